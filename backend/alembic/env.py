@@ -13,7 +13,7 @@ sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 # Импортируем наши модели и настройки
 from app.database import Base
 from app.config import settings
-from app.models import rate, usage_event, iap_receipt, push_token  # noqa
+from app.models import rate, rate_history, usage_event, usage_rollup, iap_receipt, push_token  # noqa
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -0,0 +1,33 @@
+"""Add receipt hash, data and environment to iap_receipts
+
+Revision ID: add_iap_receipt_cache_fields
+Revises: partition_usage_events
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_iap_receipt_cache_fields'
+down_revision: Union[str, Sequence[str], None] = 'partition_usage_events'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('iap_receipts', sa.Column('receipt_hash', sa.String(length=64), nullable=True))
+    op.add_column('iap_receipts', sa.Column('receipt_data', sa.Text(), nullable=True))
+    op.add_column('iap_receipts', sa.Column('environment', sa.String(length=16), nullable=True))
+    op.create_index(op.f('ix_iap_receipts_receipt_hash'), 'iap_receipts', ['receipt_hash'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_iap_receipts_receipt_hash'), table_name='iap_receipts')
+    op.drop_column('iap_receipts', 'environment')
+    op.drop_column('iap_receipts', 'receipt_data')
+    op.drop_column('iap_receipts', 'receipt_hash')
@@ -0,0 +1,27 @@
+"""Add index on iap_receipts.expires_at
+
+Revision ID: add_iap_receipts_expires_at_index
+Revises: add_iap_receipt_cache_fields
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_iap_receipts_expires_at_index'
+down_revision: Union[str, Sequence[str], None] = 'add_iap_receipt_cache_fields'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(op.f('ix_iap_receipts_expires_at'), 'iap_receipts', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_iap_receipts_expires_at'), table_name='iap_receipts')
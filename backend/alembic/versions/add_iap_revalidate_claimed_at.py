@@ -0,0 +1,27 @@
+"""Add revalidate_claimed_at to iap_receipts
+
+Revision ID: add_iap_revalidate_claimed_at
+Revises: add_rate_alerts_table
+Create Date: 2026-10-18 23:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_iap_revalidate_claimed_at'
+down_revision: Union[str, Sequence[str], None] = 'add_rate_alerts_table'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('iap_receipts', sa.Column('revalidate_claimed_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('iap_receipts', 'revalidate_claimed_at')
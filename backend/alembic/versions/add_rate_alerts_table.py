@@ -0,0 +1,50 @@
+"""Add rate alerts table
+
+Revision ID: add_rate_alerts_table
+Revises: add_iap_receipts_expires_at_index
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_rate_alerts_table'
+down_revision: Union[str, Sequence[str], None] = 'add_iap_receipts_expires_at_index'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('rate_alerts',
+    sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+    sa.Column('device_id', sa.UUID(), nullable=False),
+    sa.Column('base', sa.String(length=3), nullable=False),
+    sa.Column('quote', sa.String(length=3), nullable=False),
+    sa.Column('direction', sa.String(length=5), nullable=False),
+    sa.Column('threshold', sa.Numeric(precision=18, scale=6), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=False),
+    sa.Column('triggered_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('triggered_rate', sa.Numeric(precision=18, scale=6), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_rate_alerts_device_id'), 'rate_alerts', ['device_id'], unique=False)
+    op.create_index(
+        'ix_rate_alerts_pending_above', 'rate_alerts', ['base', 'quote', 'threshold'], unique=False,
+        postgresql_where=sa.text("triggered_at IS NULL AND direction = 'above'")
+    )
+    op.create_index(
+        'ix_rate_alerts_pending_below', 'rate_alerts', ['base', 'quote', 'threshold'], unique=False,
+        postgresql_where=sa.text("triggered_at IS NULL AND direction = 'below'")
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_rate_alerts_pending_below', table_name='rate_alerts')
+    op.drop_index('ix_rate_alerts_pending_above', table_name='rate_alerts')
+    op.drop_index(op.f('ix_rate_alerts_device_id'), table_name='rate_alerts')
+    op.drop_table('rate_alerts')
@@ -0,0 +1,38 @@
+"""Add rate_history table
+
+Revision ID: add_rate_history_table
+Revises: add_name_field_to_rates
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_rate_history_table'
+down_revision: Union[str, Sequence[str], None] = 'add_name_field_to_rates'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('rate_history',
+    sa.Column('code', sa.String(length=3), nullable=False),
+    sa.Column('recorded_at', sa.DateTime(timezone=True), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=False),
+    sa.Column('value', sa.Numeric(precision=18, scale=6), nullable=False),
+    sa.PrimaryKeyConstraint('code', 'recorded_at')
+    )
+    # BRIN-индекс: история пишется в порядке времени, индекс занимает считанные страницы
+    op.create_index('ix_rate_history_recorded_at_brin', 'rate_history', ['recorded_at'], unique=False, postgresql_using='brin')
+    
+    # Стартовая точка истории — текущие курсы
+    op.execute("INSERT INTO rate_history (code, recorded_at, value) SELECT code, updated_at, value FROM rates")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_rate_history_recorded_at_brin', table_name='rate_history')
+    op.drop_table('rate_history')
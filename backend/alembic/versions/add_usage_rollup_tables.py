@@ -0,0 +1,46 @@
+"""Add usage rollup tables
+
+Revision ID: add_usage_rollup_tables
+Revises: add_rate_history_table
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_usage_rollup_tables'
+down_revision: Union[str, Sequence[str], None] = 'add_rate_history_table'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('usage_events_hourly',
+    sa.Column('bucket', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('event_name', sa.String(length=64), nullable=False),
+    sa.Column('events', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('bucket', 'event_name')
+    )
+    op.create_table('usage_daily_devices',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('device_id', sa.UUID(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'device_id')
+    )
+    op.create_table('rollup_state',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('last_event_id', sa.BigInteger(), nullable=False),
+    sa.Column('pending_event_id', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('rollup_state')
+    op.drop_table('usage_daily_devices')
+    op.drop_table('usage_events_hourly')
@@ -0,0 +1,111 @@
+"""Partition usage_events by month
+
+Revision ID: partition_usage_events
+Revises: add_usage_rollup_tables
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'partition_usage_events'
+down_revision: Union[str, Sequence[str], None] = 'add_usage_rollup_tables'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Месячные секции от первого события (но не старше 24 месяцев) до +3 месяцев
+# вперед. События старше попадают в секцию по умолчанию.
+CREATE_MONTHLY_PARTITIONS = """
+DO $$
+DECLARE
+    month timestamp;
+    last_month timestamp := date_trunc('month', NOW() AT TIME ZONE 'UTC') + interval '3 months';
+BEGIN
+    SELECT GREATEST(
+        COALESCE(date_trunc('month', MIN(created_at) AT TIME ZONE 'UTC'), date_trunc('month', NOW() AT TIME ZONE 'UTC')),
+        date_trunc('month', NOW() AT TIME ZONE 'UTC') - interval '24 months'
+    )
+    INTO month
+    FROM usage_events_unpartitioned;
+
+    WHILE month <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF usage_events FOR VALUES FROM (%L) TO (%L)',
+            'usage_events_p' || to_char(month, 'YYYY_MM'),
+            to_char(month, 'YYYY-MM-DD') || ' 00:00:00+00',
+            to_char(month + interval '1 month', 'YYYY-MM-DD') || ' 00:00:00+00'
+        );
+        month := month + interval '1 month';
+    END LOOP;
+END
+$$
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("ALTER TABLE usage_events RENAME TO usage_events_unpartitioned")
+    op.execute("ALTER INDEX usage_events_pkey RENAME TO usage_events_unpartitioned_pkey")
+    op.execute("ALTER INDEX ix_usage_events_device_id RENAME TO ix_usage_events_unpartitioned_device_id")
+    op.execute("ALTER INDEX ix_usage_events_event_name RENAME TO ix_usage_events_unpartitioned_event_name")
+
+    # Ключ секционирования должен входить в первичный ключ, поэтому PK — (id, created_at).
+    # Последовательность id сохраняется: на ней основан водяной знак агрегатов.
+    op.execute("""
+        CREATE TABLE usage_events (
+            id INTEGER NOT NULL DEFAULT nextval('usage_events_id_seq'),
+            device_id UUID NOT NULL,
+            event_name VARCHAR(64) NOT NULL,
+            payload JSONB,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    op.execute("ALTER SEQUENCE usage_events_id_seq OWNED BY usage_events.id")
+    op.create_index(op.f('ix_usage_events_device_id'), 'usage_events', ['device_id'], unique=False)
+    op.create_index(op.f('ix_usage_events_event_name'), 'usage_events', ['event_name'], unique=False)
+    op.create_index('ix_usage_events_created_at_brin', 'usage_events', ['created_at'], unique=False, postgresql_using='brin')
+
+    op.execute("CREATE TABLE usage_events_default PARTITION OF usage_events DEFAULT")
+    op.execute(CREATE_MONTHLY_PARTITIONS)
+
+    op.execute("""
+        INSERT INTO usage_events (id, device_id, event_name, payload, created_at)
+        SELECT id, device_id, event_name, payload, created_at
+        FROM usage_events_unpartitioned
+    """)
+    op.drop_table('usage_events_unpartitioned')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("ALTER TABLE usage_events RENAME TO usage_events_partitioned")
+    op.execute("ALTER INDEX usage_events_pkey RENAME TO usage_events_partitioned_pkey")
+    op.execute("ALTER INDEX ix_usage_events_device_id RENAME TO ix_usage_events_partitioned_device_id")
+    op.execute("ALTER INDEX ix_usage_events_event_name RENAME TO ix_usage_events_partitioned_event_name")
+
+    op.execute("""
+        CREATE TABLE usage_events (
+            id INTEGER NOT NULL DEFAULT nextval('usage_events_id_seq'),
+            device_id UUID NOT NULL,
+            event_name VARCHAR(64) NOT NULL,
+            payload JSONB,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id)
+        )
+    """)
+    op.execute("ALTER SEQUENCE usage_events_id_seq OWNED BY usage_events.id")
+    op.create_index(op.f('ix_usage_events_device_id'), 'usage_events', ['device_id'], unique=False)
+    op.create_index(op.f('ix_usage_events_event_name'), 'usage_events', ['event_name'], unique=False)
+
+    op.execute("""
+        INSERT INTO usage_events (id, device_id, event_name, payload, created_at)
+        SELECT id, device_id, event_name, payload, created_at
+        FROM usage_events_partitioned
+    """)
+    # Секции удаляются вместе с родительской таблицей
+    op.drop_table('usage_events_partitioned')
@@ -15,6 +15,27 @@ class Settings(BaseSettings):
     rates_api_url: str = "https://openexchangerates.org/api/latest.json"
     rates_api_key: Optional[str] = None
     
+    # Источники курсов (опрашиваются одновременно, см. rate_providers)
+    # В порядке приоритета: openexchangerates, cbr, ecb, file, mock. Курсы берутся у первого
+    # корректно ответившего источника, поэтому обновление ждет основной источник (до
+    # rates_provider_timeout_seconds), даже если резервный ответил раньше. Если ни один
+    # источник не настроен, используются тестовые курсы (mock)
+    rates_providers: str = "openexchangerates,cbr"
+    rates_cbr_url: str = "https://www.cbr.ru/scripts/XML_daily.asp"
+    rates_ecb_url: str = "https://www.ecb.europa.eu/stats/eurofxref/eurofxref-daily.xml"
+    rates_file_path: Optional[str] = None  # JSON {"base": "RUB", "rates": {...}} для разработки и тестов
+    rates_provider_timeout_seconds: float = 10.0
+    rates_provider_quorum: int = 1  # сколько источников должны совпасть, 1 - первый корректный ответ
+    rates_provider_tolerance: float = 0.02  # допустимое расхождение курсов источников
+    rates_provider_min_currencies: int = 5  # меньше валют в ответе - ответ некорректен
+    rates_provider_failure_threshold: int = 3  # ошибок подряд до размыкания цепи
+    rates_provider_reset_timeout_seconds: float = 1800.0  # пауза перед пробным запросом
+    
+    # Пул HTTP-соединений к внешним API (общие клиенты процесса)
+    http_timeout_seconds: float = 30.0
+    http_keepalive_expiry_seconds: float = 60.0  # сколько держать простаивающее соединение
+    http2_enabled: bool = True
+    
     # Безопасность
     admin_token: str = "your-secret-admin-token"
     
@@ -22,13 +43,78 @@ class Settings(BaseSettings):
     apns_key: Optional[str] = None
     apns_key_id: Optional[str] = None
     apns_team_id: Optional[str] = None
+    apns_topic: str = "com.azg.Convertik"  # bundle id приложения
+    apns_url: str = "https://api.push.apple.com"  # sandbox: https://api.sandbox.push.apple.com
+    push_send_concurrency: int = 500  # одновременных запросов к APNs (потоки HTTP/2)
+    push_stream_batch_size: int = 1000  # строк push_tokens за одно чтение курсора
+    push_prune_batch_size: int = 500  # недействительных токенов за один DELETE
+    push_job_ttl_seconds: int = 86400  # сколько хранить состояние рассылки в Redis
+    push_job_progress_interval_seconds: float = 5.0  # как часто записывать ход рассылки в Redis
+    push_queue_batch_size: int = 500  # адресных уведомлений за одну выборку токенов
+    push_queue_flush_interval_seconds: float = 1.0
+    push_queue_max_messages: int = 100000  # лимит очереди адресных уведомлений на воркер
+    push_queue_max_attempts: int = 5  # попыток отправки пачки, после которых сообщения отбрасываются
+    
+    # Подписки на курсы (уведомление при достижении порога)
+    rate_alerts_max_per_device: int = 20  # несработавших подписок на устройство
     
     # App Store Receipt Verification
     app_store_shared_secret: Optional[str] = None
+    iap_verify_cache_seconds: int = 21600  # сколько доверять сохраненному статусу без запроса к Apple
+    iap_revalidate_interval_minutes: int = 15  # фоновая перепроверка подписок
+    iap_revalidate_ahead_hours: int = 48  # перепроверять подписки, истекающие в этом окне
+    iap_revalidate_grace_hours: int = 72  # и истекшие не раньше (продление могло пройти позже)
+    iap_revalidate_min_interval_minutes: int = 60  # не чаще для одной квитанции
+    iap_revalidate_batch_size: int = 200  # квитанций за один запуск
+    iap_revalidate_concurrency: int = 5  # одновременных запросов к Apple
+    iap_revalidate_rate_per_second: float = 10.0  # запросов к Apple в секунду
     
     # Rate Limiting (Free Plan: 900 requests/month)
-    rates_update_interval_minutes: int = 60  # минимум 1 час между запросами к API
+    rates_update_interval_minutes: int = 60  # интервал без квоты или если расход квоты неизвестен
     rates_check_interval_minutes: int = 30   # проверка каждые 30 минут
+    rates_quota_monthly_requests: int = 900  # квота openexchangerates, 0 - без ограничения
+    rates_quota_reserve_requests: int = 30  # остаток квоты только для принудительного обновления
+    rates_min_interval_minutes: int = 30  # чаще не обновлять, даже если квоты хватает
+    rates_retry_base_seconds: float = 60.0  # пауза после первой ошибки, дальше удваивается
+    rates_retry_max_seconds: float = 1800.0
+    rates_refresh_failure_threshold: int = 5  # ошибок обновления подряд до размыкания цепи
+    rates_refresh_reset_timeout_seconds: float = 3600.0
+    
+    # In-process снапшот ответа /rates (обновляется сразу после commit курсов)
+    rates_snapshot_ttl_seconds: int = 60
+    rates_http_max_age_seconds: int = 300  # Cache-Control для /rates и /currency-names
+    rates_snapshot_history_size: int = 48  # сколько версий курсов хранить для дельт
+    rates_cache_lock_enabled: bool = True  # блокировка пересборки кэша в Redis между воркерами
+    rates_cache_lock_ttl_ms: int = 5000
+    rates_cache_lock_wait_ms: int = 2000  # сколько ждать пересборки другим воркером
+    
+    # Поток обновлений курсов (/rates/stream, /rates/ws)
+    rates_stream_keepalive_seconds: float = 25.0  # keepalive для прокси и обнаружения разрывов
+    rates_stream_max_connections: int = 20000  # подключений на воркер
+    rates_stream_retry_ms: int = 5000  # пауза перед переподключением EventSource
+    
+    # Очередь записи событий аналитики (POST /stats)
+    stats_ingest_batch_size: int = 1000  # событий в одном INSERT
+    stats_ingest_flush_interval_seconds: float = 2.0
+    stats_ingest_max_events: int = 50000  # лимит буфера на воркер
+    
+    # Агрегаты событий аналитики для /stats/metrics
+    stats_rollup_interval_minutes: int = 5
+    stats_hll_retention_days: int = 400  # срок хранения дневных HyperLogLog-скетчей устройств
+
+    # Месячные секции usage_events
+    stats_partitions_ahead_months: int = 3  # сколько будущих секций держать созданными
+    stats_events_retention_months: int = 0  # 0 - хранить всегда; N - удалять события старше N месяцев (необратимо)
+
+    # Кэш результатов /stats/summary и /stats/metrics
+    stats_cache_bucket_seconds: int = 60  # окна округляются до интервала
+    stats_cache_live_ttl_seconds: int = 60  # окна, захватывающие текущий момент
+    stats_cache_closed_ttl_seconds: int = 86400  # закрытые исторические окна
+    stats_cache_settle_seconds: int = 900  # окно закрыто, если его конец старше (с учетом задержки агрегатов)
+    
+    # Фоновый сбор системных метрик (/api/v1/metrics)
+    metrics_sample_interval_seconds: int = 10
+    metrics_history_size: int = 360  # 1 час при интервале 10 секунд
     
     # Приложение
     app_name: str = "Convertik API"
@@ -1,9 +1,11 @@
 """Конфигурация базы данных и Redis"""
 
+from sqlalchemy import event, text
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 import redis.asyncio as redis
 from .config import settings
+from .utils.prometheus import DB_QUERIES
 
 
 # SQLAlchemy Base класс
@@ -18,6 +20,14 @@ engine = create_async_engine(
     future=True,
 )
 
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    """Считает SQL запросы по типу (SELECT, INSERT, WITH, ...)"""
+    words = statement.split(None, 1)
+    DB_QUERIES.labels(statement=words[0].upper() if words else "UNKNOWN").inc()
+
+
 # Фабрика для создания async сессий
 async_sessionmaker = async_sessionmaker(
     engine,
@@ -51,10 +61,14 @@ async def init_db():
     """Инициализация базы данных (создание таблиц)"""
     async with engine.begin() as conn:
         # Импортируем все модели чтобы они были зарегистрированы
-        from .models import rate, usage_event, iap_receipt, push_token  # noqa
+        from .models import rate, rate_history, usage_event, usage_rollup, iap_receipt, push_token  # noqa
         
         # Создаем все таблицы
         await conn.run_sync(Base.metadata.create_all)
+        
+        # Секция по умолчанию для usage_events, чтобы вставка работала
+        # до первого запуска задачи управления секциями
+        await conn.execute(text("CREATE TABLE IF NOT EXISTS usage_events_default PARTITION OF usage_events DEFAULT"))
 
 
 async def close_db():
@@ -6,6 +6,7 @@ import time
 from contextlib import asynccontextmanager
 
 from .config import settings
+from .utils.prometheus import HTTP_REQUEST_DURATION, HTTP_REQUESTS_IN_FLIGHT, mark_process_dead
 
 
 # Настройка логирования
@@ -36,15 +37,58 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting Convertik API", version=settings.app_version)
 
+    # Общие HTTP-клиенты внешних API (до планировщика: он сразу обновляет курсы)
+    from .utils.http_clients import http_clients
+    await http_clients.start()
+
     # Запускаем планировщик задач
     from .tasks.scheduler import task_scheduler
     await task_scheduler.start()
 
+    # Запускаем фоновый сбор системных метрик
+    from .tasks.metrics_sampler import metrics_sampler
+    await metrics_sampler.start()
+
+    # Запускаем очередь записи событий аналитики
+    from .services.stats_ingest import stats_ingest_queue
+    await stats_ingest_queue.start()
+
+    # Запускаем очередь адресных push-уведомлений (алерты курсов)
+    from .services.push_service import push_dispatcher, push_queue
+    await push_queue.start()
+
+    # Индекс Premium-статуса устройств для /iap/status
+    from .services.premium_index import PREMIUM_UPDATED_CHANNEL, handle_premium_updated, premium_index
+    try:
+        await premium_index.load()
+    except Exception as e:
+        logger.error("Failed to load premium index", error=str(e))
+
+    # Подписываемся на обновления курсов и подписок от других воркеров
+    from .services.pubsub import pubsub_listener
+    from .services.rates_service import handle_rates_updated
+    from .services.rates_snapshot import RATES_UPDATED_CHANNEL
+    from .services.rates_stream import rates_broadcaster
+    pubsub_listener.subscribe(RATES_UPDATED_CHANNEL, handle_rates_updated)
+    # После handle_rates_updated: рассылается уже загруженный снапшот
+    pubsub_listener.subscribe(RATES_UPDATED_CHANNEL, rates_broadcaster.handle_rates_updated)
+    pubsub_listener.subscribe(PREMIUM_UPDATED_CHANNEL, handle_premium_updated)
+    await rates_broadcaster.start()
+    await pubsub_listener.start()
+
     yield
 
     # Shutdown
     logger.info("Shutting down Convertik API")
+    await pubsub_listener.stop()
+    await rates_broadcaster.stop()
+    await push_dispatcher.stop()
+    await push_queue.stop()
+    await stats_ingest_queue.stop()
+    await metrics_sampler.stop()
     await task_scheduler.stop()
+    await http_clients.close()
+    mark_process_dead()
 
 
 # Создание FastAPI приложения
@@ -69,7 +113,7 @@ app.add_middleware(
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    """Middleware для логирования запросов"""
+    """Middleware для логирования запросов и сбора латентности по роутам"""
     start_time = time.time()
 
     # Логируем входящий запрос
@@ -81,10 +125,24 @@ async def log_requests(request: Request, call_next):
         user_agent=request.headers.get("user-agent")
     )
 
-    response = await call_next(request)
+    in_flight = HTTP_REQUESTS_IN_FLIGHT.labels(method=request.method)
+    in_flight.inc()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        in_flight.dec()
+        process_time = time.time() - start_time
+        # Шаблон роута (/api/v1/rates/{currency_code}) вместо URL, чтобы не плодить метки
+        route = request.scope.get("route")
+        HTTP_REQUEST_DURATION.labels(
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=str(status_code)
+        ).observe(process_time)
 
     # Логируем ответ
-    process_time = time.time() - start_time
     logger.info(
         "Request completed",
         method=request.method,
@@ -140,14 +198,17 @@ async def health_check():
 
 
 # Импорт роутов
-from .routes import rates_router, stats_router, admin_router, iap_router
+from .routes import rates_router, stats_router, admin_router, iap_router, convert_router, push_router, alerts_router
 from .routes.metrics import router as metrics_router
 
 # Подключение роутов
 app.include_router(rates_router, prefix="/api/v1", tags=["rates"])
+app.include_router(convert_router, prefix="/api/v1", tags=["rates"])
 app.include_router(stats_router, prefix="/api/v1", tags=["stats"])
 app.include_router(admin_router, prefix="/api/v1", tags=["admin"])
 app.include_router(iap_router, prefix="/api/v1", tags=["iap"])
+app.include_router(push_router, prefix="/api/v1", tags=["push"])
+app.include_router(alerts_router, prefix="/api/v1", tags=["alerts"])
 app.include_router(metrics_router, prefix="/api/v1", tags=["metrics"])
 
 
@@ -1,8 +1,11 @@
 """Модели базы данных"""
 
 from .rate import Rate
+from .rate_history import RateHistory
 from .usage_event import UsageEvent
+from .usage_rollup import UsageEventHourly, UsageDailyDevice, RollupState
 from .iap_receipt import IAPReceipt
 from .push_token import PushToken
+from .rate_alert import RateAlert
 
-__all__ = ["Rate", "UsageEvent", "IAPReceipt", "PushToken"]
+__all__ = ["Rate", "RateHistory", "UsageEvent", "UsageEventHourly", "UsageDailyDevice", "RollupState", "IAPReceipt", "PushToken", "RateAlert"]
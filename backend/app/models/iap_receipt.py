@@ -1,6 +1,6 @@
 """Модель квитанций IAP (In-App Purchase)"""
 
-from sqlalchemy import Column, String, DateTime, func
+from sqlalchemy import Column, String, Text, DateTime, func
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import text
 from ..database import Base
@@ -13,7 +13,7 @@ class IAPReceipt(Base):
     original_tx_id = Column(String, primary_key=True)  # Уникальный ID покупки от Apple
     device_id = Column(UUID(as_uuid=True), nullable=False, index=True)  # Ссылка на устройство
     product_id = Column(String, nullable=False)  # SKU подписки (например, convertik_premium_month)
-    expires_at = Column(DateTime(timezone=True), nullable=False)  # Дата окончания подписки
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)  # Дата окончания подписки
     last_check = Column(
         DateTime(timezone=True), 
         nullable=False,
@@ -21,6 +21,10 @@ class IAPReceipt(Base):
         onupdate=func.now(),
         server_default=text('CURRENT_TIMESTAMP')
     )  # Последняя валидация квитанции
+    receipt_hash = Column(String(64), nullable=True, index=True)  # SHA-256 последней квитанции
+    receipt_data = Column(Text, nullable=True)  # Последняя квитанция (для повторной проверки)
+    environment = Column(String(16), nullable=True)  # production / sandbox
+    revalidate_claimed_at = Column(DateTime(timezone=True), nullable=True)  # Когда фоновая перепроверка забрала квитанцию
 
     def __repr__(self):
-        return f"<IAPReceipt(tx_id='{self.original_tx_id}', product='{self.product_id}')>"
\ No newline at end of file
+        return f"<IAPReceipt(tx_id='{self.original_tx_id}', product='{self.product_id}')>"
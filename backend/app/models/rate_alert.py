@@ -0,0 +1,49 @@
+"""Модель подписок на изменение курса"""
+
+from sqlalchemy import BigInteger, Column, String, Numeric, DateTime, Index, func
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql import text
+from ..database import Base
+
+
+class RateAlert(Base):
+    """
+    Подписка устройства на пересечение курсом пары порога
+
+    Срабатывает один раз: когда курс base/quote поднимается до threshold
+    (direction="above") или опускается до него (direction="below"),
+    заполняются triggered_at и triggered_rate. Частичные индексы по
+    (base, quote, threshold) содержат только несработавшие подписки своего
+    направления, поэтому сработавшие находятся range-сканом по паре.
+    """
+    __tablename__ = "rate_alerts"
+    __table_args__ = (
+        Index(
+            "ix_rate_alerts_pending_above",
+            "base", "quote", "threshold",
+            postgresql_where=text("triggered_at IS NULL AND direction = 'above'"),
+        ),
+        Index(
+            "ix_rate_alerts_pending_below",
+            "base", "quote", "threshold",
+            postgresql_where=text("triggered_at IS NULL AND direction = 'below'"),
+        ),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    device_id = Column(UUID(as_uuid=True), nullable=False, index=True)  # Анонимный UUID клиента
+    base = Column(String(3), nullable=False)  # Валюта, курс которой отслеживается (USD в USD/RUB)
+    quote = Column(String(3), nullable=False)  # Валюта котировки (RUB в USD/RUB)
+    direction = Column(String(5), nullable=False)  # "above" или "below"
+    threshold = Column(Numeric(18, 6), nullable=False)  # Порог: сколько quote за 1 base
+    created_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=func.now(),
+        server_default=text('CURRENT_TIMESTAMP')
+    )
+    triggered_at = Column(DateTime(timezone=True), nullable=True)  # Время срабатывания
+    triggered_rate = Column(Numeric(18, 6), nullable=True)  # Курс на момент срабатывания
+
+    def __repr__(self):
+        return f"<RateAlert(id={self.id}, pair='{self.base}/{self.quote}', {self.direction} {self.threshold})>"
@@ -0,0 +1,31 @@
+"""Модель истории курсов валют"""
+
+from sqlalchemy import Column, String, Numeric, DateTime, Index, func
+from sqlalchemy.sql import text
+from ..database import Base
+
+
+class RateHistory(Base):
+    """
+    Append-only история курсов валют
+
+    Одна строка на валюту за каждое обновление курсов. Первичный ключ
+    (code, recorded_at) служит индексом для диапазонных запросов по валюте,
+    BRIN-индекс по recorded_at — компактный индекс для сканов по времени.
+    """
+    __tablename__ = "rate_history"
+    __table_args__ = (
+        Index("ix_rate_history_recorded_at_brin", "recorded_at", postgresql_using="brin"),
+    )
+    
+    code = Column(String(3), primary_key=True)  # ISO код валюты
+    recorded_at = Column(
+        DateTime(timezone=True), 
+        primary_key=True,
+        default=func.now(),
+        server_default=text('CURRENT_TIMESTAMP')
+    )  # Время обновления курсов
+    value = Column(Numeric(18, 6), nullable=False)  # Значение курса на момент обновления
+
+    def __repr__(self):
+        return f"<RateHistory(code='{self.code}', recorded_at='{self.recorded_at}', value={self.value})>"
@@ -1,6 +1,6 @@
 """Модель событий аналитики"""
 
-from sqlalchemy import Column, Integer, String, DateTime, func
+from sqlalchemy import Column, Integer, String, DateTime, Index, func
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.sql import text
 import uuid
@@ -8,8 +8,19 @@ from ..database import Base
 
 
 class UsageEvent(Base):
-    """Модель событий пользователя для аналитики"""
+    """
+    Модель событий пользователя для аналитики
+
+    Таблица секционирована по месяцам (RANGE по created_at), поэтому
+    created_at входит в первичный ключ. Секции создаются и удаляются
+    фоновой задачей (см. services/event_partitions.py), события вне
+    созданных секций попадают в секцию по умолчанию.
+    """
     __tablename__ = "usage_events"
+    __table_args__ = (
+        Index("ix_usage_events_created_at_brin", "created_at", postgresql_using="brin"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     device_id = Column(UUID(as_uuid=True), nullable=False, index=True)  # Анонимный UUID клиента
@@ -17,10 +28,11 @@ class UsageEvent(Base):
     payload = Column(JSONB, nullable=True)  # Параметры события в JSON формате
     created_at = Column(
         DateTime(timezone=True), 
-        nullable=False,
+        primary_key=True,
         default=func.now(),
         server_default=text('CURRENT_TIMESTAMP')
     )
 
     def __repr__(self):
-        return f"<UsageEvent(device_id='{self.device_id}', event='{self.event_name}')>"
\ No newline at end of file
+        return f"<UsageEvent(device_id='{self.device_id}', event='{self.event_name}')>"
+
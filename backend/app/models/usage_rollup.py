@@ -0,0 +1,48 @@
+"""Модели агрегатов событий аналитики"""
+
+from sqlalchemy import Column, String, BigInteger, Date, DateTime, func
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql import text
+from ..database import Base
+
+
+class UsageEventHourly(Base):
+    """Количество событий за час по названию события"""
+    __tablename__ = "usage_events_hourly"
+    
+    bucket = Column(DateTime(timezone=True), primary_key=True)  # Начало часа (UTC)
+    event_name = Column(String(64), primary_key=True)
+    events = Column(BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<UsageEventHourly(bucket='{self.bucket}', event='{self.event_name}', events={self.events})>"
+
+
+class UsageDailyDevice(Base):
+    """Множество активных устройств за день (UTC)"""
+    __tablename__ = "usage_daily_devices"
+    
+    day = Column(Date, primary_key=True)
+    device_id = Column(UUID(as_uuid=True), primary_key=True)
+
+    def __repr__(self):
+        return f"<UsageDailyDevice(day='{self.day}', device_id='{self.device_id}')>"
+
+
+class RollupState(Base):
+    """Водяные знаки инкрементального пересчета агрегатов"""
+    __tablename__ = "rollup_state"
+    
+    name = Column(String(64), primary_key=True)
+    last_event_id = Column(BigInteger, nullable=False, default=0)  # Последний учтенный id события
+    pending_event_id = Column(BigInteger, nullable=False, default=0)  # Максимальный id на прошлом запуске
+    updated_at = Column(
+        DateTime(timezone=True), 
+        nullable=False,
+        default=func.now(),
+        onupdate=func.now(),
+        server_default=text('CURRENT_TIMESTAMP')
+    )
+
+    def __repr__(self):
+        return f"<RollupState(name='{self.name}', last_event_id={self.last_event_id})>"
@@ -4,5 +4,8 @@ from .rates import router as rates_router
 from .stats import router as stats_router
 from .admin import router as admin_router
 from .iap import router as iap_router
+from .convert import router as convert_router
+from .push import router as push_router
+from .alerts import router as alerts_router
 
-__all__ = ["rates_router", "stats_router", "admin_router", "iap_router"]
+__all__ = ["rates_router", "stats_router", "admin_router", "iap_router", "convert_router", "push_router", "alerts_router"]
@@ -5,7 +5,16 @@ from typing import Optional
 import structlog
 
 from ..config import settings
+from ..schemas import PushJobResponse, PushSendRequest
 from ..tasks.scheduler import task_scheduler
+from ..services.apns import APNsConfigurationError
+from ..services.push_service import (
+    SUPPORTED_PLATFORMS,
+    PushJob,
+    PushSegment,
+    build_apns_payload,
+    push_dispatcher,
+)
 from ..services.rates_service import rates_service
 
 logger = structlog.get_logger()
@@ -79,4 +88,87 @@ async def get_rates_stats(admin_check=Depends(verify_admin_token)) -> dict:
                 "message": "Failed to get rates statistics",
                 "details": {"error": str(e)}
             }
-        )
\ No newline at end of file
+        )
+
+
+def _push_job_response(job: PushJob) -> PushJobResponse:
+    return PushJobResponse(
+        job_id=job.job_id,
+        status=job.status,
+        matched=job.matched,
+        sent=job.sent,
+        failed=job.failed,
+        pruned=job.pruned,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+        error=job.error,
+    )
+
+
+@router.post("/admin/push/send", response_model=PushJobResponse, status_code=202)
+async def send_push(
+    request: PushSendRequest,
+    admin_check=Depends(verify_admin_token)
+) -> PushJobResponse:
+    """
+    Запустить рассылку push-уведомления по сегменту
+
+    Рассылка выполняется в фоне текущего воркера, ход виден через
+    GET /admin/push/jobs/{job_id} на любом воркере (состояние хранится
+    в Redis push_job_ttl_seconds).
+    """
+    if request.platform and request.platform not in SUPPORTED_PLATFORMS:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "code": 400,
+                "message": "Push delivery is not supported for this platform",
+                "details": {"platform": request.platform, "supported": list(SUPPORTED_PLATFORMS)}
+            }
+        )
+
+    segment = PushSegment(
+        premium={"premium": True, "free": False}.get(request.segment),
+        locale=request.locale,
+        platform=request.platform,
+        app_version=request.app_version,
+    )
+    try:
+        job = await push_dispatcher.start(
+            segment,
+            build_apns_payload(request.message, request.title, request.payload)
+        )
+    except APNsConfigurationError as e:
+        logger.error("APNs is not configured", error=str(e))
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "code": 503,
+                "message": "Push notifications are not configured",
+                "details": {"error": str(e)}
+            }
+        )
+
+    logger.info("Push send requested by admin", job_id=job.job_id)
+    return _push_job_response(job)
+
+
+@router.get("/admin/push/jobs/{job_id}", response_model=PushJobResponse)
+async def get_push_job(job_id: str, admin_check=Depends(verify_admin_token)) -> PushJobResponse:
+    """
+    Получить состояние рассылки push-уведомлений
+
+    Ход рассылки, запущенной на другом воркере, обновляется раз в
+    push_job_progress_interval_seconds.
+    """
+    job = await push_dispatcher.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "code": 404,
+                "message": "Push job not found",
+                "details": {"job_id": job_id}
+            }
+        )
+    return _push_job_response(job)
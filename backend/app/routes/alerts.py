@@ -0,0 +1,129 @@
+"""API роуты подписок на курсы валют"""
+
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+import structlog
+import uuid
+
+from ..config import settings
+from ..database import get_db
+from ..models.rate_alert import RateAlert
+from ..schemas import RateAlertCreate, RateAlertResponse
+from ..services.rate_alerts import alert_reached
+from .convert import _get_matrix
+
+logger = structlog.get_logger()
+router = APIRouter()
+
+
+@router.post("/alerts", response_model=RateAlertResponse, status_code=201)
+async def create_alert(
+    request: RateAlertCreate,
+    db: AsyncSession = Depends(get_db)
+) -> RateAlertResponse:
+    """
+    Подписаться на достижение курсом пары порога
+
+    Подписка срабатывает один раз после обновления курсов, на котором курс
+    base/quote достиг threshold, и устройство получает push-уведомление.
+    Порог, который курс уже прошел, отклоняется: такая подписка сработала
+    бы сразу.
+    """
+    base = request.base.upper()
+    quote = request.quote.upper()
+
+    rate = (await _get_matrix(db)).rate(base, quote)
+    if rate is None:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "code": 404,
+                "message": "Currency rate not found",
+                "details": {"base": base, "quote": quote}
+            }
+        )
+    if alert_reached(request.direction, request.threshold, rate):
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "code": 400,
+                "message": "Threshold is already reached",
+                "details": {"current_rate": rate}
+            }
+        )
+
+    active = await db.scalar(
+        select(func.count()).select_from(RateAlert).where(
+            RateAlert.device_id == request.device_id,
+            RateAlert.triggered_at.is_(None),
+        )
+    )
+    if active >= settings.rate_alerts_max_per_device:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "code": 400,
+                "message": "Too many active alerts",
+                "details": {"limit": settings.rate_alerts_max_per_device}
+            }
+        )
+
+    alert = RateAlert(
+        device_id=request.device_id,
+        base=base,
+        quote=quote,
+        direction=request.direction,
+        threshold=request.threshold,
+    )
+    db.add(alert)
+    await db.commit()
+    await db.refresh(alert)
+
+    logger.info(
+        "Rate alert created",
+        device_id=str(request.device_id),
+        pair=f"{base}/{quote}",
+        direction=request.direction,
+        threshold=request.threshold
+    )
+    return RateAlertResponse.model_validate(alert)
+
+
+@router.get("/alerts/{device_id}", response_model=List[RateAlertResponse])
+async def list_alerts(
+    device_id: uuid.UUID,
+    db: AsyncSession = Depends(get_db)
+) -> List[RateAlertResponse]:
+    """Подписки устройства, новые первыми"""
+    result = await db.execute(
+        select(RateAlert)
+        .where(RateAlert.device_id == device_id)
+        .order_by(RateAlert.created_at.desc())
+    )
+    return [RateAlertResponse.model_validate(alert) for alert in result.scalars().all()]
+
+
+@router.delete("/alerts/{alert_id}")
+async def delete_alert(
+    alert_id: int,
+    device_id: uuid.UUID = Query(..., description="ID устройства-владельца"),
+    db: AsyncSession = Depends(get_db)
+) -> dict:
+    """Удалить подписку"""
+    result = await db.execute(
+        delete(RateAlert).where(RateAlert.id == alert_id, RateAlert.device_id == device_id)
+    )
+    await db.commit()
+    if not result.rowcount:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "code": 404,
+                "message": "Alert not found",
+                "details": {"alert_id": alert_id}
+            }
+        )
+    return {"deleted": True}
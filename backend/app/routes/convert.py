@@ -0,0 +1,134 @@
+"""API роуты для конвертации валют по кросс-курсам"""
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+import structlog
+
+from ..database import get_db
+from ..schemas import ConversionResponse, ConversionBatchRequest, ConversionBatchResponse
+from ..services.cross_rates import CrossRateMatrix, cross_rates_cache
+from ..services.rates_snapshot import RATES_SNAPSHOT_KEY, Snapshot, load_rates_snapshot, refresh_snapshot, snapshot_store
+
+logger = structlog.get_logger()
+router = APIRouter()
+
+
+async def _get_rates_snapshot(db: AsyncSession) -> Snapshot:
+    """Текущий снапшот курсов (503, если курсов еще нет)"""
+    snapshot = snapshot_store.get(RATES_SNAPSHOT_KEY)
+    if snapshot is None:
+        snapshot = await refresh_snapshot(RATES_SNAPSHOT_KEY, load_rates_snapshot, db)
+    if snapshot is None:
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "code": 503,
+                "message": "Exchange rates are not available yet",
+                "details": {}
+            }
+        )
+    return snapshot
+
+
+async def _get_matrix(db: AsyncSession) -> CrossRateMatrix:
+    return cross_rates_cache.for_snapshot(await _get_rates_snapshot(db))
+
+
+@router.get("/convert", response_model=ConversionResponse)
+async def convert(
+    from_currency: str = Query(..., alias="from", max_length=3, description="ISO код исходной валюты"),
+    to_currency: str = Query(..., alias="to", max_length=3, description="ISO код целевой валюты"),
+    amount: float = Query(1.0, ge=0, description="Сумма в исходной валюте"),
+    db: AsyncSession = Depends(get_db)
+) -> ConversionResponse:
+    """
+    Конвертировать сумму из одной валюты в другую
+    
+    Кросс-курс берется из предвычисленной матрицы (O(1) индексация).
+    """
+    from_currency = from_currency.upper()
+    to_currency = to_currency.upper()
+    
+    try:
+        matrix = await _get_matrix(db)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error loading cross rates", error=str(e), exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "code": 500,
+                "message": "Failed to convert currency",
+                "details": {"error": str(e)}
+            }
+        )
+    
+    rate = matrix.rate(from_currency, to_currency)
+    if rate is None:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "code": 404,
+                "message": "Currency rate not found",
+                "details": {"from": from_currency, "to": to_currency}
+            }
+        )
+    
+    return ConversionResponse(
+        from_currency=from_currency,
+        to_currency=to_currency,
+        amount=amount,
+        rate=rate,
+        result=rate * amount
+    )
+
+
+@router.post("/convert/batch", response_model=ConversionBatchResponse)
+async def convert_batch(
+    request: ConversionBatchRequest,
+    db: AsyncSession = Depends(get_db)
+) -> ConversionBatchResponse:
+    """
+    Пакетная конвертация нескольких пар валют
+    
+    Неизвестные валюты не прерывают запрос: для них rate и result равны null.
+    """
+    try:
+        snapshot = await _get_rates_snapshot(db)
+        matrix = cross_rates_cache.for_snapshot(snapshot)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error loading cross rates", error=str(e), exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "code": 500,
+                "message": "Failed to convert currencies",
+                "details": {"error": str(e)}
+            }
+        )
+    
+    pairs = [
+        (pair.from_currency.upper(), pair.to_currency.upper(), pair.amount)
+        for pair in request.pairs
+    ]
+    converted = matrix.convert_many(pairs) if pairs else []
+    
+    results = []
+    for (from_currency, to_currency, amount), item in zip(pairs, converted):
+        rate, result = item if item is not None else (None, None)
+        results.append(ConversionResponse(
+            from_currency=from_currency,
+            to_currency=to_currency,
+            amount=amount,
+            rate=rate,
+            result=result
+        ))
+    
+    return ConversionBatchResponse(
+        updated_at=snapshot.updated_at,
+        base=matrix.base,
+        results=results
+    )
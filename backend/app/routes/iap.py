@@ -2,70 +2,19 @@
 
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from typing import Optional
 import structlog
-import httpx
-import base64
-from datetime import datetime, timezone
+import uuid
 
 from ..database import get_db
-from ..models.iap_receipt import IAPReceipt
-from ..schemas import IAPVerifyRequest, IAPVerifyResponse
-from ..config import settings
+from ..schemas import IAPVerifyRequest, IAPVerifyResponse, IAPStatusResponse
+from ..services.iap_service import AppleUnavailableError, ReceiptRejectedError, verify_receipt
+from ..services.premium_index import premium_index
+from ..utils.prometheus import record_cache
 
 logger = structlog.get_logger()
 router = APIRouter()
 
 
-async def verify_receipt_with_apple(
-    receipt_data: str,
-    use_sandbox: bool = False
-) -> dict:
-    """
-    Проверка квитанции через Apple App Store
-    
-    Args:
-        receipt_data: Base64-encoded receipt data
-        use_sandbox: Whether to use sandbox environment
-    
-    Returns:
-        Apple's verification response
-    """
-    # Определяем URL для проверки
-    if use_sandbox:
-        verify_url = "https://sandbox.itunes.apple.com/verifyReceipt"
-    else:
-        verify_url = "https://buy.itunes.apple.com/verifyReceipt"
-    
-    # Секретный ключ для проверки (если используется)
-    verify_payload = {
-        "receipt-data": receipt_data,
-        "password": getattr(settings, "app_store_shared_secret", None),  # Опционально
-        "exclude-old-transactions": True
-    }
-    
-    try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(verify_url, json=verify_payload)
-            response.raise_for_status()
-            return response.json()
-    except httpx.HTTPError as e:
-        logger.error(
-            "Failed to verify receipt with Apple",
-            error=str(e),
-            use_sandbox=use_sandbox
-        )
-        raise HTTPException(
-            status_code=503,
-            detail={
-                "code": 503,
-                "message": "Failed to verify receipt with Apple",
-                "details": {"error": str(e)}
-            }
-        )
-
-
 @router.post("/iap/verify", response_model=IAPVerifyResponse)
 async def verify_iap_receipt(
     request: IAPVerifyRequest,
@@ -78,37 +27,32 @@ async def verify_iap_receipt(
     1. Сначала проверяем в production
     2. Если получаем код ошибки 21007 (sandbox receipt used in production),
        проверяем в sandbox
+    
+    Пока подписка по этой квитанции не истекла и проверялась недавно
+    (iap_verify_cache_seconds), статус отдается из БД без запроса к Apple.
+    Для известных sandbox-квитанций запрос в production пропускается.
     """
     logger.info(
         "Verifying IAP receipt",
         device_id=str(request.device_id)
     )
     
-    # Сначала пробуем production
-    apple_response = await verify_receipt_with_apple(
-        request.receipt_data,
-        use_sandbox=False
-    )
-    
-    status = apple_response.get("status")
-    
-    # Если получили код 21007, значит это sandbox receipt, проверяем в sandbox
-    if status == 21007:
-        logger.info(
-            "Received sandbox receipt in production, verifying in sandbox",
-            device_id=str(request.device_id)
-        )
-        apple_response = await verify_receipt_with_apple(
-            request.receipt_data,
-            use_sandbox=True
+    try:
+        response, from_cache = await verify_receipt(db, request.device_id, request.receipt_data)
+    except AppleUnavailableError as e:
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "code": 503,
+                "message": "Failed to verify receipt with Apple",
+                "details": {"error": str(e)}
+            }
         )
-        status = apple_response.get("status")
-    
-    # Проверяем статус ответа от Apple
-    if status != 0:
+    except ReceiptRejectedError as e:
+        # Проверяем статус ответа от Apple
         logger.error(
             "Apple verification failed",
-            status=status,
+            status=e.apple_status,
             device_id=str(request.device_id)
         )
         raise HTTPException(
@@ -116,75 +60,41 @@ async def verify_iap_receipt(
             detail={
                 "code": 400,
                 "message": "Receipt verification failed",
-                "details": {"apple_status": status}
+                "details": {"apple_status": e.apple_status}
             }
         )
-    
-    # Извлекаем информацию о покупках
-    receipt = apple_response.get("receipt", {})
-    in_app = receipt.get("in_app", [])
-    
-    # Проверяем наличие подписки
-    is_premium = False
-    expires_at: Optional[datetime] = None
-    
-    for purchase in in_app:
-        # Проверяем product_id
-        product_id = purchase.get("product_id")
-        if product_id == "com.azg.Convertik":
-            # Проверяем транзакцию
-            transaction_id = purchase.get("original_transaction_id")
-            
-            # Получаем или создаем запись в БД
-            stmt = select(IAPReceipt).where(
-                IAPReceipt.original_tx_id == transaction_id
-            )
-            result = await db.execute(stmt)
-            iap_receipt = result.scalar_one_or_none()
-            
-            # Определяем дату истечения подписки
-            expires_date_ms = purchase.get("expires_date_ms")
-            if expires_date_ms:
-                expires_at = datetime.fromtimestamp(
-                    int(expires_date_ms) / 1000,
-                    tz=timezone.utc
-                )
-                
-                # Проверяем, не истекла ли подписка
-                if expires_at > datetime.now(tz=timezone.utc):
-                    is_premium = True
-                    
-                    # Обновляем или создаем запись в БД
-                    if iap_receipt:
-                        iap_receipt.expires_at = expires_at
-                        iap_receipt.last_check = datetime.now(tz=timezone.utc)
-                    else:
-                        iap_receipt = IAPReceipt(
-                            original_tx_id=transaction_id,
-                            device_id=request.device_id,
-                            product_id=product_id,
-                            expires_at=expires_at,
-                            last_check=datetime.now(tz=timezone.utc)
-                        )
-                        db.add(iap_receipt)
-                    
-                    await db.commit()
-                    
-                    logger.info(
-                        "Premium subscription found",
-                        device_id=str(request.device_id),
-                        expires_at=expires_at.isoformat()
-                    )
+    record_cache("iap_receipts", from_cache)
     
     logger.info(
         "Receipt verification completed",
         device_id=str(request.device_id),
-        is_premium=is_premium,
-        expires_at=expires_at.isoformat() if expires_at else None
+        is_premium=response.premium,
+        expires_at=response.expires_at.isoformat() if response.expires_at else None,
+        from_cache=from_cache
     )
     
-    return IAPVerifyResponse(
-        premium=is_premium,
-        expires_at=expires_at
-    )
+    return response
+
+
+
+@router.get("/iap/status/{device_id}", response_model=IAPStatusResponse)
+async def get_premium_status(device_id: uuid.UUID) -> IAPStatusResponse:
+    """
+    Статус Premium устройства
+
+    Отвечает из индекса в памяти процесса (device_id -> окончание подписки)
+    без обращения к БД и Apple. Индекс загружается из iap_receipts при
+    старте и обновляется при проверке квитанций во всех воркерах (pub/sub).
+    """
+    if not premium_index.loaded:
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "code": 503,
+                "message": "Premium index is not loaded yet",
+                "details": {}
+            }
+        )
 
+    premium, expires_at = premium_index.status(device_id)
+    return IAPStatusResponse(device_id=device_id, premium=premium, expires_at=expires_at)
@@ -1,53 +1,36 @@
-from fastapi import APIRouter
-from datetime import datetime
-import psutil
-import os
+from fastapi import APIRouter, Query, Response
+from typing import Optional
+
+from ..tasks.metrics_sampler import metrics_sampler, format_timestamp
+from ..utils.prometheus import render_metrics
 
 router = APIRouter()
 
 
 @router.get("/metrics")
-async def get_metrics():
-    """Получение технических метрик сервиса"""
-    # Получаем метрики системы
-    cpu_percent = psutil.cpu_percent(interval=1)
-    memory = psutil.virtual_memory()
-    disk = psutil.disk_usage('/')
-
-    # Получаем информацию о процессе
-    process = psutil.Process(os.getpid())
-    process_memory = process.memory_info()
-
-    return {
-        "timestamp": datetime.utcnow().isoformat(),
-        "metrics": {
-            "cpu_usage_percent": cpu_percent,
-            "memory_total_mb": memory.total / (1024 * 1024),
-            "memory_used_mb": memory.used / (1024 * 1024),
-            "memory_available_mb": memory.available / (1024 * 1024),
-            "memory_usage_percent": memory.percent,
-            "disk_total_gb": disk.total / (1024 * 1024 * 1024),
-            "disk_used_gb": disk.used / (1024 * 1024 * 1024),
-            "disk_free_gb": disk.free / (1024 * 1024 * 1024),
-            "disk_usage_percent": (disk.used / disk.total) * 100,
-            "process_memory_mb": process_memory.rss / (1024 * 1024),
-        }
+async def get_metrics(
+    window: Optional[int] = Query(None, ge=1, le=86400, description="Окно в секундах для min/avg/max по метрикам")
+):
+    """
+    Получение технических метрик сервиса
+
+    Метрики собираются фоновым сборщиком, эндпоинт отдает последний сэмпл
+    без ожидания. С параметром window добавляет min/avg/max за окно.
+    """
+    ts, metrics = metrics_sampler.latest()
+
+    response = {
+        "timestamp": format_timestamp(ts),
+        "metrics": metrics,
     }
+    if window is not None:
+        response["window"] = metrics_sampler.window_stats(window)
 
+    return response
 
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+@router.get("/metrics/prometheus")
+async def get_prometheus_metrics():
+    """Метрики в формате Prometheus (латентность по роутам, кэши, БД, внешние API, планировщик)"""
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
@@ -0,0 +1,45 @@
+"""API роуты push-уведомлений"""
+
+from fastapi import APIRouter, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+import structlog
+
+from ..database import get_db
+from ..schemas import PushTokenRegister
+from ..services.premium_index import premium_index
+from ..services.push_service import register_push_token
+
+logger = structlog.get_logger()
+router = APIRouter()
+
+
+@router.post("/push/register", status_code=201)
+async def register_token(
+    request: PushTokenRegister,
+    db: AsyncSession = Depends(get_db)
+) -> dict:
+    """
+    Регистрация push-токена устройства
+
+    Повторная регистрация того же device_id заменяет токен и атрибуты
+    сегмента (локаль, версия приложения). Флаг is_premium берется из
+    индекса подписок процесса.
+    """
+    is_premium, _ = premium_index.status(request.device_id)
+    await register_push_token(
+        db,
+        device_id=request.device_id,
+        token=request.token,
+        platform=request.platform,
+        locale=request.locale,
+        app_version=request.app_version,
+        is_premium=is_premium,
+    )
+
+    logger.info(
+        "Push token registered",
+        device_id=str(request.device_id),
+        platform=request.platform,
+        locale=request.locale
+    )
+    return {"registered": True}
@@ -1,46 +1,193 @@
 """API роуты для курсов валют"""
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from datetime import datetime
-import json
+from sqlalchemy import select, text
+from typing import AsyncIterator, Optional
+from datetime import datetime, timedelta, timezone
 import structlog
 
-from ..database import get_db, get_redis
+from ..config import settings
+from ..database import async_sessionmaker, get_db
 from ..models.rate import Rate
-from ..schemas import RateResponse, RateSchema, CurrencyNamesResponse
+from ..schemas import (
+    RateResponse,
+    RateSchema,
+    CurrencyNamesResponse,
+    RateHistoryPoint,
+    RateHistoryResponse,
+)
+from ..utils.prometheus import RATES_STREAM_CONNECTIONS, record_cache
+from ..services.rates_snapshot import (
+    CURRENCY_NAMES_SNAPSHOT_KEY,
+    RATES_SNAPSHOT_KEY,
+    Snapshot,
+    build_rates_delta,
+    load_currency_names_snapshot,
+    load_rates_snapshot,
+    refresh_snapshot,
+    snapshot_store,
+)
+from ..services.rates_stream import rates_broadcaster
 
 logger = structlog.get_logger()
 router = APIRouter()
 
+# Длительность интервалов даунсэмплинга истории (для ограничения числа точек)
+HISTORY_STEPS = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+    "month": timedelta(days=31),
+}
+HISTORY_MAX_POINTS = 5000
+
+# OHLC по интервалам считается в SQL. История пишется только при изменении
+# курса, поэтому интервалы строятся generate_series, а курс, действовавший
+# к началу интервала, берется последней записью до него (LATERAL, спуск по
+# первичному ключу (code, recorded_at)). Он открывает интервал и входит в
+# high/low; интервал без записей повторяет его. Интервалы до первой записи
+# валюты не возвращаются.
+RATE_HISTORY_QUERY = """
+    WITH bounds AS (
+        SELECT
+            CAST(:start AS timestamptz) AS start_at,
+            CAST(:end AS timestamptz) AS end_at,
+            CAST('1 ' || CAST(:step AS text) AS interval) AS step_interval
+    ),
+    buckets AS (
+        SELECT bucket
+        FROM bounds, generate_series(
+            date_trunc(CAST(:step AS text), start_at AT TIME ZONE 'UTC'),
+            end_at AT TIME ZONE 'UTC',
+            step_interval
+        ) AS bucket
+        WHERE bucket < end_at AT TIME ZONE 'UTC'
+    )
+    SELECT
+        buckets.bucket,
+        COALESCE(carried.value, sampled.open) AS open,
+        GREATEST(carried.value, sampled.high) AS high,
+        LEAST(carried.value, sampled.low) AS low,
+        COALESCE(sampled.close, carried.value) AS close,
+        sampled.samples
+    FROM buckets
+    CROSS JOIN bounds
+    LEFT JOIN LATERAL (
+        SELECT value
+        FROM rate_history
+        WHERE code = :code AND recorded_at < GREATEST(buckets.bucket AT TIME ZONE 'UTC', bounds.start_at)
+        ORDER BY recorded_at DESC
+        LIMIT 1
+    ) AS carried ON TRUE
+    CROSS JOIN LATERAL (
+        SELECT
+            (array_agg(value ORDER BY recorded_at))[1] AS open,
+            MAX(value) AS high,
+            MIN(value) AS low,
+            (array_agg(value ORDER BY recorded_at DESC))[1] AS close,
+            COUNT(*) AS samples
+        FROM rate_history
+        WHERE code = :code
+          AND recorded_at >= GREATEST(buckets.bucket AT TIME ZONE 'UTC', bounds.start_at)
+          AND recorded_at < LEAST((buckets.bucket + bounds.step_interval) AT TIME ZONE 'UTC', bounds.end_at)
+    ) AS sampled
+    WHERE carried.value IS NOT NULL OR sampled.samples > 0
+    ORDER BY buckets.bucket
+"""
+
+
+def _snapshot_response(request: Request, snapshot: Snapshot) -> Response:
+    """Ответ из снапшота: 304 при совпадении условных заголовков, иначе готовые байты"""
+    if snapshot.matches(
+        request.headers.get("if-none-match"),
+        request.headers.get("if-modified-since"),
+    ):
+        return Response(status_code=304, headers=snapshot.headers)
+    return Response(content=snapshot.body, media_type="application/json", headers=snapshot.headers)
+
+
+def _delta_response(snapshot: Snapshot, since: int) -> Response:
+    """Ответ с изменениями курсов с версии since"""
+    return Response(
+        content=build_rates_delta(snapshot, since),
+        media_type="application/json",
+        headers={
+            "Cache-Control": snapshot.headers["Cache-Control"],
+            "X-Snapshot-Version": snapshot.headers["X-Snapshot-Version"],
+        },
+    )
+
+
+def _stream_unavailable() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail={
+            "code": 503,
+            "message": "Too many rate stream connections",
+            "details": {"limit": rates_broadcaster.max_connections}
+        }
+    )
+
+
+async def _prime_broadcaster() -> None:
+    """
+    Передает рассыльщику снапшот процесса перед подключением клиента
+
+    Новые версии приходят через pub/sub, но после старта воркера или
+    пересборки по запросу снапшот процесса может быть новее разосланного.
+    Сессия БД открывается только при пустом кэше и закрывается до начала
+    потока, поэтому подключения не держат соединения из пула.
+    """
+    snapshot = snapshot_store.get_stale(RATES_SNAPSHOT_KEY)
+    if snapshot is None:
+        async with async_sessionmaker() as db:
+            snapshot = await refresh_snapshot(RATES_SNAPSHOT_KEY, load_rates_snapshot, db)
+    if snapshot is not None:
+        rates_broadcaster.publish(snapshot)
+
+
+async def _sse_events(since: Optional[int]) -> AsyncIterator[bytes]:
+    """События SSE: дельта курсов с id версии или комментарий keepalive"""
+    RATES_STREAM_CONNECTIONS.labels(transport="sse").inc()
+    try:
+        yield f"retry: {settings.rates_stream_retry_ms}\n\n".encode()
+        async for update in rates_broadcaster.updates(since):
+            if update is None:
+                yield b": ping\n\n"
+            else:
+                yield b"id: %d\nevent: rates\ndata: %s\n\n" % update
+    finally:
+        RATES_STREAM_CONNECTIONS.labels(transport="sse").dec()
+
 
 @router.get("/rates", response_model=RateResponse)
 async def get_rates(
+    request: Request,
+    since: Optional[int] = Query(None, description="Версия курсов клиента (X-Snapshot-Version). Если указана, возвращаются только изменения"),
     db: AsyncSession = Depends(get_db),
-) -> RateResponse:
+):
     """
     Получить актуальные курсы валют
     
-    Сначала проверяет кэш Redis, если нет - обращается к базе данных
+    Отдает заранее сериализованный снапшот из памяти процесса.
+    При промахе снапшот строится из кэша Redis или базы данных: одновременные
+    промахи объединяются, а пока идет пересборка, отдается предыдущий снапшот.
+    Поддерживает ETag / If-None-Match: неизмененные данные отдаются как 304.
+    С параметром since возвращает только валюты, изменившиеся с этой версии.
     """
+    snapshot = snapshot_store.get(RATES_SNAPSHOT_KEY)
+    record_cache("rates_snapshot", snapshot is not None)
+    if snapshot is not None:
+        if since is not None:
+            return _delta_response(snapshot, since)
+        return _snapshot_response(request, snapshot)
+
     try:
-        # Получаем Redis клиент
-        redis_client = await get_redis()
-        
-        # Проверяем кэш
-        cached_rates = await redis_client.get("rates_cache")
-        if cached_rates:
-            logger.info("Returning rates from cache")
-            return RateResponse.model_validate_json(cached_rates)
-        
-        # Если кэша нет, читаем из БД
-        logger.info("Reading rates from database")
-        result = await db.execute(select(Rate))
-        rates = result.scalars().all()
+        snapshot = await refresh_snapshot(RATES_SNAPSHOT_KEY, load_rates_snapshot, db)
         
-        if not rates:
-            logger.warning("No rates found in database")
+        if snapshot is None:
             # Возвращаем пустой результат с текущим временем
             response_data = {
                 "updated_at": datetime.utcnow(),
@@ -49,25 +196,9 @@ async def get_rates(
             }
             return RateResponse(**response_data)
         
-        # Формируем ответ
-        rates_dict = {rate.code: float(rate.value) for rate in rates}
-        updated_at = max(rate.updated_at for rate in rates)
-        
-        response_data = {
-            "updated_at": updated_at,
-            "base": "RUB",
-            "rates": rates_dict
-        }
-        
-        # Кэшируем результат на 1 час (3600 секунд)
-        await redis_client.setex(
-            "rates_cache",
-            3600,  # TTL в секундах
-            json.dumps(response_data, default=str)
-        )
-        
-        logger.info("Rates cached successfully", rates_count=len(rates_dict))
-        return RateResponse(**response_data)
+        if since is not None:
+            return _delta_response(snapshot, since)
+        return _snapshot_response(request, snapshot)
         
     except Exception as e:
         logger.error("Error getting rates", error=str(e), exc_info=True)
@@ -83,30 +214,24 @@ async def get_rates(
 
 @router.get("/currency-names", response_model=CurrencyNamesResponse)
 async def get_currency_names(
+    request: Request,
     db: AsyncSession = Depends(get_db),
-) -> CurrencyNamesResponse:
+):
     """
     Получить названия валют
     
-    Возвращает словарь с названиями всех доступных валют
+    Возвращает словарь с названиями всех доступных валют.
+    Поддерживает ETag / If-None-Match: неизмененные данные отдаются как 304.
     """
+    snapshot = snapshot_store.get(CURRENCY_NAMES_SNAPSHOT_KEY)
+    record_cache("currency_names_snapshot", snapshot is not None)
+    if snapshot is not None:
+        return _snapshot_response(request, snapshot)
+
     try:
-        # Получаем Redis клиент
-        redis_client = await get_redis()
-        
-        # Проверяем кэш
-        cached_names = await redis_client.get("currency_names_cache")
-        if cached_names:
-            logger.info("Returning currency names from cache")
-            return CurrencyNamesResponse.model_validate_json(cached_names)
-        
-        # Если кэша нет, читаем из БД
-        logger.info("Reading currency names from database")
-        result = await db.execute(select(Rate))
-        rates = result.scalars().all()
+        snapshot = await refresh_snapshot(CURRENCY_NAMES_SNAPSHOT_KEY, load_currency_names_snapshot, db)
         
-        if not rates:
-            logger.warning("No rates found in database")
+        if snapshot is None:
             # Возвращаем пустой результат с текущим временем
             response_data = {
                 "updated_at": datetime.utcnow(),
@@ -114,32 +239,151 @@ async def get_currency_names(
             }
             return CurrencyNamesResponse(**response_data)
         
-        # Формируем словарь названий
-        names_dict = {rate.code: rate.name for rate in rates}
-        updated_at = max(rate.updated_at for rate in rates)
-        
-        response_data = {
-            "updated_at": updated_at,
-            "names": names_dict
-        }
+        return _snapshot_response(request, snapshot)
         
-        # Кэшируем результат на 24 часа (86400 секунд)
-        await redis_client.setex(
-            "currency_names_cache",
-            86400,  # TTL в секундах
-            json.dumps(response_data, default=str)
+    except Exception as e:
+        logger.error("Error getting currency names", error=str(e), exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "code": 500,
+                "message": "Failed to get currency names",
+                "details": {"error": str(e)}
+            }
+        )
+
+
+@router.get("/rates/stream")
+async def stream_rates(
+    since: Optional[int] = Query(None, description="Версия курсов клиента. Если не указана, первым событием приходит полный набор курсов"),
+    last_event_id: Optional[int] = Header(None, alias="Last-Event-ID"),
+) -> StreamingResponse:
+    """
+    Поток обновлений курсов (Server-Sent Events)
+
+    Событие rates содержит тело ответа /rates?since=<версия клиента>,
+    id события — новая версия, поэтому EventSource после переподключения
+    получает только пропущенные изменения. Каждые
+    rates_stream_keepalive_seconds отправляется комментарий keepalive.
+    """
+    if rates_broadcaster.connections >= rates_broadcaster.max_connections:
+        raise _stream_unavailable()
+    await _prime_broadcaster()
+    return StreamingResponse(
+        _sse_events(last_event_id if last_event_id is not None else since),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/rates/ws")
+async def rates_websocket(
+    websocket: WebSocket,
+    since: Optional[int] = Query(None),
+) -> None:
+    """
+    Поток обновлений курсов через WebSocket
+
+    Сообщения те же, что у /rates/stream: {"event": "rates", "version": ...,
+    "data": <тело /rates?since>} и {"event": "ping"}.
+    """
+    if rates_broadcaster.connections >= rates_broadcaster.max_connections:
+        await websocket.close(code=1013)
+        return
+    await websocket.accept()
+    await _prime_broadcaster()
+    RATES_STREAM_CONNECTIONS.labels(transport="websocket").inc()
+    try:
+        async for update in rates_broadcaster.updates(since):
+            if update is None:
+                await websocket.send_text('{"event": "ping"}')
+            else:
+                await websocket.send_text(
+                    (b'{"event": "rates", "version": %d, "data": %s}' % update).decode()
+                )
+    except WebSocketDisconnect:
+        pass
+    finally:
+        RATES_STREAM_CONNECTIONS.labels(transport="websocket").dec()
+
+
+@router.get("/rates/{currency_code}/history", response_model=RateHistoryResponse)
+async def get_rate_history(
+    currency_code: str,
+    from_date: Optional[datetime] = Query(None, alias="from", description="Начало периода (ISO). По умолчанию — 30 дней до конца периода"),
+    to_date: Optional[datetime] = Query(None, alias="to", description="Конец периода (ISO). По умолчанию — текущее время"),
+    step: str = Query("day", pattern="^(hour|day|week|month)$", description="Интервал агрегации: hour, day, week, month"),
+    db: AsyncSession = Depends(get_db)
+) -> RateHistoryResponse:
+    """
+    Получить историю курса валюты для графиков
+    
+    Возвращает OHLC (open/high/low/close) по интервалам, посчитанные в SQL,
+    поэтому объем ответа зависит от числа интервалов, а не от числа обновлений.
+    Интервалы без изменений курса повторяют действовавший курс (samples = 0).
+    """
+    currency_code = currency_code.upper()
+    
+    end = to_date or datetime.now(timezone.utc)
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    start = from_date or end - timedelta(days=30)
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    
+    if start >= end:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "code": 400,
+                "message": "from cannot be later than to",
+                "details": {"from": start.isoformat(), "to": end.isoformat()}
+            }
+        )
+    
+    if (end - start) / HISTORY_STEPS[step] > HISTORY_MAX_POINTS:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "code": 400,
+                "message": "Too many points requested, use a larger step",
+                "details": {"step": step, "max_points": HISTORY_MAX_POINTS}
+            }
+        )
+    
+    try:
+        result = await db.execute(
+            text(RATE_HISTORY_QUERY),
+            {"step": step, "code": currency_code, "start": start, "end": end}
         )
         
-        logger.info("Currency names cached successfully", names_count=len(names_dict))
-        return CurrencyNamesResponse(**response_data)
+        points = [
+            RateHistoryPoint(
+                bucket=bucket.replace(tzinfo=timezone.utc),
+                open=float(open_value),
+                high=float(high),
+                low=float(low),
+                close=float(close),
+                samples=samples
+            )
+            for bucket, open_value, high, low, close, samples in result.fetchall()
+        ]
+        
+        return RateHistoryResponse(
+            code=currency_code,
+            step=step,
+            start=start,
+            end=end,
+            points=points
+        )
         
     except Exception as e:
-        logger.error("Error getting currency names", error=str(e), exc_info=True)
+        logger.error("Error getting rate history", currency_code=currency_code, error=str(e), exc_info=True)
         raise HTTPException(
             status_code=500,
             detail={
                 "code": 500,
-                "message": "Failed to get currency names",
+                "message": "Failed to get currency rate history",
                 "details": {"error": str(e)}
             }
         )
@@ -3,14 +3,16 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-from typing import List, Optional
+from typing import Any, Dict, Optional, Set, Tuple
 import structlog
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timezone, timedelta
 import uuid
 
 from ..database import get_db
-from ..models.usage_event import UsageEvent
-from ..schemas import UsageEventBatch, UsageEventCreate
+from ..schemas import UsageEventBatch
+from ..services.stats_ingest import stats_ingest_queue
+from ..services.device_sketches import HLL_STANDARD_ERROR, count_unique_devices, record_devices
+from ..services.stats_cache import stats_result_cache
 
 logger = structlog.get_logger()
 router = APIRouter()
@@ -18,64 +20,98 @@ router = APIRouter()
 
 @router.post("/stats")
 async def submit_stats(
-    event_batch: UsageEventBatch,
-    db: AsyncSession = Depends(get_db)
+    event_batch: UsageEventBatch
 ) -> dict:
     """
     Принять batch событий аналитики
 
-    Принимает до 50 событий за один запрос для эффективной обработки
+    Принимает до 50 событий за один запрос. События кладутся в очередь
+    процесса и записываются в БД пачками в фоне, поэтому ответ не ждет commit.
     """
+    events_to_insert = []
+
+    for event in event_batch.events:
+        # Конвертируем timestamp в datetime с UTC часовым поясом
+        event_time = datetime.fromtimestamp(event.ts, tz=timezone.utc)
+
+        # Конвертируем device_id из строки в UUID
+        try:
+            device_uuid = uuid.UUID(event.device_id)
+        except ValueError:
+            logger.warning(f"Invalid device_id format: {event.device_id}")
+            continue
+
+        events_to_insert.append({
+            "device_id": device_uuid,
+            "event_name": event.name,
+            "payload": event.params,
+            "created_at": event_time
+        })
+
+    if events_to_insert and not stats_ingest_queue.submit(events_to_insert):
+        logger.warning("Analytics queue is full, rejecting batch", events_count=len(events_to_insert))
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "code": 503,
+                "message": "Analytics queue is full, retry later",
+                "details": {"pending_events": stats_ingest_queue.pending}
+            },
+            headers={"Retry-After": "5"}
+        )
+
+    # Дневные HyperLogLog-скетчи устройств для DAU/WAU/MAU
+    devices_by_day: Dict[date, Set[str]] = {}
+    for row in events_to_insert:
+        devices_by_day.setdefault(row["created_at"].date(), set()).add(str(row["device_id"]))
     try:
-        events_to_insert = []
-
-        for event in event_batch.events:
-            # Конвертируем timestamp в datetime с UTC часовым поясом
-            event_time = datetime.fromtimestamp(event.ts, tz=timezone.utc)
-
-            # Конвертируем device_id из строки в UUID
-            try:
-                device_uuid = uuid.UUID(event.device_id)
-            except ValueError:
-                logger.warning(f"Invalid device_id format: {event.device_id}")
-                continue
-
-            # Создаем объект события
-            usage_event = UsageEvent(
-                device_id=device_uuid,
-                event_name=event.name,
-                payload=event.params,
-                created_at=event_time
-            )
-            events_to_insert.append(usage_event)
+        await record_devices(devices_by_day)
+    except Exception as e:
+        logger.warning("Failed to update device sketches", error=str(e))
+
+    logger.info(
+        "Analytics events accepted",
+        events_count=len(events_to_insert),
+        device_ids=[str(e["device_id"]) for e in events_to_insert[:5]]  # Логируем только первые 5 для примера
+    )
+
+    return {
+        "status": "success",
+        "processed_events": len(events_to_insert),
+        "message": "Events accepted"
+    }
 
-        # Bulk insert всех событий
-        db.add_all(events_to_insert)
-        await db.commit()
 
-        logger.info(
-            "Analytics events saved successfully",
-            events_count=len(events_to_insert),
-            device_ids=[str(e.device_id) for e in events_to_insert[:5]]  # Логируем только первые 5 для примера
-        )
+async def _compute_stats_summary(db: AsyncSession) -> dict:
+    """Сводка по аналитике по сырым событиям usage_events"""
+    # Подсчитываем общую статистику
+    queries = {
+        "total_events": "SELECT COUNT(*) FROM usage_events",
+        "unique_devices": "SELECT COUNT(DISTINCT device_id) FROM usage_events",
+        "events_today": """
+            SELECT COUNT(*) FROM usage_events
+            WHERE created_at >= (NOW() AT TIME ZONE 'UTC')::date
+        """,
+        "top_events": """
+            SELECT event_name, COUNT(*) as count
+            FROM usage_events
+            GROUP BY event_name
+            ORDER BY count DESC
+            LIMIT 10
+        """
+    }
 
-        return {
-            "status": "success",
-            "processed_events": len(events_to_insert),
-            "message": "Events saved successfully"
-        }
+    stats = {}
 
-    except Exception as e:
-        await db.rollback()
-        logger.error("Error saving analytics events", error=str(e), exc_info=True)
-        raise HTTPException(
-            status_code=500,
-            detail={
-                "code": 500,
-                "message": "Failed to save analytics events",
-                "details": {"error": str(e)}
-            }
-        )
+    for key, query in queries.items():
+        if key == "top_events":
+            result = await db.execute(text(query))
+            stats[key] = [{"event": row[0], "count": row[1]} for row in result.fetchall()]
+        else:
+            result = await db.execute(text(query))
+            stats[key] = result.scalar()
+
+    return stats
 
 
 @router.get("/stats/summary")
@@ -84,34 +120,17 @@ async def get_stats_summary(
 ) -> dict:
     """
     Получить краткую сводку по аналитике (для админа)
+
+    Результат кэшируется на stats_cache_live_ttl_seconds: сводка
+    захватывает текущий момент, повторные опросы берут ее из кэша.
     """
     try:
-        # Подсчитываем общую статистику
-        queries = {
-            "total_events": "SELECT COUNT(*) FROM usage_events",
-            "unique_devices": "SELECT COUNT(DISTINCT device_id) FROM usage_events",
-            "events_today": """
-                SELECT COUNT(*) FROM usage_events
-                WHERE created_at >= (NOW() AT TIME ZONE 'UTC')::date
-            """,
-            "top_events": """
-                SELECT event_name, COUNT(*) as count
-                FROM usage_events
-                GROUP BY event_name
-                ORDER BY count DESC
-                LIMIT 10
-            """
-        }
-
-        stats = {}
-
-        for key, query in queries.items():
-            if key == "top_events":
-                result = await db.execute(text(query))
-                stats[key] = [{"event": row[0], "count": row[1]} for row in result.fetchall()]
-            else:
-                result = await db.execute(text(query))
-                stats[key] = result.scalar()
+        now = datetime.now(timezone.utc)
+        stats = await stats_result_cache.get_or_compute(
+            stats_result_cache.window_key("summary", now, now),
+            stats_result_cache.ttl_for(None),
+            lambda: _compute_stats_summary(db),
+        )
 
         logger.info("Stats summary requested", stats=stats)
         return stats
@@ -128,11 +147,348 @@ async def get_stats_summary(
         )
 
 
+def _parse_metrics_window(
+    period: str,
+    start_date: Optional[str],
+    end_date: Optional[str]
+) -> Tuple[datetime, datetime, int, bool]:
+    """
+    Вычисляет окно метрик по параметрам запроса
+
+    Returns:
+        (начало, конец, количество дней, указано ли начало явно)
+    """
+    now = datetime.now(timezone.utc)
+
+    # Парсим даты, если указаны
+    if start_date:
+        try:
+            # Пробуем парсить с временем
+            if 'T' in start_date:
+                start_datetime = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
+            else:
+                # Только дата - начало дня
+                start_datetime = datetime.fromisoformat(start_date).replace(hour=0, minute=0, second=0, microsecond=0)
+                start_datetime = start_datetime.replace(tzinfo=timezone.utc)
+        except ValueError:
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "code": 400,
+                    "message": "Invalid start_date format. Use ISO format: YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS",
+                    "details": {"start_date": start_date}
+                }
+            )
+    else:
+        start_datetime = None
+
+    if end_date:
+        try:
+            # Пробуем парсить с временем
+            if 'T' in end_date:
+                end_datetime = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
+            else:
+                # Только дата - конец дня
+                end_datetime = datetime.fromisoformat(end_date).replace(hour=23, minute=59, second=59, microsecond=999999)
+                end_datetime = end_datetime.replace(tzinfo=timezone.utc)
+        except ValueError:
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "code": 400,
+                    "message": "Invalid end_date format. Use ISO format: YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS",
+                    "details": {"end_date": end_date}
+                }
+            )
+    else:
+        end_datetime = now
+
+    # Если указаны конкретные даты, используем их
+    if start_datetime:
+        window_start = start_datetime
+        # Вычисляем количество дней для названия метрики
+        interval_days = (end_datetime - start_datetime).days + 1
+    else:
+        # Определяем период для вычисления метрик (по умолчанию)
+        if period == "day":
+            window_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+            interval_days = 1
+        elif period == "week":
+            window_start = now - timedelta(days=7)
+            interval_days = 7
+        elif period == "month":
+            window_start = now - timedelta(days=30)
+            interval_days = 30
+        else:
+            window_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+            interval_days = 1
+        end_datetime = now
+
+    # Валидация: start_date не должна быть позже end_date
+    if window_start > end_datetime:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "code": 400,
+                "message": "start_date cannot be later than end_date",
+                "details": {
+                    "start_date": window_start.isoformat(),
+                    "end_date": end_datetime.isoformat()
+                }
+            }
+        )
+
+    return window_start, end_datetime, interval_days, start_datetime is not None
+
+
+def _metrics_bounds(window_start: datetime, end_datetime: datetime, explicit_start: bool) -> Dict[str, datetime]:
+    """Границы всех окон, по которым считаются метрики"""
+    now = datetime.now(timezone.utc)
+
+    # DAU (Daily Active Users) - уникальные устройства за выбранный день
+    # Если указана конкретная дата, используем её, иначе сегодня
+    dau_date = window_start.date() if explicit_start else now.date()
+    dau_start = datetime.combine(dau_date, datetime.min.time()).replace(tzinfo=timezone.utc)
+    end_midnight = end_datetime.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    return {
+        "dau_start": dau_start,
+        "dau_end": dau_start + timedelta(days=1),
+        # WAU / MAU - уникальные устройства за последние 7 / 30 дней от end_date
+        "wau_start": end_midnight - timedelta(days=7),
+        "mau_start": end_midnight - timedelta(days=30),
+        "period_start": window_start,
+        # События за последние 24 часа от end_date
+        "events_24h_start": end_datetime - timedelta(hours=24),
+        "end": end_datetime,
+    }
+
+
+# Запросы к агрегатам (см. services/stats_rollup.py). Число событий считается
+# по часовым интервалам, уникальные устройства — по дневным множествам,
+# поэтому стоимость зависит от числа дней в окне, а не от числа событий.
+ROLLUP_EVENTS_QUERY = """
+    SELECT
+        COALESCE(SUM(events) FILTER (WHERE bucket >= :period_start), 0) AS events_period,
+        COALESCE(SUM(events) FILTER (WHERE bucket >= :events_24h_start), 0) AS events_24h
+    FROM usage_events_hourly
+    WHERE bucket >= :range_start AND bucket <= :end
+"""
+
+ROLLUP_TOP_EVENTS_QUERY = """
+    SELECT event_name, SUM(events) AS count
+    FROM usage_events_hourly
+    WHERE bucket >= :period_start AND bucket <= :end
+    GROUP BY event_name
+    ORDER BY count DESC
+    LIMIT 10
+"""
+
+ROLLUP_DEVICES_QUERY = """
+    SELECT
+        COUNT(DISTINCT device_id) FILTER (WHERE day = :dau_day) AS dau,
+        COUNT(DISTINCT device_id) FILTER (WHERE day >= :wau_start_day) AS wau,
+        COUNT(DISTINCT device_id) FILTER (WHERE day >= :mau_start_day) AS mau,
+        COUNT(DISTINCT device_id) FILTER (WHERE day >= :period_start_day) AS unique_devices_period
+    FROM usage_daily_devices
+    WHERE day >= :range_start_day AND day <= :end_day
+"""
+
+
+def _floor_hour(value: datetime) -> datetime:
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def _device_day_ranges(bounds: Dict[str, datetime]) -> Dict[str, Tuple[date, date]]:
+    """Диапазоны дней (UTC) для метрик уникальных устройств"""
+    end_day = bounds["end"].date()
+    return {
+        "dau": (bounds["dau_start"].date(), bounds["dau_start"].date()),
+        "wau": (bounds["wau_start"].date(), end_day),
+        "mau": (bounds["mau_start"].date(), end_day),
+        "unique_devices_period": (bounds["period_start"].date(), end_day),
+    }
+
+
+async def _rollup_event_counters(db: AsyncSession, bounds: Dict[str, datetime]) -> Dict[str, Any]:
+    """Счетчики событий по часовым агрегатам"""
+    period_start = _floor_hour(bounds["period_start"])
+    events_24h_start = _floor_hour(bounds["events_24h_start"])
+
+    events_result = await db.execute(
+        text(ROLLUP_EVENTS_QUERY),
+        {
+            "period_start": period_start,
+            "events_24h_start": events_24h_start,
+            "range_start": min(period_start, events_24h_start),
+            "end": bounds["end"],
+        }
+    )
+    events_period, events_24h = events_result.one()
+
+    top_events_result = await db.execute(
+        text(ROLLUP_TOP_EVENTS_QUERY),
+        {"period_start": period_start, "end": bounds["end"]}
+    )
+
+    return {
+        "events_period": int(events_period),
+        "events_24h": int(events_24h),
+        "top_events": [(event_name, int(count)) for event_name, count in top_events_result.fetchall()],
+    }
+
+
+async def _rollup_device_counters(db: AsyncSession, bounds: Dict[str, datetime]) -> Dict[str, int]:
+    """Уникальные устройства по дневным множествам"""
+    ranges = _device_day_ranges(bounds)
+    devices_result = await db.execute(
+        text(ROLLUP_DEVICES_QUERY),
+        {
+            "dau_day": ranges["dau"][0],
+            "wau_start_day": ranges["wau"][0],
+            "mau_start_day": ranges["mau"][0],
+            "period_start_day": ranges["unique_devices_period"][0],
+            "range_start_day": min(start for start, _ in ranges.values()),
+            "end_day": bounds["end"].date(),
+        }
+    )
+    return dict(devices_result.one()._mapping)
+
+
+# Точные метрики считаются за один проход по самому широкому окну: каждая
+# метрика — агрегат с FILTER по своему подокну. Вместо семи сканов usage_events
+# (по одному на метрику) Postgres читает диапазон один раз.
+EXACT_COUNTERS_QUERY = """
+    SELECT
+        COUNT(DISTINCT device_id) FILTER (WHERE created_at >= :dau_start AND created_at < :dau_end) AS dau,
+        COUNT(DISTINCT device_id) FILTER (WHERE created_at >= :wau_start AND created_at <= :end) AS wau,
+        COUNT(DISTINCT device_id) FILTER (WHERE created_at >= :mau_start AND created_at <= :end) AS mau,
+        COUNT(*) FILTER (WHERE created_at >= :period_start AND created_at <= :end) AS events_period,
+        COUNT(*) FILTER (WHERE created_at >= :events_24h_start AND created_at <= :end) AS events_24h,
+        COUNT(DISTINCT device_id) FILTER (
+            WHERE created_at >= :period_start AND created_at <= :end
+        ) AS unique_devices_period
+    FROM usage_events
+    WHERE created_at >= :range_start AND created_at <= :range_end
+"""
+
+# Топ событий за период. Итог за период уже есть в EXACT_COUNTERS_QUERY,
+# поэтому строка-итог GROUPING SETS ((event_name), ()) здесь не нужна.
+EXACT_TOP_EVENTS_QUERY = """
+    SELECT event_name, COUNT(*) AS count
+    FROM usage_events
+    WHERE created_at >= :period_start AND created_at <= :end
+    GROUP BY event_name
+    ORDER BY count DESC
+    LIMIT 10
+"""
+
+
+async def _exact_counters(db: AsyncSession, bounds: Dict[str, datetime]) -> Dict[str, Any]:
+    """Точные метрики по сырым событиям usage_events (для сверки с агрегатами)"""
+    params = dict(bounds)
+    params["range_start"] = min(bounds["dau_start"], bounds["wau_start"], bounds["mau_start"],
+                                bounds["period_start"], bounds["events_24h_start"])
+    params["range_end"] = max(bounds["dau_end"], bounds["end"])
+
+    counters_result = await db.execute(text(EXACT_COUNTERS_QUERY), params)
+    counters: Dict[str, Any] = dict(counters_result.one()._mapping)
+
+    top_events_result = await db.execute(
+        text(EXACT_TOP_EVENTS_QUERY),
+        {"period_start": bounds["period_start"], "end": bounds["end"]}
+    )
+    counters["top_events"] = [(event_name, count) for event_name, count in top_events_result.fetchall()]
+    return counters
+
+
+async def _compute_metrics(
+    db: AsyncSession,
+    window_start: datetime,
+    end_datetime: datetime,
+    interval_days: int,
+    explicit_start: bool,
+    exact: bool
+) -> dict:
+    """Вычисляет ответ /stats/metrics для окна"""
+    bounds = _metrics_bounds(window_start, end_datetime, explicit_start)
+
+    unique_devices_error = None
+    if exact:
+        source = "events"
+        counters = await _exact_counters(db, bounds)
+    else:
+        counters = await _rollup_event_counters(db, bounds)
+        device_ranges = _device_day_ranges(bounds)
+        try:
+            sketch_counts = await count_unique_devices(device_ranges)
+        except Exception as e:
+            logger.warning("HyperLogLog sketches unavailable, using daily device rollups", error=str(e))
+            sketch_counts = {}
+
+        estimated = {name: count for name, count in sketch_counts.items() if count is not None}
+        if len(estimated) < len(device_ranges):
+            # Скетчей нет за часть дней (до их появления или до заполнения из агрегатов)
+            if sketch_counts:
+                logger.info("Device sketches incomplete, using daily device rollups",
+                            metrics=sorted(set(sketch_counts) - set(estimated)))
+            rollup_counts = await _rollup_device_counters(db, bounds)
+            counters.update({name: rollup_counts[name] for name in rollup_counts if name not in estimated})
+        counters.update(estimated)
+        if estimated:
+            source = "rollups+hll"
+            unique_devices_error = HLL_STANDARD_ERROR
+        else:
+            source = "rollups"
+
+    dau = counters["dau"]
+    mau = counters["mau"]
+    events_period = counters["events_period"]
+    unique_devices_period = counters["unique_devices_period"]
+
+    # Вычисляем события на пользователя за период
+    events_per_user = round(events_period / unique_devices_period, 2) if unique_devices_period > 0 else 0
+
+    # Вычисляем Stickiness (DAU/MAU)
+    stickiness = round((dau / mau * 100), 2) if mau > 0 else 0
+
+    # Формируем метрики
+    metrics = {
+        "dau": dau,
+        "wau": counters["wau"],
+        "mau": mau,
+        "stickiness_percent": stickiness,
+        f"events_last_{interval_days}d": events_period,
+        "events_last_24h": counters["events_24h"],
+        "unique_devices_period": unique_devices_period,
+        "events_per_user": events_per_user,
+    }
+
+    # Добавляем метрики для каждого события из top_events
+    for event_name, count in counters["top_events"]:
+        metrics[f"event_{event_name}"] = count
+
+    response = {
+        "timestamp": end_datetime.isoformat(),
+        "period": {
+            "start": window_start.isoformat(),
+            "end": end_datetime.isoformat(),
+            "days": interval_days
+        },
+        "source": source,
+        "metrics": metrics
+    }
+    if unique_devices_error is not None:
+        response["unique_devices_std_error"] = unique_devices_error
+    return response
+
+
 @router.get("/stats/metrics")
 async def get_metrics_for_monitoring(
     period: str = Query("day", regex="^(day|week|month)$", description="Период для метрик: day, week, month"),
     start_date: Optional[str] = Query(None, description="Начальная дата в формате ISO (YYYY-MM-DD или YYYY-MM-DDTHH:MM:SS). Если не указана, используется текущий период."),
     end_date: Optional[str] = Query(None, description="Конечная дата в формате ISO (YYYY-MM-DD или YYYY-MM-DDTHH:MM:SS). Если не указана, используется текущее время."),
+    exact: bool = Query(False, description="Считать метрики точно по сырым событиям (медленно, для сверки)"),
     db: AsyncSession = Depends(get_db)
 ) -> dict:
     """
@@ -141,6 +497,17 @@ async def get_metrics_for_monitoring(
     Возвращает продуктовые метрики в формате, совместимом с azg_admin.
     Метрики вычисляются за указанный период (не накопительные).
 
+    По умолчанию счетчики событий берутся из часовых агрегатов
+    usage_events_hourly (точность — час), а DAU/WAU/MAU и уникальные
+    устройства — из дневных HyperLogLog-скетчей в Redis (точность — день,
+    стандартная ошибка ~0.81%). Если Redis недоступен, уникальные устройства
+    считаются по дневным множествам usage_daily_devices.
+    С exact=true все метрики считаются по сырым событиям usage_events.
+
+    Ответ кэшируется по окну, округленному до stats_cache_bucket_seconds:
+    окна, захватывающие текущий момент, — на stats_cache_live_ttl_seconds,
+    закрытые исторические окна — на stats_cache_closed_ttl_seconds.
+
     Формат ответа:
     {
         "timestamp": "2025-12-10T12:00:00Z",
@@ -156,226 +523,30 @@ async def get_metrics_for_monitoring(
         }
     }
     """
-    try:
-        now = datetime.now(timezone.utc)
-
-        # Парсим даты, если указаны
-        if start_date:
-            try:
-                # Пробуем парсить с временем
-                if 'T' in start_date:
-                    start_datetime = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-                else:
-                    # Только дата - начало дня
-                    start_datetime = datetime.fromisoformat(start_date).replace(hour=0, minute=0, second=0, microsecond=0)
-                    start_datetime = start_datetime.replace(tzinfo=timezone.utc)
-            except ValueError:
-                raise HTTPException(
-                    status_code=400,
-                    detail={
-                        "code": 400,
-                        "message": "Invalid start_date format. Use ISO format: YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS",
-                        "details": {"start_date": start_date}
-                    }
-                )
-        else:
-            start_datetime = None
-
-        if end_date:
-            try:
-                # Пробуем парсить с временем
-                if 'T' in end_date:
-                    end_datetime = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-                else:
-                    # Только дата - конец дня
-                    end_datetime = datetime.fromisoformat(end_date).replace(hour=23, minute=59, second=59, microsecond=999999)
-                    end_datetime = end_datetime.replace(tzinfo=timezone.utc)
-            except ValueError:
-                raise HTTPException(
-                    status_code=400,
-                    detail={
-                        "code": 400,
-                        "message": "Invalid end_date format. Use ISO format: YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS",
-                        "details": {"end_date": end_date}
-                    }
-                )
-        else:
-            end_datetime = now
-
-        # Если указаны конкретные даты, используем их
-        if start_datetime:
-            start_date = start_datetime
-            # Вычисляем количество дней для названия метрики
-            if end_datetime:
-                interval_days = (end_datetime - start_datetime).days + 1
-            else:
-                interval_days = (now - start_datetime).days + 1
-        else:
-            # Определяем период для вычисления метрик (по умолчанию)
-            if period == "day":
-                start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-                interval_days = 1
-            elif period == "week":
-                start_date = now - timedelta(days=7)
-                interval_days = 7
-            elif period == "month":
-                start_date = now - timedelta(days=30)
-                interval_days = 30
-            else:
-                start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-                interval_days = 1
-            end_datetime = now
+    window_start, end_datetime, interval_days, explicit_start = _parse_metrics_window(period, start_date, end_date)
 
-        # Валидация: start_date не должна быть позже end_date
-        if start_date > end_datetime:
-            raise HTTPException(
-                status_code=400,
-                detail={
-                    "code": 400,
-                    "message": "start_date cannot be later than end_date",
-                    "details": {
-                        "start_date": start_date.isoformat(),
-                        "end_date": end_datetime.isoformat()
-                    }
-                }
-            )
-
-        # Вычисляем DAU (Daily Active Users) - уникальные устройства за выбранный день
-        # Если указана конкретная дата, используем её, иначе сегодня
-        dau_date = start_date.date() if start_datetime else now.date()
-        dau_query = """
-            SELECT COUNT(DISTINCT device_id)
-            FROM usage_events
-            WHERE created_at >= :dau_start AND created_at < :dau_end
-        """
-        dau_start = datetime.combine(dau_date, datetime.min.time()).replace(tzinfo=timezone.utc)
-        dau_end = dau_start + timedelta(days=1)
-        dau_result = await db.execute(
-            text(dau_query),
-            {"dau_start": dau_start, "dau_end": dau_end}
-        )
-        dau = dau_result.scalar() or 0
-
-        # Вычисляем WAU (Weekly Active Users) - уникальные устройства за последние 7 дней от end_date
-        wau_start = end_datetime.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=7)
-        wau_query = """
-            SELECT COUNT(DISTINCT device_id)
-            FROM usage_events
-            WHERE created_at >= :wau_start AND created_at <= :wau_end
-        """
-        wau_result = await db.execute(
-            text(wau_query),
-            {"wau_start": wau_start, "wau_end": end_datetime}
-        )
-        wau = wau_result.scalar() or 0
-
-        # Вычисляем MAU (Monthly Active Users) - уникальные устройства за последние 30 дней от end_date
-        mau_start = end_datetime.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=30)
-        mau_query = """
-            SELECT COUNT(DISTINCT device_id)
-            FROM usage_events
-            WHERE created_at >= :mau_start AND created_at <= :mau_end
-        """
-        mau_result = await db.execute(
-            text(mau_query),
-            {"mau_start": mau_start, "mau_end": end_datetime}
-        )
-        mau = mau_result.scalar() or 0
-
-        # Вычисляем события за период (не накопительные)
-        events_period_query = """
-            SELECT COUNT(*)
-            FROM usage_events
-            WHERE created_at >= :start_date AND created_at <= :end_date
-        """
-        events_result = await db.execute(
-            text(events_period_query),
-            {"start_date": start_date, "end_date": end_datetime}
-        )
-        events_period = events_result.scalar() or 0
-
-        # Вычисляем события за последние 24 часа от end_date
-        events_24h_start = end_datetime - timedelta(hours=24)
-        events_24h_query = """
-            SELECT COUNT(*)
-            FROM usage_events
-            WHERE created_at >= :events_24h_start AND created_at <= :events_24h_end
-        """
-        events_24h_result = await db.execute(
-            text(events_24h_query),
-            {"events_24h_start": events_24h_start, "events_24h_end": end_datetime}
-        )
-        events_24h = events_24h_result.scalar() or 0
-
-        # Вычисляем уникальные устройства за период
-        unique_devices_period_query = """
-            SELECT COUNT(DISTINCT device_id)
-            FROM usage_events
-            WHERE created_at >= :start_date AND created_at <= :end_date
-        """
-        unique_devices_result = await db.execute(
-            text(unique_devices_period_query),
-            {"start_date": start_date, "end_date": end_datetime}
-        )
-        unique_devices_period = unique_devices_result.scalar() or 0
-
-        # Вычисляем события на пользователя за период
-        events_per_user = round(events_period / unique_devices_period, 2) if unique_devices_period > 0 else 0
-
-        # Вычисляем Stickiness (DAU/MAU)
-        stickiness = round((dau / mau * 100), 2) if mau > 0 else 0
-
-        # Получаем топ событий за период
-        top_events_query = """
-            SELECT event_name, COUNT(*) as count
-            FROM usage_events
-            WHERE created_at >= :start_date AND created_at <= :end_date
-            GROUP BY event_name
-            ORDER BY count DESC
-            LIMIT 10
-        """
-        top_events_result = await db.execute(
-            text(top_events_query),
-            {"start_date": start_date, "end_date": end_datetime}
+    try:
+        response = await stats_result_cache.get_or_compute(
+            stats_result_cache.window_key(
+                "metrics", window_start, end_datetime, period, int(explicit_start), int(exact)
+            ),
+            stats_result_cache.ttl_for(end_datetime),
+            lambda: _compute_metrics(db, window_start, end_datetime, interval_days, explicit_start, exact),
         )
-        top_events = top_events_result.fetchall()
-
-        # Формируем метрики
-        metrics = {
-            "dau": dau,
-            "wau": wau,
-            "mau": mau,
-            "stickiness_percent": stickiness,
-            f"events_last_{interval_days}d": events_period,
-            "events_last_24h": events_24h,
-            "unique_devices_period": unique_devices_period,
-            "events_per_user": events_per_user,
-        }
-
-        # Добавляем метрики для каждого события из top_events
-        for event_name, count in top_events:
-            metrics[f"event_{event_name}"] = count
 
+        metrics = response["metrics"]
         logger.info(
             "Metrics requested for monitoring",
             period=period,
-            start_date=start_date.isoformat() if start_datetime else None,
+            start_date=window_start.isoformat() if explicit_start else None,
             end_date=end_datetime.isoformat(),
-            dau=dau,
-            wau=wau,
-            mau=mau,
-            events_period=events_period
+            source=response["source"],
+            dau=metrics["dau"],
+            wau=metrics["wau"],
+            mau=metrics["mau"],
+            events_period=metrics[f"events_last_{response['period']['days']}d"]
         )
-
-        return {
-            "timestamp": end_datetime.isoformat(),
-            "period": {
-                "start": start_date.isoformat(),
-                "end": end_datetime.isoformat(),
-                "days": interval_days
-            },
-            "metrics": metrics
-        }
+        return response
 
     except Exception as e:
         logger.error("Error getting metrics for monitoring", error=str(e), exc_info=True)
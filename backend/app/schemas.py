@@ -16,6 +16,17 @@ class RateResponse(BaseModel):
     rates: Dict[str, float]  # Курсы валют: {"USD": 0.0112, "EUR": 0.0101}
 
 
+class RatesDeltaResponse(BaseModel):
+    """Изменения курсов относительно версии клиента"""
+    updated_at: datetime
+    base: str = "RUB"
+    version: int  # Текущая версия курсов
+    since: int  # Версия, от которой считалась дельта
+    full: bool = False  # True — версия since слишком старая, rates содержит все курсы
+    rates: Dict[str, float]  # Изменившиеся курсы (или все при full=true)
+    removed: List[str] = []  # Валюты, пропавшие из курсов
+
+
 class RateSchema(BaseModel):
     """Схема отдельного курса валюты"""
     model_config = ConfigDict(from_attributes=True)
@@ -25,6 +36,54 @@ class RateSchema(BaseModel):
     updated_at: datetime
 
 
+class RateHistoryPoint(BaseModel):
+    """Агрегат курса за интервал (OHLC)"""
+    bucket: datetime  # Начало интервала (UTC)
+    open: float
+    high: float
+    low: float
+    close: float
+    samples: int  # Количество изменений курса в интервале (0 — курс не менялся)
+
+
+class RateHistoryResponse(BaseModel):
+    """История курса валюты с даунсэмплингом по интервалам"""
+    code: str
+    base: str = "RUB"
+    step: str  # hour | day | week | month
+    start: datetime
+    end: datetime
+    points: List[RateHistoryPoint]
+
+
+class ConversionResponse(BaseModel):
+    """Результат конвертации суммы по кросс-курсу"""
+    from_currency: str
+    to_currency: str
+    amount: float
+    rate: Optional[float] = None  # None, если валюта неизвестна
+    result: Optional[float] = None
+
+
+class ConversionPair(BaseModel):
+    """Пара валют для пакетной конвертации"""
+    from_currency: str = Field(..., max_length=3, description="ISO код исходной валюты")
+    to_currency: str = Field(..., max_length=3, description="ISO код целевой валюты")
+    amount: float = Field(1.0, ge=0, description="Сумма в исходной валюте")
+
+
+class ConversionBatchRequest(BaseModel):
+    """Пакетный запрос конвертации (до 500 пар)"""
+    pairs: List[ConversionPair] = Field(..., max_length=500, description="Список пар валют")
+
+
+class ConversionBatchResponse(BaseModel):
+    """Ответ пакетной конвертации"""
+    updated_at: datetime
+    base: str = "RUB"
+    results: List[ConversionResponse]
+
+
 class CurrencyNamesResponse(BaseModel):
     """Ответ с названиями валют"""
     model_config = ConfigDict(from_attributes=True)
@@ -60,6 +119,13 @@ class IAPVerifyResponse(BaseModel):
     expires_at: Optional[datetime] = Field(None, description="Дата окончания подписки")
 
 
+class IAPStatusResponse(BaseModel):
+    """Статус Premium устройства"""
+    device_id: uuid.UUID = Field(..., description="ID устройства")
+    premium: bool = Field(..., description="Статус Premium подписки")
+    expires_at: Optional[datetime] = Field(None, description="Дата окончания подписки")
+
+
 # Схемы для push-уведомлений
 class PushTokenRegister(BaseModel):
     """Регистрация push-токена"""
@@ -74,10 +140,50 @@ class PushSendRequest(BaseModel):
     """Запрос на отправку push-уведомления"""
     message: str = Field(..., max_length=200, description="Текст уведомления")
     title: Optional[str] = Field(None, max_length=100, description="Заголовок")
-    segment: Optional[str] = Field("all", description="Сегмент пользователей")
+    segment: Optional[str] = Field("all", pattern="^(all|premium|free)$", description="Сегмент пользователей")
+    locale: Optional[str] = Field(None, max_length=10, description="Локаль или язык (ru-RU, ru)")
+    platform: Optional[str] = Field(None, pattern="^(ios|android)$", description="Платформа")
+    app_version: Optional[str] = Field(None, max_length=20, description="Версия приложения (1.2 или 1.2.3)")
     payload: Optional[Dict[str, Any]] = Field(None, description="Дополнительные данные")
 
 
+class PushJobResponse(BaseModel):
+    """Состояние рассылки push-уведомлений"""
+    job_id: str
+    status: str = Field(..., description="running, completed или failed")
+    matched: int = Field(..., description="Токенов в сегменте")
+    sent: int
+    failed: int
+    pruned: int = Field(..., description="Удалено недействительных токенов")
+    started_at: datetime
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+
+
+class RateAlertCreate(BaseModel):
+    """Подписка на достижение курсом пары порога"""
+    device_id: uuid.UUID = Field(..., description="ID устройства")
+    base: str = Field(..., min_length=3, max_length=3, description="ISO код валюты (USD в USD/RUB)")
+    quote: str = Field(..., min_length=3, max_length=3, description="ISO код валюты котировки (RUB в USD/RUB)")
+    direction: str = Field(..., pattern="^(above|below)$", description="above — курс вырастет до порога, below — опустится")
+    threshold: float = Field(..., gt=0, description="Порог: сколько quote за 1 base")
+
+
+class RateAlertResponse(BaseModel):
+    """Подписка на курс"""
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    device_id: uuid.UUID
+    base: str
+    quote: str
+    direction: str
+    threshold: float
+    created_at: datetime
+    triggered_at: Optional[datetime] = None
+    triggered_rate: Optional[float] = None
+
+
 # Общие схемы
 class HealthResponse(BaseModel):
     """Ответ health check"""
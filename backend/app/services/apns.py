@@ -0,0 +1,130 @@
+"""Клиент Apple Push Notification service (HTTP/2 API с токен-авторизацией)"""
+
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import httpx
+import structlog
+
+from ..config import settings
+from ..utils.http_clients import http_clients
+
+logger = structlog.get_logger()
+
+# Apple принимает provider token не старше часа и отклоняет слишком частую
+# смену (TooManyProviderTokenUpdates), поэтому токен переиспользуется ~50 минут
+PROVIDER_TOKEN_TTL_SECONDS = 50 * 60
+
+# Причины отказа, после которых токен устройства больше не действителен
+INVALID_TOKEN_REASONS = frozenset({"BadDeviceToken", "Unregistered", "DeviceTokenNotForTopic"})
+
+# Причины, по которым нужно подписать новый provider token
+PROVIDER_TOKEN_REASONS = frozenset({"ExpiredProviderToken", "InvalidProviderToken"})
+
+
+class APNsConfigurationError(Exception):
+    """Не заданы ключ, key id или team id для APNs"""
+
+
+@dataclass(frozen=True)
+class APNsResult:
+    """Ответ APNs на одно уведомление"""
+    status: int
+    reason: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 200
+
+    @property
+    def token_invalid(self) -> bool:
+        """Токен устройства нужно удалить (приложение удалено или токен чужой)"""
+        return self.status == 410 or self.reason in INVALID_TOKEN_REASONS
+
+
+class APNsClient:
+    """
+    Отправка уведомлений в APNs
+
+    Запросы идут через общий HTTP/2 клиент "apns" из http_clients: тысячи
+    уведомлений мультиплексируются потоками поверх нескольких соединений.
+    Адрес сервиса задается в settings.apns_url — для нагрузочных проверок
+    его можно направить на локальную заглушку (serve_fake_apns в benchmarks/bench_push_fanout.py).
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        topic: str,
+        client_factory: Callable[[], httpx.AsyncClient] = lambda: http_clients.get("apns"),
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.topic = topic
+        self._client_factory = client_factory
+        self._provider_token: Optional[str] = None
+        self._provider_token_issued_at = 0.0
+
+    def provider_token(self) -> str:
+        """JWT для заголовка authorization, подписанный ключом .p8 (ES256)"""
+        now = time.time()
+        if self._provider_token is None or now - self._provider_token_issued_at >= PROVIDER_TOKEN_TTL_SECONDS:
+            self._provider_token = self._sign(int(now))
+            self._provider_token_issued_at = now
+        return self._provider_token
+
+    def _sign(self, issued_at: int) -> str:
+        if not (settings.apns_key and settings.apns_key_id and settings.apns_team_id):
+            raise APNsConfigurationError("APNs key, key id and team id must be configured")
+
+        from jose import jwt
+
+        # В переменных окружения ключ часто хранится в одну строку с \n
+        key = settings.apns_key.replace("\\n", "\n")
+        return jwt.encode(
+            {"iss": settings.apns_team_id, "iat": issued_at},
+            key,
+            algorithm="ES256",
+            headers={"kid": settings.apns_key_id},
+        )
+
+    async def send(self, device_token: str, payload: bytes) -> APNsResult:
+        """
+        Отправляет одно уведомление
+
+        payload — уже сериализованный JSON: при рассылке одно и то же тело
+        уходит на все устройства и кодируется один раз.
+
+        Raises:
+            httpx.HTTPError: сетевая ошибка или таймаут
+        """
+        provider_token = self.provider_token()
+        response = await self._client_factory().post(
+            f"{self.base_url}/3/device/{device_token}",
+            content=payload,
+            headers={
+                "content-type": "application/json",
+                "authorization": f"bearer {provider_token}",
+                "apns-topic": self.topic,
+                "apns-push-type": "alert",
+                "apns-priority": "10",
+            },
+        )
+        if response.status_code == 200:
+            return APNsResult(status=200)
+
+        try:
+            reason = response.json().get("reason")
+        except ValueError:
+            reason = None
+
+        # Сбрасываем только токен, с которым ушел запрос: ответы остальных
+        # запросов в полете не должны заставлять подписывать его повторно
+        if reason in PROVIDER_TOKEN_REASONS and self._provider_token == provider_token:
+            logger.warning("APNs rejected provider token", reason=reason)
+            self._provider_token = None
+        return APNsResult(status=response.status_code, reason=reason)
+
+
+# Глобальный клиент APNs процесса
+apns_client = APNsClient(settings.apns_url, settings.apns_topic)
@@ -0,0 +1,86 @@
+"""Матрица кросс-курсов валют"""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import structlog
+
+from .rates_snapshot import Snapshot
+
+logger = structlog.get_logger()
+
+
+class CrossRateMatrix:
+    """
+    Предвычисленная N×N матрица кросс-курсов
+
+    matrix[i, j] — сколько единиц валюты j дают за 1 единицу валюты i.
+    Курсы хранятся относительно базовой валюты (RUB), поэтому
+    matrix = outer(1 / rates, rates), а любой курс — это индексация массива.
+    """
+
+    def __init__(self, version: int, base: str, rates: Dict[str, float]):
+        codes = [base] + sorted(code for code, value in rates.items() if code != base and value > 0)
+        values = np.array([1.0] + [rates[code] for code in codes[1:]], dtype=np.float64)
+
+        self.version = version
+        self.base = base
+        self.index: Dict[str, int] = {code: i for i, code in enumerate(codes)}
+        self.matrix = np.outer(1.0 / values, values)
+
+    def rate(self, from_code: str, to_code: str) -> Optional[float]:
+        """Кросс-курс пары или None, если валюта неизвестна"""
+        i = self.index.get(from_code)
+        j = self.index.get(to_code)
+        if i is None or j is None:
+            return None
+        return float(self.matrix[i, j])
+
+    def convert_many(self, pairs: Sequence[Tuple[str, str, float]]) -> List[Optional[Tuple[float, float]]]:
+        """
+        Векторная конвертация списка (from, to, amount)
+
+        Returns:
+            Для каждой пары (курс, результат) или None, если валюта неизвестна
+        """
+        from_idx = np.array([self.index.get(from_code, -1) for from_code, _, _ in pairs], dtype=np.intp)
+        to_idx = np.array([self.index.get(to_code, -1) for _, to_code, _ in pairs], dtype=np.intp)
+        amounts = np.array([amount for _, _, amount in pairs], dtype=np.float64)
+
+        known = (from_idx >= 0) & (to_idx >= 0)
+        rates = np.where(known, self.matrix[from_idx, to_idx], np.nan)
+        results = rates * amounts
+
+        return [
+            (float(rate), float(result)) if is_known else None
+            for rate, result, is_known in zip(rates, results, known)
+        ]
+
+
+class CrossRatesCache:
+    """Хранит матрицу для текущей версии снапшота курсов"""
+
+    def __init__(self):
+        self._matrix: Optional[CrossRateMatrix] = None
+
+    def rebuild(self, snapshot: Snapshot) -> CrossRateMatrix:
+        """Пересчитывает матрицу по снапшоту /rates"""
+        matrix = CrossRateMatrix(
+            snapshot.version,
+            snapshot.payload["base"],
+            snapshot.payload["rates"],
+        )
+        self._matrix = matrix
+        logger.info("Cross rate matrix rebuilt", version=snapshot.version, currencies=len(matrix.index))
+        return matrix
+
+    def for_snapshot(self, snapshot: Snapshot) -> CrossRateMatrix:
+        """Матрица для снапшота; пересчитывается только при смене версии"""
+        matrix = self._matrix
+        if matrix is None or matrix.version != snapshot.version:
+            matrix = self.rebuild(snapshot)
+        return matrix
+
+
+# Глобальный кэш матрицы кросс-курсов процесса
+cross_rates_cache = CrossRatesCache()
@@ -0,0 +1,101 @@
+"""HyperLogLog-скетчи активных устройств по дням"""
+
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import structlog
+
+from ..config import settings
+from ..database import get_redis
+
+logger = structlog.get_logger()
+
+HLL_KEY_PREFIX = "hll:devices:"
+
+# Стандартная ошибка HyperLogLog в Redis (16384 регистра): 1.04 / sqrt(16384)
+HLL_STANDARD_ERROR = 0.0081
+
+
+def sketch_key(day: date) -> str:
+    """Ключ Redis со скетчем устройств за день (UTC)"""
+    return f"{HLL_KEY_PREFIX}{day.isoformat()}"
+
+
+def sketch_days(start_day: date, end_day: date) -> List[date]:
+    """Все дни диапазона включительно"""
+    return [start_day + timedelta(days=i) for i in range((end_day - start_day).days + 1)]
+
+
+def sketch_keys(start_day: date, end_day: date) -> List[str]:
+    """Ключи скетчей за все дни диапазона включительно"""
+    return [sketch_key(day) for day in sketch_days(start_day, end_day)]
+
+
+async def record_devices(devices_by_day: Dict[date, Set[str]]) -> None:
+    """
+    Добавляет устройства в дневные скетчи одним pipeline (PFADD + EXPIRE)
+
+    Пустое множество создает пустой скетч: так отмечается день без
+    активности, чтобы он не считался днем без данных.
+    """
+    if not devices_by_day:
+        return
+
+    redis_client = await get_redis()
+    ttl_seconds = settings.stats_hll_retention_days * 86400
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for day, device_ids in devices_by_day.items():
+            key = sketch_key(day)
+            pipe.pfadd(key, *device_ids)
+            pipe.expire(key, ttl_seconds)
+        await pipe.execute()
+
+
+async def missing_sketch_days(days: Iterable[date]) -> List[date]:
+    """Дни, для которых в Redis нет скетча"""
+    days = list(days)
+    if not days:
+        return []
+
+    redis_client = await get_redis()
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for day in days:
+            pipe.exists(sketch_key(day))
+        exists = await pipe.execute()
+    return [day for day, found in zip(days, exists) if not found]
+
+
+async def count_unique_devices(ranges: Dict[str, Tuple[date, date]]) -> Dict[str, Optional[int]]:
+    """
+    Оценка числа уникальных устройств для нескольких диапазонов дней
+
+    PFCOUNT по нескольким ключам объединяет скетчи на лету, поэтому
+    WAU/MAU и произвольные диапазоны не требуют сканирования событий.
+    Отсутствующий ключ PFCOUNT считает пустым, поэтому для диапазона, где
+    скетча нет хотя бы за один прошедший день (например, дни до появления
+    скетчей, еще не заполненные из агрегатов), возвращается None: такую
+    метрику нужно считать по дневным агрегатам.
+
+    Args:
+        ranges: имя метрики -> (первый день, последний день)
+    """
+    today = datetime.now(timezone.utc).date()
+    days = sorted({
+        day for start_day, end_day in ranges.values()
+        for day in sketch_days(start_day, min(end_day, today))
+    })
+
+    redis_client = await get_redis()
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for day in days:
+            pipe.exists(sketch_key(day))
+        for start_day, end_day in ranges.values():
+            pipe.pfcount(*sketch_keys(start_day, end_day))
+        results = await pipe.execute()
+
+    missing = {day for day, found in zip(days, results) if not found}
+    counts: Dict[str, Optional[int]] = {}
+    for (name, (start_day, end_day)), count in zip(ranges.items(), results[len(days):]):
+        complete = not any(start_day <= day <= end_day for day in missing)
+        counts[name] = count if complete else None
+    return counts
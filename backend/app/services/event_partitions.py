@@ -0,0 +1,176 @@
+"""Управление месячными секциями таблицы usage_events"""
+
+import re
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import structlog
+from sqlalchemy import text
+
+from ..config import settings
+from ..database import async_sessionmaker
+
+logger = structlog.get_logger()
+
+PARENT_TABLE = "usage_events"
+DEFAULT_PARTITION = "usage_events_default"
+PARTITION_NAME_RE = re.compile(r"^usage_events_p(\d{4})_(\d{2})$")
+
+# Ключ advisory-блокировки: секциями одновременно управляет только один воркер
+PARTITIONS_LOCK_QUERY = "SELECT pg_advisory_xact_lock(hashtext('usage_event_partitions'))"
+
+LIST_PARTITIONS_QUERY = """
+    SELECT child.relname
+    FROM pg_inherits
+    JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE parent.relname = :parent
+"""
+
+
+def month_start(value: date) -> date:
+    """Первое число месяца"""
+    return value.replace(day=1)
+
+
+def add_months(value: date, months: int) -> date:
+    """Сдвигает первое число месяца на months месяцев"""
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    """Имя секции месяца: usage_events_pYYYY_MM"""
+    return f"{PARENT_TABLE}_p{month.year:04d}_{month.month:02d}"
+
+
+def partition_month(name: str) -> Optional[date]:
+    """Месяц секции по ее имени или None для чужих таблиц"""
+    match = PARTITION_NAME_RE.match(name)
+    if match is None:
+        return None
+    return date(int(match.group(1)), int(match.group(2)), 1)
+
+
+def partition_bounds(month: date) -> Tuple[str, str]:
+    """Границы секции [начало месяца, начало следующего) в UTC"""
+    return f"{month.isoformat()} 00:00:00+00", f"{add_months(month, 1).isoformat()} 00:00:00+00"
+
+
+def retention_cutoff(today: date, retention_months: int) -> Optional[date]:
+    """Первый хранимый месяц или None, если события хранятся всегда"""
+    if retention_months <= 0:
+        return None
+    return add_months(month_start(today), -retention_months)
+
+
+def plan_partitions(existing: List[str], today: date, ahead_months: int, retention_months: int) -> Tuple[List[date], List[str]]:
+    """
+    Какие секции создать и какие удалить
+
+    Returns:
+        (месяцы для создания, имена секций для удаления)
+    """
+    current = month_start(today)
+    existing_months = {month for month in map(partition_month, existing) if month is not None}
+
+    to_create = [
+        month for month in (add_months(current, offset) for offset in range(ahead_months + 1))
+        if month not in existing_months
+    ]
+
+    to_drop: List[str] = []
+    oldest_kept = retention_cutoff(today, retention_months)
+    if oldest_kept is not None:
+        to_drop = sorted(partition_name(month) for month in existing_months if month < oldest_kept)
+
+    return to_create, to_drop
+
+
+async def _create_partition(session, month: date) -> int:
+    """
+    Создает секцию месяца
+
+    Строки этого месяца, уже попавшие в секцию по умолчанию, переносятся
+    в новую секцию до ATTACH — иначе Postgres отклонит подключение.
+    """
+    name = partition_name(month)
+    start, end = partition_bounds(month)
+
+    await session.execute(text(
+        f"CREATE TABLE {name} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+    ))
+    moved = await session.execute(
+        text(f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION}
+                WHERE created_at >= CAST(:start AS timestamptz) AND created_at < CAST(:end AS timestamptz)
+                RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        """),
+        {"start": start, "end": end}
+    )
+    await session.execute(text(
+        f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')"
+    ))
+    return moved.rowcount or 0
+
+
+async def manage_usage_event_partitions(today: Optional[date] = None) -> Dict[str, Any]:
+    """
+    Создает секции на stats_partitions_ahead_months вперед и, если задан
+    stats_events_retention_months, удаляет события старше этого срока
+
+    Удаление включается явно (по умолчанию события хранятся всегда).
+    Датированные секции удаляются через DETACH + DROP, без DELETE по
+    таблице; старые строки секции по умолчанию (месяцы, для которых
+    секций нет) удаляются по тому же сроку.
+
+    Returns:
+        Dict с созданными и удаленными секциями и числом строк, удаленных
+        из секции по умолчанию
+    """
+    today = today or datetime.now(timezone.utc).date()
+
+    async with async_sessionmaker() as session:
+        try:
+            await session.execute(text(PARTITIONS_LOCK_QUERY))
+            result = await session.execute(text(LIST_PARTITIONS_QUERY), {"parent": PARENT_TABLE})
+            to_create, to_drop = plan_partitions(
+                [name for (name,) in result.fetchall()],
+                today,
+                settings.stats_partitions_ahead_months,
+                settings.stats_events_retention_months,
+            )
+
+            created = []
+            for month in to_create:
+                moved = await _create_partition(session, month)
+                created.append(partition_name(month))
+                logger.info("Usage events partition created", partition=partition_name(month), moved_rows=moved)
+
+            for name in to_drop:
+                await session.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+                await session.execute(text(f"DROP TABLE {name}"))
+                logger.info("Usage events partition dropped", partition=name)
+
+            default_deleted = 0
+            oldest_kept = retention_cutoff(today, settings.stats_events_retention_months)
+            if oldest_kept is not None:
+                deleted = await session.execute(
+                    text(f"DELETE FROM {DEFAULT_PARTITION} WHERE created_at < CAST(:cutoff AS timestamptz)"),
+                    {"cutoff": f"{oldest_kept.isoformat()} 00:00:00+00"}
+                )
+                default_deleted = deleted.rowcount or 0
+                if default_deleted:
+                    logger.info("Expired usage events deleted from default partition", rows=default_deleted)
+
+            await session.commit()
+
+        except Exception as e:
+            await session.rollback()
+            logger.error("Usage events partition maintenance failed", error=str(e))
+            raise
+
+    return {"created": created, "dropped": to_drop, "default_deleted": default_deleted}
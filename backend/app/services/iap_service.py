@@ -0,0 +1,382 @@
+"""Проверка квитанций IAP через Apple App Store"""
+
+import asyncio
+import hashlib
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import structlog
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..database import async_sessionmaker
+from ..models.iap_receipt import IAPReceipt
+from ..schemas import IAPVerifyResponse
+from ..utils.http_clients import http_clients
+from ..utils.prometheus import track_external_call
+from ..utils.rate_limiter import RateLimiter
+from ..utils.singleflight import SingleFlight
+from .premium_index import record_premium
+
+logger = structlog.get_logger()
+
+PREMIUM_PRODUCT_ID = "com.azg.Convertik"
+
+ENVIRONMENT_PRODUCTION = "production"
+ENVIRONMENT_SANDBOX = "sandbox"
+
+VERIFY_URLS = {
+    ENVIRONMENT_PRODUCTION: "https://buy.itunes.apple.com/verifyReceipt",
+    ENVIRONMENT_SANDBOX: "https://sandbox.itunes.apple.com/verifyReceipt",
+}
+
+# Статус Apple: sandbox-квитанция отправлена в production
+STATUS_SANDBOX_RECEIPT = 21007
+
+# Одновременные проверки одной квитанции с одного устройства выполняются один раз
+_verify_flight = SingleFlight()
+
+
+class AppleUnavailableError(Exception):
+    """Не удалось получить ответ от verifyReceipt"""
+
+
+class ReceiptRejectedError(Exception):
+    """Apple вернул ненулевой статус квитанции"""
+
+    def __init__(self, apple_status: Any):
+        super().__init__(f"Apple status {apple_status}")
+        self.apple_status = apple_status
+
+
+def receipt_hash(receipt_data: str) -> str:
+    """SHA-256 квитанции — ключ кэша проверок"""
+    return hashlib.sha256(receipt_data.encode()).hexdigest()
+
+
+async def verify_receipt_with_apple(
+    receipt_data: str,
+    use_sandbox: bool = False
+) -> dict:
+    """
+    Проверка квитанции через Apple App Store
+    
+    Args:
+        receipt_data: Base64-encoded receipt data
+        use_sandbox: Whether to use sandbox environment
+    
+    Returns:
+        Apple's verification response
+    """
+    environment = ENVIRONMENT_SANDBOX if use_sandbox else ENVIRONMENT_PRODUCTION
+    
+    # Секретный ключ для проверки (если используется)
+    verify_payload = {
+        "receipt-data": receipt_data,
+        "password": getattr(settings, "app_store_shared_secret", None),  # Опционально
+        "exclude-old-transactions": True
+    }
+    
+    try:
+        upstream = f"apple_{environment}"
+        with track_external_call(upstream):
+            response = await http_clients.get(upstream).post(VERIFY_URLS[environment], json=verify_payload)
+            response.raise_for_status()
+        return response.json()
+    except httpx.HTTPError as e:
+        logger.error(
+            "Failed to verify receipt with Apple",
+            error=str(e),
+            use_sandbox=use_sandbox
+        )
+        raise AppleUnavailableError(str(e)) from e
+
+
+async def verify_with_known_environment(
+    receipt_data: str,
+    environment: Optional[str]
+) -> Tuple[Dict[str, Any], str]:
+    """
+    Проверяет квитанцию в ее окружении
+
+    Если окружение неизвестно, сначала проверяем в production, а при
+    статусе 21007 (sandbox receipt used in production) — в sandbox.
+    Для известной sandbox-квитанции запрос в production не делается.
+
+    Returns:
+        (ответ Apple, окружение квитанции)
+    """
+    if environment == ENVIRONMENT_SANDBOX:
+        return await verify_receipt_with_apple(receipt_data, use_sandbox=True), ENVIRONMENT_SANDBOX
+
+    apple_response = await verify_receipt_with_apple(receipt_data, use_sandbox=False)
+    if apple_response.get("status") == STATUS_SANDBOX_RECEIPT:
+        logger.info("Received sandbox receipt in production, verifying in sandbox")
+        return await verify_receipt_with_apple(receipt_data, use_sandbox=True), ENVIRONMENT_SANDBOX
+    return apple_response, ENVIRONMENT_PRODUCTION
+
+
+async def find_fresh_receipt_state(db: AsyncSession, hash_value: str) -> Optional[IAPVerifyResponse]:
+    """
+    Сохраненный статус Premium для квитанции, если ему можно доверять
+
+    Статус свежий, пока подписка не истекла и с последней проверки
+    прошло меньше iap_verify_cache_seconds.
+    """
+    now = datetime.now(tz=timezone.utc)
+    result = await db.execute(
+        select(func.max(IAPReceipt.expires_at)).where(
+            IAPReceipt.receipt_hash == hash_value,
+            IAPReceipt.expires_at > now,
+            IAPReceipt.last_check >= now - timedelta(seconds=settings.iap_verify_cache_seconds),
+        )
+    )
+    expires_at = result.scalar()
+    if expires_at is None:
+        return None
+    return IAPVerifyResponse(premium=True, expires_at=expires_at)
+
+
+async def _known_environment(db: AsyncSession, hash_value: str) -> Optional[str]:
+    result = await db.execute(
+        select(IAPReceipt.environment)
+        .where(IAPReceipt.receipt_hash == hash_value, IAPReceipt.environment.is_not(None))
+        .limit(1)
+    )
+    return result.scalar_one_or_none()
+
+
+async def store_verification(
+    db: AsyncSession,
+    device_id: uuid.UUID,
+    receipt_data: str,
+    hash_value: str,
+    environment: str,
+    apple_response: Dict[str, Any]
+) -> IAPVerifyResponse:
+    """Сохраняет результат проверки Apple и возвращает статус Premium"""
+    # Извлекаем информацию о покупках
+    receipt = apple_response.get("receipt", {})
+    in_app = receipt.get("in_app", [])
+    
+    # Проверяем наличие подписки
+    is_premium = False
+    expires_at: Optional[datetime] = None
+    
+    for purchase in in_app:
+        # Проверяем product_id
+        product_id = purchase.get("product_id")
+        if product_id == PREMIUM_PRODUCT_ID:
+            # Проверяем транзакцию
+            transaction_id = purchase.get("original_transaction_id")
+            
+            # Получаем или создаем запись в БД
+            stmt = select(IAPReceipt).where(
+                IAPReceipt.original_tx_id == transaction_id
+            )
+            result = await db.execute(stmt)
+            iap_receipt = result.scalar_one_or_none()
+            
+            # Определяем дату истечения подписки
+            expires_date_ms = purchase.get("expires_date_ms")
+            if expires_date_ms:
+                expires_at = datetime.fromtimestamp(
+                    int(expires_date_ms) / 1000,
+                    tz=timezone.utc
+                )
+                
+                # Проверяем, не истекла ли подписка
+                if expires_at > datetime.now(tz=timezone.utc):
+                    is_premium = True
+                    
+                    # Обновляем или создаем запись в БД
+                    if iap_receipt:
+                        iap_receipt.expires_at = expires_at
+                        iap_receipt.last_check = datetime.now(tz=timezone.utc)
+                    else:
+                        iap_receipt = IAPReceipt(
+                            original_tx_id=transaction_id,
+                            device_id=device_id,
+                            product_id=product_id,
+                            expires_at=expires_at,
+                            last_check=datetime.now(tz=timezone.utc)
+                        )
+                        db.add(iap_receipt)
+                    
+                    # Запоминаем квитанцию и ее окружение для кэша и повторных проверок
+                    iap_receipt.receipt_hash = hash_value
+                    iap_receipt.receipt_data = receipt_data
+                    iap_receipt.environment = environment
+                    
+                    await db.commit()
+                    await record_premium(device_id, expires_at)
+                    
+                    logger.info(
+                        "Premium subscription found",
+                        device_id=str(device_id),
+                        expires_at=expires_at.isoformat()
+                    )
+    
+    return IAPVerifyResponse(
+        premium=is_premium,
+        expires_at=expires_at
+    )
+
+
+async def _verify_and_store(
+    db: AsyncSession,
+    device_id: uuid.UUID,
+    receipt_data: str,
+    hash_value: str
+) -> IAPVerifyResponse:
+    environment = await _known_environment(db, hash_value)
+    apple_response, environment = await verify_with_known_environment(receipt_data, environment)
+
+    # Проверяем статус ответа от Apple
+    status = apple_response.get("status")
+    if status != 0:
+        raise ReceiptRejectedError(status)
+
+    return await store_verification(db, device_id, receipt_data, hash_value, environment, apple_response)
+
+
+async def verify_receipt(
+    db: AsyncSession,
+    device_id: uuid.UUID,
+    receipt_data: str
+) -> Tuple[IAPVerifyResponse, bool]:
+    """
+    Статус Premium по квитанции
+
+    Сначала проверяет сохраненный статус по хэшу квитанции, при промахе
+    идет в Apple. Одновременные проверки одной квитанции с одного
+    устройства объединяются. device_id входит в ключ: лидер записывает
+    результат со своим device_id, и запрос другого устройства с той же
+    квитанцией не должен получить запись, сделанную за чужое устройство.
+
+    Returns:
+        (статус, взят ли статус из БД без запроса к Apple)
+    """
+    hash_value = receipt_hash(receipt_data)
+
+    cached = await find_fresh_receipt_state(db, hash_value)
+    if cached is not None:
+        return cached, True
+
+    response = await _verify_flight.do(
+        (hash_value, device_id),
+        lambda: _verify_and_store(db, device_id, receipt_data, hash_value)
+    )
+    return response, False
+
+
+async def _revalidate_receipt(receipt: Any) -> str:
+    """Перепроверяет одну квитанцию в собственной сессии БД, возвращает исход"""
+    try:
+        apple_response, environment = await verify_with_known_environment(receipt.receipt_data, receipt.environment)
+    except AppleUnavailableError:
+        return "unavailable"
+
+    status = apple_response.get("status")
+    if status != 0:
+        logger.warning("Receipt rejected on revalidation", apple_status=status, device_id=str(receipt.device_id))
+        return "rejected"
+
+    async with async_sessionmaker() as session:
+        response = await store_verification(
+            session, receipt.device_id, receipt.receipt_data, receipt.receipt_hash, environment, apple_response
+        )
+    return "premium" if response.premium else "expired"
+
+
+async def claim_expiring_receipts() -> List[Any]:
+    """
+    Забирает квитанции для перепроверки
+
+    Квитанции с expires_at в окне [now - grace, now + ahead], которые не
+    проверялись и не забирались на перепроверку
+    iap_revalidate_min_interval_minutes, в порядке expires_at, last_check.
+    Захват отмечается в revalidate_claimed_at (FOR UPDATE SKIP LOCKED),
+    поэтому воркеры, запустившие задачу одновременно, не берут одни и те же
+    квитанции, а неудачная проверка повторится через min_interval.
+    last_check не трогается: его обновляет только подтвержденный Apple
+    ответ, иначе find_fresh_receipt_state отдавал бы Premium по квитанции,
+    которую Apple не подтвердил.
+    """
+    now = datetime.now(tz=timezone.utc)
+    min_interval_start = now - timedelta(minutes=settings.iap_revalidate_min_interval_minutes)
+    candidates = (
+        select(IAPReceipt.original_tx_id)
+        .where(
+            IAPReceipt.receipt_data.is_not(None),
+            IAPReceipt.expires_at >= now - timedelta(hours=settings.iap_revalidate_grace_hours),
+            IAPReceipt.expires_at <= now + timedelta(hours=settings.iap_revalidate_ahead_hours),
+            IAPReceipt.last_check < min_interval_start,
+            or_(
+                IAPReceipt.revalidate_claimed_at.is_(None),
+                IAPReceipt.revalidate_claimed_at < min_interval_start,
+            ),
+        )
+        .order_by(IAPReceipt.expires_at, IAPReceipt.last_check)
+        .limit(settings.iap_revalidate_batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    async with async_sessionmaker() as session:
+        result = await session.execute(
+            update(IAPReceipt)
+            .where(IAPReceipt.original_tx_id.in_(candidates))
+            # last_check указан явно, иначе onupdate модели выставит его в now()
+            .values(revalidate_claimed_at=now, last_check=IAPReceipt.last_check)
+            .returning(
+                IAPReceipt.device_id,
+                IAPReceipt.receipt_hash,
+                IAPReceipt.receipt_data,
+                IAPReceipt.environment,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        rows = result.all()
+        await session.commit()
+    return rows
+
+
+async def revalidate_expiring_receipts() -> Dict[str, int]:
+    """
+    Фоновая перепроверка подписок, истекающих в ближайшее время
+
+    Запросы к Apple идут не более чем iap_revalidate_concurrency
+    одновременно и с частотой не выше iap_revalidate_rate_per_second.
+    Продления попадают в БД до истечения сохраненной подписки без
+    участия клиента, и /iap/verify отвечает из БД.
+
+    Returns:
+        Dict с количеством квитанций по исходам проверки
+    """
+    # Одна квитанция может содержать несколько транзакций — проверяем ее один раз
+    receipts: Dict[str, Any] = {}
+    for row in await claim_expiring_receipts():
+        receipts.setdefault(row.receipt_hash, row)
+
+    semaphore = asyncio.Semaphore(settings.iap_revalidate_concurrency)
+    limiter = RateLimiter(settings.iap_revalidate_rate_per_second)
+    outcomes: Counter = Counter()
+
+    async def revalidate(receipt: Any) -> None:
+        async with semaphore:
+            await limiter.acquire()
+            try:
+                outcomes[await _revalidate_receipt(receipt)] += 1
+            except Exception as e:
+                outcomes["error"] += 1
+                logger.error("Receipt revalidation failed", error=str(e), exc_info=True)
+
+    await asyncio.gather(*(revalidate(receipt) for receipt in receipts.values()))
+
+    result_counts = {"receipts": len(receipts), **outcomes}
+    if receipts:
+        logger.info("Expiring receipts revalidated", **result_counts)
+    return result_counts
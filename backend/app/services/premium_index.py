@@ -0,0 +1,89 @@
+"""Индекс Premium-статуса устройств в памяти процесса"""
+
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+import structlog
+from sqlalchemy import func, select
+
+from ..database import async_sessionmaker
+from ..models.iap_receipt import IAPReceipt
+from .pubsub import publish_event
+
+logger = structlog.get_logger()
+
+# Канал pub/sub с обновлениями подписок от других воркеров
+PREMIUM_UPDATED_CHANNEL = "iap:premium"
+
+
+class PremiumIndex:
+    """
+    Индекс device_id -> окончание подписки
+
+    Ключ — 128-битное число UUID, значение — Unix-время окончания в секундах:
+    компактнее словаря объектов UUID/datetime, а проверка — один dict lookup
+    без обращения к БД и сети. Хранятся только неистекшие подписки.
+    """
+
+    def __init__(self):
+        self._expires: Dict[int, int] = {}
+        self.loaded = False
+
+    def __len__(self) -> int:
+        return len(self._expires)
+
+    def status(self, device_id: uuid.UUID, now: Optional[float] = None) -> Tuple[bool, Optional[datetime]]:
+        """(premium, окончание подписки) устройства"""
+        expires = self._expires.get(device_id.int)
+        if expires is None:
+            return False, None
+        now = now if now is not None else datetime.now(timezone.utc).timestamp()
+        return expires > now, datetime.fromtimestamp(expires, tz=timezone.utc)
+
+    def update(self, device_id: uuid.UUID, expires_at: datetime) -> None:
+        """Запоминает окончание подписки (более раннее значение не перезаписывает позднее)"""
+        expires = int(expires_at.timestamp())
+        key = device_id.int
+        if expires > self._expires.get(key, 0):
+            self._expires[key] = expires
+
+    async def load(self) -> int:
+        """Полностью перестраивает индекс по неистекшим подпискам из iap_receipts"""
+        async with async_sessionmaker() as session:
+            result = await session.execute(
+                select(IAPReceipt.device_id, func.max(IAPReceipt.expires_at))
+                .where(IAPReceipt.expires_at > func.now())
+                .group_by(IAPReceipt.device_id)
+            )
+            expires = {device_id.int: int(expires_at.timestamp()) for device_id, expires_at in result.all()}
+
+        # Замена одной операцией присваивания: читатели не видят частично загруженный индекс
+        self._expires = expires
+        self.loaded = True
+        logger.info("Premium index loaded", devices=len(expires))
+        return len(expires)
+
+
+async def record_premium(device_id: uuid.UUID, expires_at: datetime) -> None:
+    """Обновляет индекс процесса и рассылает подписку остальным воркерам"""
+    premium_index.update(device_id, expires_at)
+    try:
+        await publish_event(
+            PREMIUM_UPDATED_CHANNEL,
+            {"device_id": str(device_id), "expires_at": int(expires_at.timestamp())}
+        )
+    except Exception as e:
+        logger.warning("Failed to publish premium update", error=str(e))
+
+
+async def handle_premium_updated(message: Dict[str, Any]) -> None:
+    """Обработчик PREMIUM_UPDATED_CHANNEL"""
+    premium_index.update(
+        uuid.UUID(message["device_id"]),
+        datetime.fromtimestamp(int(message["expires_at"]), tz=timezone.utc)
+    )
+
+
+# Глобальный индекс процесса
+premium_index = PremiumIndex()
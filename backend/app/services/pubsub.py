@@ -0,0 +1,108 @@
+"""Рассылка событий между воркерами через Redis pub/sub"""
+
+import asyncio
+import json
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import structlog
+
+from ..database import get_redis
+
+logger = structlog.get_logger()
+
+Message = Dict[str, Any]
+Handler = Callable[[Message], Awaitable[None]]
+
+
+async def publish_event(channel: str, message: Message) -> int:
+    """
+    Публикует JSON-сообщение в канал
+
+    Returns:
+        int: количество получивших сообщение подписчиков
+    """
+    redis_client = await get_redis()
+    return await redis_client.publish(channel, json.dumps(message, default=str))
+
+
+class PubSubListener:
+    """
+    Подписчик Redis pub/sub процесса
+
+    Модули регистрируют обработчики каналов через subscribe() до start().
+    Одно соединение обслуживает все каналы; при обрыве слушатель
+    переподключается через reconnect_delay_seconds. Ошибка обработчика
+    логируется и не останавливает прием сообщений.
+    """
+
+    def __init__(self, reconnect_delay_seconds: float = 1.0):
+        self.reconnect_delay_seconds = reconnect_delay_seconds
+        self._handlers: Dict[str, List[Handler]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self, channel: str, handler: Handler) -> None:
+        """Регистрирует обработчик сообщений канала"""
+        self._handlers.setdefault(channel, []).append(handler)
+
+    async def start(self) -> None:
+        """Запускает фоновое чтение подписок"""
+        if self._task is not None or not self._handlers:
+            return
+        self._task = asyncio.create_task(self._run())
+        logger.info("Pub/sub listener started", channels=sorted(self._handlers))
+
+    async def stop(self) -> None:
+        """Останавливает фоновое чтение подписок"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info("Pub/sub listener stopped")
+
+    async def dispatch(self, channel: str, data: Any) -> None:
+        """Передает сообщение обработчикам канала"""
+        try:
+            message = json.loads(data)
+        except (TypeError, ValueError) as e:
+            logger.warning("Malformed pub/sub message", channel=channel, error=str(e))
+            return
+
+        for handler in self._handlers.get(channel, ()):
+            try:
+                await handler(message)
+            except Exception as e:
+                logger.error("Pub/sub handler failed", channel=channel, error=str(e), exc_info=True)
+
+    async def _run(self) -> None:
+        while True:
+            pubsub = None
+            try:
+                redis_client = await get_redis()
+                pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+                await pubsub.subscribe(*self._handlers)
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    channel = message["channel"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    await self.dispatch(channel, message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Pub/sub connection lost, reconnecting", error=str(e))
+                await asyncio.sleep(self.reconnect_delay_seconds)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.reset()
+                    except Exception:
+                        pass
+
+
+# Глобальный подписчик процесса
+pubsub_listener = PubSubListener()
@@ -0,0 +1,616 @@
+"""Регистрация push-токенов и рассылка уведомлений по сегментам"""
+
+import asyncio
+import json
+import uuid
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import structlog
+from sqlalchemy import delete, exists, func, or_, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+from ..config import settings
+from ..database import async_sessionmaker, get_redis
+from ..models.iap_receipt import IAPReceipt
+from ..models.push_token import PushToken
+from ..utils.prometheus import PUSH_NOTIFICATIONS
+from .apns import APNsClient, APNsConfigurationError, apns_client
+
+logger = structlog.get_logger()
+
+TokenRow = Tuple[uuid.UUID, str]
+
+# Платформы, для которых есть отправитель (Android/FCM пока не подключен)
+SUPPORTED_PLATFORMS = ("ios",)
+
+# Сколько завершенных рассылок помнить в памяти процесса
+MAX_FINISHED_JOBS = 50
+
+# Состояние рассылок в Redis: GET /admin/push/jobs/{job_id} отвечает на любом воркере
+PUSH_JOB_PREFIX = "push:job:"
+
+
+@dataclass(frozen=True)
+class PushSegment:
+    """
+    Фильтр получателей рассылки
+
+    locale и app_version сравниваются по префиксу с границей компонента:
+    "ru" совпадает с ru-RU, "1.2" — с 1.2 и 1.2.3, но не с 1.20.
+    """
+    premium: Optional[bool] = None
+    locale: Optional[str] = None
+    platform: Optional[str] = None
+    app_version: Optional[str] = None
+
+
+def _prefix_filter(column, value: str, separator: str):
+    return or_(column == value, column.like(f"{value}{separator}%"))
+
+
+def segment_query(segment: PushSegment) -> Select:
+    """SELECT device_id, token по push_tokens для сегмента"""
+    platforms = [p for p in SUPPORTED_PLATFORMS if segment.platform in (None, p)]
+    query = select(PushToken.device_id, PushToken.token).where(PushToken.platform.in_(platforms))
+
+    if segment.locale:
+        query = query.where(_prefix_filter(PushToken.locale, segment.locale, "-"))
+    if segment.app_version:
+        query = query.where(_prefix_filter(PushToken.app_version, segment.app_version, "."))
+    if segment.premium is not None:
+        # Флаг is_premium в push_tokens фиксируется при регистрации и может
+        # устареть, поэтому подписка проверяется по iap_receipts
+        active = exists().where(
+            IAPReceipt.device_id == PushToken.device_id,
+            IAPReceipt.expires_at > func.now(),
+        )
+        query = query.where(active if segment.premium else ~active)
+    return query
+
+
+async def stream_segment_tokens(segment: PushSegment, batch_size: int) -> AsyncIterator[TokenRow]:
+    """
+    Токены сегмента через серверный курсор
+
+    Строки читаются из PostgreSQL порциями по batch_size, поэтому память
+    не растет с размером сегмента.
+    """
+    async with async_sessionmaker() as session:
+        result = await session.stream(segment_query(segment).execution_options(yield_per=batch_size))
+        async for partition in result.partitions():
+            for device_id, token in partition:
+                yield device_id, token
+
+
+async def delete_push_tokens(rows: List[TokenRow]) -> int:
+    """
+    Удаляет недействительные токены
+
+    Совпадение проверяется по паре (device_id, token): если устройство успело
+    зарегистрировать новый токен во время рассылки, он не удаляется.
+    """
+    async with async_sessionmaker() as session:
+        result = await session.execute(
+            delete(PushToken).where(tuple_(PushToken.device_id, PushToken.token).in_(rows))
+        )
+        await session.commit()
+    return result.rowcount
+
+
+async def fetch_device_tokens(device_ids: List[uuid.UUID]) -> Dict[uuid.UUID, str]:
+    """Токены устройств с поддерживаемой платформой одним запросом"""
+    async with async_sessionmaker() as session:
+        result = await session.execute(
+            select(PushToken.device_id, PushToken.token).where(
+                PushToken.device_id.in_(device_ids),
+                PushToken.platform.in_(SUPPORTED_PLATFORMS),
+            )
+        )
+        return {device_id: token for device_id, token in result.all()}
+
+
+async def register_push_token(
+    db: AsyncSession,
+    device_id: uuid.UUID,
+    token: str,
+    platform: str,
+    locale: Optional[str],
+    app_version: Optional[str],
+    is_premium: bool,
+) -> None:
+    """Создает или обновляет токен устройства"""
+    values = {
+        "token": token,
+        "platform": platform,
+        "locale": locale,
+        "app_version": app_version,
+        "is_premium": is_premium,
+    }
+    statement = insert(PushToken).values(device_id=device_id, **values)
+    await db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[PushToken.device_id],
+            set_={**values, "updated_at": func.now()},
+        )
+    )
+    await db.commit()
+
+
+def build_apns_payload(message: str, title: Optional[str], payload: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Тело уведомления APNs: alert в aps, дополнительные данные на верхнем уровне"""
+    alert: Dict[str, Any] = {"body": message}
+    if title:
+        alert["title"] = title
+    body: Dict[str, Any] = {k: v for k, v in (payload or {}).items() if k != "aps"}
+    body["aps"] = {"alert": alert, "sound": "default"}
+    return body
+
+
+async def fan_out(
+    sender: APNsClient,
+    rows: AsyncIterator[Tuple[uuid.UUID, str, bytes]],
+    concurrency: int,
+    pruner: Callable[[List[TokenRow]], Awaitable[int]],
+    prune_batch_size: int,
+    counts: Any,
+) -> None:
+    """
+    Отправляет уведомления (device_id, token, тело APNs) с ограничением параллелизма
+
+    Перед созданием задачи отправки берется слот семафора, поэтому в полете
+    не больше concurrency запросов, а чтение rows приостанавливается, пока
+    APNs не ответит. Недействительные токены удаляются пачками по
+    prune_batch_size. Итоги накапливаются в атрибутах counts
+    (matched, sent, failed, pruned).
+    """
+    slots = asyncio.Semaphore(concurrency)
+    in_flight: Set[asyncio.Task] = set()
+    invalid: List[TokenRow] = []
+
+    async def send_one(device_id: uuid.UUID, token: str, body: bytes) -> None:
+        try:
+            result = await sender.send(token, body)
+        except Exception as e:
+            counts.failed += 1
+            PUSH_NOTIFICATIONS.labels(outcome="failed").inc()
+            logger.debug("Push delivery error", error=str(e))
+            return
+        finally:
+            slots.release()
+
+        if result.ok:
+            counts.sent += 1
+            PUSH_NOTIFICATIONS.labels(outcome="sent").inc()
+        elif result.token_invalid:
+            invalid.append((device_id, token))
+        else:
+            counts.failed += 1
+            PUSH_NOTIFICATIONS.labels(outcome="failed").inc()
+
+    async def prune() -> None:
+        batch = invalid[:]
+        del invalid[:]
+        try:
+            counts.pruned += await pruner(batch)
+        except Exception as e:
+            logger.error("Failed to prune push tokens", tokens=len(batch), error=str(e))
+            return
+        PUSH_NOTIFICATIONS.labels(outcome="pruned").inc(len(batch))
+
+    try:
+        async for device_id, token, body in rows:
+            counts.matched += 1
+            await slots.acquire()
+            task = asyncio.create_task(send_one(device_id, token, body))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+
+            if len(invalid) >= prune_batch_size:
+                await prune()
+
+        if in_flight:
+            await asyncio.gather(*in_flight)
+        if invalid:
+            await prune()
+    finally:
+        for task in in_flight:
+            task.cancel()
+
+
+@dataclass
+class PushJob:
+    """Состояние одной рассылки"""
+    job_id: str
+    segment: PushSegment
+    status: str = "running"
+    matched: int = 0
+    sent: int = 0
+    failed: int = 0
+    pruned: int = 0
+    started_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+
+    def to_json(self) -> str:
+        data = asdict(self)
+        data["started_at"] = self.started_at.isoformat()
+        data["finished_at"] = self.finished_at.isoformat() if self.finished_at else None
+        return json.dumps(data)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "PushJob":
+        data = json.loads(raw)
+        data["segment"] = PushSegment(**data["segment"])
+        data["started_at"] = datetime.fromisoformat(data["started_at"])
+        if data["finished_at"]:
+            data["finished_at"] = datetime.fromisoformat(data["finished_at"])
+        return cls(**data)
+
+
+class PushDispatcher:
+    """
+    Фоновые рассылки push-уведомлений по сегментам
+
+    Токены сегмента читаются серверным курсором и передаются в fan_out:
+    пока APNs не ответит на concurrency запросов, следующие строки
+    из курсора не читаются, поэтому память не растет с размером сегмента.
+
+    Рассылка выполняется на воркере, который ее запустил. Ее состояние
+    пишется в Redis при запуске, каждые progress_interval_seconds и по
+    завершении и хранится job_ttl_seconds, поэтому get() находит рассылку
+    на любом воркере.
+    """
+
+    def __init__(
+        self,
+        sender: APNsClient,
+        concurrency: int,
+        stream_batch_size: int,
+        prune_batch_size: int,
+        job_ttl_seconds: int = 86400,
+        progress_interval_seconds: float = 5.0,
+        token_source: Callable[[PushSegment, int], AsyncIterator[TokenRow]] = stream_segment_tokens,
+        pruner: Callable[[List[TokenRow]], Awaitable[int]] = delete_push_tokens,
+        redis_factory: Callable[[], Awaitable[Any]] = get_redis,
+    ):
+        self._sender = sender
+        self.concurrency = concurrency
+        self.stream_batch_size = stream_batch_size
+        self.prune_batch_size = prune_batch_size
+        self.job_ttl_seconds = job_ttl_seconds
+        self.progress_interval_seconds = progress_interval_seconds
+        self._token_source = token_source
+        self._pruner = pruner
+        self._redis_factory = redis_factory
+        self._jobs: Dict[str, PushJob] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def get(self, job_id: str) -> Optional[PushJob]:
+        """
+        Рассылка по id
+
+        Рассылки этого воркера берутся из памяти, остальные — из Redis
+        (None, если рассылки нет или Redis недоступен).
+        """
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        try:
+            redis_client = await self._redis_factory()
+            raw = await redis_client.get(f"{PUSH_JOB_PREFIX}{job_id}")
+        except Exception as e:
+            logger.warning("Failed to read push job state", job_id=job_id, error=str(e))
+            return None
+        return PushJob.from_json(raw) if raw else None
+
+    async def start(self, segment: PushSegment, notification: Dict[str, Any]) -> PushJob:
+        """
+        Запускает рассылку в фоне
+
+        Raises:
+            APNsConfigurationError: не настроены ключи APNs
+        """
+        # Ошибка конфигурации должна вернуться клиенту, а не тысячу раз в логи
+        self._sender.provider_token()
+
+        job = PushJob(job_id=uuid.uuid4().hex, segment=segment)
+        self._jobs[job.job_id] = job
+        self._forget_finished()
+        await self._save(job)
+
+        body = json.dumps(notification, ensure_ascii=False).encode()
+        task = asyncio.create_task(self._run(job, body))
+        self._tasks[job.job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.job_id, None))
+        logger.info("Push job started", job_id=job.job_id, segment=segment.__dict__)
+        return job
+
+    def _forget_finished(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.status != "running"]
+        for job_id in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self._jobs[job_id]
+
+    async def stop(self) -> None:
+        """Прерывает незавершенные рассылки (остановка приложения)"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _save(self, job: PushJob) -> None:
+        """Записывает состояние рассылки в Redis"""
+        try:
+            redis_client = await self._redis_factory()
+            await redis_client.set(f"{PUSH_JOB_PREFIX}{job.job_id}", job.to_json(), ex=self.job_ttl_seconds)
+        except Exception as e:
+            logger.warning("Failed to save push job state", job_id=job.job_id, error=str(e))
+
+    async def _report_progress(self, job: PushJob) -> None:
+        while True:
+            await asyncio.sleep(self.progress_interval_seconds)
+            await self._save(job)
+
+    async def _run(self, job: PushJob, body: bytes) -> None:
+        progress = asyncio.create_task(self._report_progress(job))
+        try:
+            await self.deliver(job, body)
+            job.status = "completed"
+        except asyncio.CancelledError:
+            job.status = "failed"
+            job.error = "cancelled"
+            raise
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error("Push job failed", job_id=job.job_id, error=str(e), exc_info=True)
+        finally:
+            progress.cancel()
+            job.finished_at = datetime.now(timezone.utc)
+            await self._save(job)
+            logger.info(
+                "Push job finished",
+                job_id=job.job_id,
+                status=job.status,
+                matched=job.matched,
+                sent=job.sent,
+                failed=job.failed,
+                pruned=job.pruned,
+                duration_seconds=round((job.finished_at - job.started_at).total_seconds(), 1)
+            )
+
+    async def deliver(self, job: PushJob, body: bytes) -> None:
+        """Отправляет уведомление (сериализованное тело APNs) всем токенам сегмента job"""
+        async def rows() -> AsyncIterator[Tuple[uuid.UUID, str, bytes]]:
+            async for device_id, token in self._token_source(job.segment, self.stream_batch_size):
+                yield device_id, token, body
+
+        await fan_out(self._sender, rows(), self.concurrency, self._pruner, self.prune_batch_size, job)
+
+
+@dataclass(frozen=True)
+class PushMessage:
+    """Уведомление одному устройству"""
+    device_id: uuid.UUID
+    message: str
+    title: Optional[str] = None
+    payload: Optional[Dict[str, Any]] = None
+
+    def body(self) -> bytes:
+        return json.dumps(build_apns_payload(self.message, self.title, self.payload), ensure_ascii=False).encode()
+
+
+@dataclass
+class PushCounts:
+    """Итоги отправки пачки адресных уведомлений"""
+    matched: int = 0
+    sent: int = 0
+    failed: int = 0
+    pruned: int = 0
+
+
+class PushQueue:
+    """
+    Очередь адресных push-уведомлений процесса
+
+    Сервисы (например, алерты курсов) кладут сообщения через submit() и не
+    ждут отправки. Фоновая задача забирает их пачками по batch_size, находит
+    токены устройств одним запросом и отправляет через fan_out. Пачка,
+    которую не удалось отправить (ошибка БД или APNs), возвращается в начало
+    очереди и отбрасывается после max_attempts попыток. Размер очереди
+    ограничен max_messages: при переполнении лишние сообщения отбрасываются.
+    """
+
+    def __init__(
+        self,
+        sender: APNsClient,
+        concurrency: int,
+        batch_size: int,
+        flush_interval_seconds: float,
+        max_messages: int,
+        max_attempts: int = 5,
+        token_lookup: Callable[[List[uuid.UUID]], Awaitable[Dict[uuid.UUID, str]]] = fetch_device_tokens,
+        pruner: Callable[[List[TokenRow]], Awaitable[int]] = delete_push_tokens,
+    ):
+        self._sender = sender
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_messages = max_messages
+        self.max_attempts = max_attempts
+        self._token_lookup = token_lookup
+        self._pruner = pruner
+        # Сообщение и число неудачных попыток отправки его пачки
+        self._buffer: List[Tuple[PushMessage, int]] = []
+        self._drop_handlers: List[Callable[[List[PushMessage]], Awaitable[None]]] = []
+        self._wakeup = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        """Количество сообщений, ожидающих отправки"""
+        return len(self._buffer)
+
+    def can_send(self) -> bool:
+        """Настроены ли ключи APNs (без них сообщения не будут доставлены)"""
+        try:
+            self._sender.provider_token()
+        except APNsConfigurationError:
+            return False
+        return True
+
+    def add_drop_handler(self, handler: Callable[[List[PushMessage]], Awaitable[None]]) -> None:
+        """
+        Регистрирует обработчик сообщений, которые очередь отбросила
+
+        Вызывается для сообщений, не отправленных за max_attempts попыток
+        и оставшихся в очереди при остановке. Отказ submit() обработчик не
+        получает: вызывающий видит его по возвращенному числу.
+        """
+        self._drop_handlers.append(handler)
+
+    async def _dropped(self, messages: List[PushMessage]) -> None:
+        if not messages:
+            return
+        for handler in self._drop_handlers:
+            try:
+                await handler(messages)
+            except Exception as e:
+                logger.error("Push drop handler failed", error=str(e), messages_count=len(messages))
+
+    def submit(self, messages: List[PushMessage]) -> int:
+        """
+        Добавляет сообщения в очередь
+
+        Returns:
+            int: сколько сообщений принято
+        """
+        room = max(self.max_messages - len(self._buffer), 0)
+        if len(messages) > room:
+            logger.error("Push queue is full, dropping messages", dropped=len(messages) - room)
+            messages = messages[:room]
+        self._buffer.extend((message, 0) for message in messages)
+        if self._buffer:
+            self._wakeup.set()
+        return len(messages)
+
+    async def flush(self) -> PushCounts:
+        """Отправляет все сообщения очереди пачками по batch_size"""
+        counts = PushCounts()
+        async with self._flush_lock:
+            while self._buffer:
+                batch = self._buffer[:self.batch_size]
+                del self._buffer[:self.batch_size]
+                try:
+                    await self._send_batch([message for message, _ in batch], counts)
+                except Exception as e:
+                    logger.error("Failed to send push messages", error=str(e), batch_size=len(batch))
+                    await self._dropped(self._requeue(batch))
+                    break
+
+        if counts.matched:
+            logger.info(
+                "Push messages sent",
+                sent=counts.sent,
+                failed=counts.failed,
+                pruned=counts.pruned,
+                pending=len(self._buffer)
+            )
+        return counts
+
+    def _requeue(self, batch: List[Tuple[PushMessage, int]]) -> List[PushMessage]:
+        """
+        Возвращает неудачную пачку в начало очереди, если попытки и место не исчерпаны
+
+        Returns:
+            Отброшенные сообщения
+        """
+        retry = [(message, attempts + 1) for message, attempts in batch if attempts + 1 < self.max_attempts]
+        exhausted = [message for message, attempts in batch if attempts + 1 >= self.max_attempts]
+        room = max(self.max_messages - len(self._buffer), 0)
+        dropped = exhausted + [message for message, _ in retry[room:]]
+        if dropped:
+            logger.error("Push messages dropped after failed sends", dropped=len(dropped), max_attempts=self.max_attempts)
+        self._buffer[:0] = retry[:room]
+        return dropped
+
+    async def _send_batch(self, batch: List[PushMessage], counts: PushCounts) -> None:
+        # Без ключей APNs пачка не отправляется (и повторяется до max_attempts)
+        self._sender.provider_token()
+        tokens = await self._token_lookup(list({message.device_id for message in batch}))
+
+        async def rows() -> AsyncIterator[Tuple[uuid.UUID, str, bytes]]:
+            for message in batch:
+                token = tokens.get(message.device_id)
+                if token is not None:
+                    yield message.device_id, token, message.body()
+
+        await fan_out(self._sender, rows(), self.concurrency, self._pruner, self.batch_size, counts)
+
+    async def start(self) -> None:
+        """Запускает фоновую отправку"""
+        if self._task is not None:
+            return
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+        logger.info("Push queue started", batch_size=self.batch_size, max_messages=self.max_messages)
+
+    async def stop(self) -> None:
+        """
+        Останавливает фоновую задачу и отправляет оставшиеся сообщения
+
+        Задача не отменяется: она завершает текущую отправку и выходит из
+        цикла, иначе отмена посреди отправки теряла бы пачку, уже снятую
+        с очереди.
+        """
+        if self._task is not None:
+            self._stopping.set()
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+        await self.flush()
+        if self._buffer:
+            logger.error("Push messages lost on shutdown", messages_count=len(self._buffer))
+            lost = [message for message, _ in self._buffer]
+            self._buffer.clear()
+            await self._dropped(lost)
+        logger.info("Push queue stopped")
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Error sending push messages", error=str(e), exc_info=True)
+
+
+# Глобальный диспетчер рассылок процесса
+push_dispatcher = PushDispatcher(
+    sender=apns_client,
+    concurrency=settings.push_send_concurrency,
+    stream_batch_size=settings.push_stream_batch_size,
+    prune_batch_size=settings.push_prune_batch_size,
+    job_ttl_seconds=settings.push_job_ttl_seconds,
+    progress_interval_seconds=settings.push_job_progress_interval_seconds,
+)
+
+# Глобальная очередь адресных уведомлений процесса
+push_queue = PushQueue(
+    sender=apns_client,
+    concurrency=settings.push_send_concurrency,
+    batch_size=settings.push_queue_batch_size,
+    flush_interval_seconds=settings.push_queue_flush_interval_seconds,
+    max_messages=settings.push_queue_max_messages,
+    max_attempts=settings.push_queue_max_attempts,
+)
@@ -0,0 +1,200 @@
+"""Проверка подписок на изменение курсов после обновления"""
+
+import time
+from decimal import Decimal
+from typing import Any, List, Tuple
+
+import structlog
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..database import async_sessionmaker
+from .cross_rates import CrossRateMatrix
+from .push_service import PushMessage, push_queue
+
+logger = structlog.get_logger()
+
+DIRECTION_ABOVE = "above"
+DIRECTION_BELOW = "below"
+
+# Пары с несработавшими подписками. Эмуляция skip scan: каждая следующая
+# пара находится одним спуском по частичному индексу направления, поэтому
+# запрос читает по строке на пару, а не все подписки.
+PENDING_PAIRS_QUERY = """
+    WITH RECURSIVE pairs AS (
+        (
+            SELECT base, quote
+            FROM rate_alerts
+            WHERE triggered_at IS NULL AND direction = '{direction}'
+            ORDER BY base, quote
+            LIMIT 1
+        )
+        UNION ALL
+        SELECT next_pair.base, next_pair.quote
+        FROM pairs
+        CROSS JOIN LATERAL (
+            SELECT base, quote
+            FROM rate_alerts
+            WHERE triggered_at IS NULL AND direction = '{direction}'
+              AND (base, quote) > (pairs.base, pairs.quote)
+            ORDER BY base, quote
+            LIMIT 1
+        ) AS next_pair
+    )
+    SELECT base, quote FROM pairs
+"""
+
+# Все курсы пар передаются массивами, и для каждой пары выполняется
+# range-скан частичного индекса (base, quote, threshold): читаются только
+# сработавшие подписки. Несработавшие подписки, порог которых курс уже
+# прошел, сработали на прошлых обновлениях, поэтому диапазон узкий.
+TRIGGER_ALERTS_QUERY = """
+    UPDATE rate_alerts AS alert
+    SET triggered_at = NOW(), triggered_rate = pair.rate
+    FROM unnest(
+        CAST(:bases AS varchar[]), CAST(:quotes AS varchar[]), CAST(:rates AS numeric[])
+    ) AS pair(base, quote, rate)
+    WHERE alert.triggered_at IS NULL AND alert.direction = '{direction}'
+      AND alert.base = pair.base AND alert.quote = pair.quote
+      AND alert.threshold {operator} pair.rate
+    RETURNING alert.id, alert.device_id, alert.base, alert.quote, alert.threshold, pair.rate
+"""
+
+# Подписки, уведомление о которых не доставлено, снова ждут срабатывания
+REARM_ALERTS_QUERY = """
+    UPDATE rate_alerts
+    SET triggered_at = NULL, triggered_rate = NULL
+    WHERE id = ANY(CAST(:ids AS bigint[])) AND triggered_at IS NOT NULL
+"""
+
+# Направление подставляется литералом, а не параметром: иначе планировщик
+# не может использовать частичный индекс в generic-плане prepared statement.
+ALERT_QUERIES = {
+    direction: (
+        PENDING_PAIRS_QUERY.format(direction=direction),
+        TRIGGER_ALERTS_QUERY.format(direction=direction, operator=operator),
+    )
+    for direction, operator in ((DIRECTION_ABOVE, "<="), (DIRECTION_BELOW, ">="))
+}
+
+
+def alert_reached(direction: str, threshold: float, rate: float) -> bool:
+    """Достиг ли курс порога подписки"""
+    return rate >= threshold if direction == DIRECTION_ABOVE else rate <= threshold
+
+
+def _format_rate(value: Any) -> str:
+    return f"{float(value):.6g}"
+
+
+def alert_message(direction: str, alert: Any) -> PushMessage:
+    """Уведомление о сработавшей подписке"""
+    sign = "≥" if direction == DIRECTION_ABOVE else "≤"
+    return PushMessage(
+        device_id=alert.device_id,
+        title=f"{alert.base}/{alert.quote} {sign} {_format_rate(alert.threshold)}",
+        message=f"Курс {alert.base}/{alert.quote} сейчас {_format_rate(alert.rate)}",
+        payload={
+            "type": "rate_alert",
+            "alert_id": alert.id,
+            "base": alert.base,
+            "quote": alert.quote,
+            "rate": float(alert.rate),
+        },
+    )
+
+
+async def trigger_rate_alerts(session: AsyncSession, matrix: CrossRateMatrix) -> List[Tuple[str, Any]]:
+    """
+    Отмечает сработавшие подписки по курсам матрицы
+
+    Returns:
+        Список (direction, строка подписки с курсом срабатывания)
+    """
+    triggered = []
+    for direction, (pairs_query, trigger_query) in ALERT_QUERIES.items():
+        pairs = (await session.execute(text(pairs_query))).all()
+        priced = [(base, quote, matrix.rate(base, quote)) for base, quote in pairs]
+        priced = [(base, quote, rate) for base, quote, rate in priced if rate is not None]
+        if not priced:
+            continue
+
+        result = await session.execute(
+            text(trigger_query),
+            {
+                "bases": [base for base, _, _ in priced],
+                "quotes": [quote for _, quote, _ in priced],
+                "rates": [Decimal(repr(rate)) for _, _, rate in priced],
+            }
+        )
+        triggered.extend((direction, alert) for alert in result.all())
+    return triggered
+
+
+async def rearm_rate_alerts(alert_ids: List[int]) -> int:
+    """Снимает отметку срабатывания с подписок (уведомление не доставлено)"""
+    if not alert_ids:
+        return 0
+    async with async_sessionmaker() as session:
+        result = await session.execute(text(REARM_ALERTS_QUERY), {"ids": alert_ids})
+        await session.commit()
+    logger.warning("Rate alerts re-armed after undelivered notifications", alerts=result.rowcount)
+    return result.rowcount
+
+
+async def rearm_dropped_alerts(messages: List[PushMessage]) -> None:
+    """Обработчик сообщений, отброшенных очередью push: подписки сработают снова"""
+    await rearm_rate_alerts([
+        message.payload["alert_id"] for message in messages
+        if message.payload and message.payload.get("type") == "rate_alert"
+    ])
+
+
+push_queue.add_drop_handler(rearm_dropped_alerts)
+
+
+async def evaluate_rate_alerts(matrix: CrossRateMatrix) -> int:
+    """
+    Проверяет подписки после обновления курсов и ставит уведомления в очередь
+
+    Срабатывание записывается в той же транзакции, что и выборка, поэтому
+    подписка срабатывает один раз, даже если проверка запущена в нескольких
+    воркерах. Если проверка после какого-то обновления не выполнилась,
+    подписки сработают на следующем: условие — курс за порогом, а не
+    пересечение между двумя соседними обновлениями.
+
+    Уведомление, которое не удалось доставить (очередь переполнена,
+    пачка не отправилась за max_attempts попыток, остановка воркера),
+    снимает отметку срабатывания, и подписка сработает на следующем
+    обновлении. Без ключей APNs подписки не проверяются.
+
+    Returns:
+        int: количество сработавших подписок
+    """
+    if not push_queue.can_send():
+        logger.warning("Rate alerts not evaluated: APNs is not configured")
+        return 0
+
+    started = time.perf_counter()
+    async with async_sessionmaker() as session:
+        try:
+            triggered = await trigger_rate_alerts(session, matrix)
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            logger.error("Rate alerts evaluation failed", error=str(e))
+            raise
+
+    messages = [alert_message(direction, alert) for direction, alert in triggered]
+    queued = push_queue.submit(messages)
+    if queued < len(messages):
+        await rearm_dropped_alerts(messages[queued:])
+
+    logger.info(
+        "Rate alerts evaluated",
+        version=matrix.version,
+        triggered=len(triggered),
+        queued=queued,
+        duration_ms=round((time.perf_counter() - started) * 1000, 1)
+    )
+    return len(triggered)
@@ -0,0 +1,468 @@
+"""Источники курсов валют и их одновременный опрос"""
+
+import asyncio
+import json
+import math
+import statistics
+import time
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Set
+
+import structlog
+
+from ..config import settings
+from ..utils.circuit_breaker import CircuitBreaker
+from ..utils.http_clients import http_clients
+from ..utils.prometheus import track_external_call
+from .rates_quota import RatesQuotaBudget, openexchangerates_quota
+
+logger = structlog.get_logger()
+
+# Вес последнего опроса в оценке здоровья источника
+HEALTH_ALPHA = 0.3
+# Сколько общих валют нужно для сравнения двух источников
+MIN_COMMON_CURRENCIES = 3
+
+
+@dataclass
+class ProviderRates:
+    """Курсы одного источника: сколько единиц валюты за 1 base"""
+    provider: str
+    base: str
+    rates: Dict[str, float]
+    timestamp: int
+
+    def rub_rates(self) -> Optional[Dict[str, float]]:
+        """
+        Курсы относительно RUB, как они хранятся в таблице rates
+
+        None, если источник не публикует RUB (ЕЦБ): такие курсы только
+        подтверждают курсы других источников в режиме кворума.
+        """
+        if self.base == "RUB":
+            return {code: value for code, value in self.rates.items() if code != "RUB"}
+        units_per_rub = self.rates.get("RUB")
+        if not units_per_rub:
+            return None
+        # Если 1 USD = 90 RUB и 1 USD = 0.85 EUR, то 1 RUB = 0.85 / 90 EUR
+        rub_rates = {code: value / units_per_rub for code, value in self.rates.items() if code != "RUB"}
+        rub_rates.setdefault(self.base, 1 / units_per_rub)
+        return rub_rates
+
+
+def rates_agree(first: ProviderRates, second: ProviderRates, tolerance: float) -> bool:
+    """
+    Совпадают ли курсы двух источников
+
+    Общие валюты сравниваются относительно общей опорной валюты, поэтому
+    сравнимы источники с разной базой (RUB у ЦБ, EUR у ЕЦБ). Медиана
+    относительных расхождений не чувствительна к отдельным валютам,
+    которые источники фиксируют в разное время дня.
+    """
+    if first is second:
+        return True
+    first_rates = {**first.rates, first.base: 1.0}
+    second_rates = {**second.rates, second.base: 1.0}
+    common = set(first_rates) & set(second_rates)
+    if len(common) < MIN_COMMON_CURRENCIES:
+        return False
+    pivot = "USD" if "USD" in common else min(common)
+    deviations = [
+        abs((first_rates[code] / first_rates[pivot]) / (second_rates[code] / second_rates[pivot]) - 1)
+        for code in common
+        if code != pivot
+    ]
+    return statistics.median(deviations) <= tolerance
+
+
+def validate_rates(result: ProviderRates, min_currencies: int) -> Optional[str]:
+    """Причина, по которой курсы источника нельзя использовать, или None"""
+    if len(result.rates) < min_currencies:
+        return f"too few currencies: {len(result.rates)}"
+    invalid = [code for code, value in result.rates.items() if not (math.isfinite(value) and value > 0)]
+    if invalid:
+        return f"invalid rates: {', '.join(sorted(invalid)[:5])}"
+    return None
+
+
+def _parse_decimal(value: Optional[str]) -> float:
+    # ЦБ публикует числа с запятой: 90,1234
+    return float((value or "").replace(",", "."))
+
+
+def parse_cbr_daily(content: bytes) -> Dict[str, float]:
+    """Курсы из XML_daily.asp ЦБ РФ: Value рублей за Nominal единиц валюты"""
+    root = ET.fromstring(content)
+    return {
+        valute.findtext("CharCode"): _parse_decimal(valute.findtext("Nominal")) / _parse_decimal(valute.findtext("Value"))
+        for valute in root.iter("Valute")
+    }
+
+
+def parse_ecb_daily(content: bytes) -> Dict[str, float]:
+    """Курсы из eurofxref-daily.xml ЕЦБ: единиц валюты за 1 EUR"""
+    root = ET.fromstring(content)
+    return {
+        element.get("currency"): float(element.get("rate"))
+        for element in root.iter()
+        if element.get("currency") is not None
+    }
+
+
+class RatesProvider:
+    """Источник курсов. name совпадает с меткой upstream в метриках"""
+
+    name = ""
+    # Месячная квота запросов (None — источник бесплатный)
+    budget: Optional[RatesQuotaBudget] = None
+
+    async def fetch(self) -> ProviderRates:
+        """Запрашивает текущие курсы (исключение — источник недоступен)"""
+        raise NotImplementedError
+
+    async def has_budget(self, forced: bool = False) -> bool:
+        """
+        Осталась ли квота на запрос
+
+        Если расход квоты не прочитать (Redis недоступен), запрос
+        разрешается: обновления идут с фиксированным интервалом
+        rates_update_interval_minutes, который укладывается в квоту.
+        """
+        if self.budget is None:
+            return True
+        try:
+            return await self.budget.allows(forced)
+        except Exception as e:
+            logger.warning("Failed to check rates quota", provider=self.name, error=str(e))
+            return True
+
+    async def _get(self, url: str, params: Optional[Dict[str, Any]] = None) -> bytes:
+        client = http_clients.get(self.name)
+        with track_external_call(self.name):
+            response = await client.get(url, params=params)
+            response.raise_for_status()
+        return response.content
+
+
+class OpenExchangeRatesProvider(RatesProvider):
+    """openexchangerates.org (Free plan отдает курсы только к USD)"""
+
+    name = "openexchangerates"
+
+    def __init__(self, api_url: str, api_key: str, budget: Optional[RatesQuotaBudget] = None):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.budget = budget
+
+    async def fetch(self) -> ProviderRates:
+        if self.budget is not None:
+            # Квота расходуется на любой запрос, в том числе неудачный
+            try:
+                await self.budget.record()
+            except Exception as e:
+                logger.warning("Failed to record rates quota usage", provider=self.name, error=str(e))
+        data = json.loads(await self._get(self.api_url, {"app_id": self.api_key}))
+        return ProviderRates(
+            provider=self.name,
+            base=data.get("base", "USD"),
+            rates=data["rates"],
+            timestamp=int(data.get("timestamp") or time.time()),
+        )
+
+
+class CBRProvider(RatesProvider):
+    """Официальные курсы ЦБ РФ (обновляются раз в рабочий день)"""
+
+    name = "cbr"
+
+    def __init__(self, url: str):
+        self.url = url
+
+    async def fetch(self) -> ProviderRates:
+        rates = parse_cbr_daily(await self._get(self.url))
+        return ProviderRates(provider=self.name, base="RUB", rates=rates, timestamp=int(time.time()))
+
+
+class ECBProvider(RatesProvider):
+    """Референсные курсы ЕЦБ к EUR (RUB не публикуется)"""
+
+    name = "ecb"
+
+    def __init__(self, url: str):
+        self.url = url
+
+    async def fetch(self) -> ProviderRates:
+        rates = parse_ecb_daily(await self._get(self.url))
+        return ProviderRates(provider=self.name, base="EUR", rates=rates, timestamp=int(time.time()))
+
+
+class FileRatesProvider(RatesProvider):
+    """
+    Курсы из JSON-файла {"base": "RUB", "rates": {...}}
+
+    Замена внешних API для разработки и тестов.
+    """
+
+    name = "file"
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+
+    async def fetch(self) -> ProviderRates:
+        data = json.loads(await asyncio.to_thread(self.path.read_bytes))
+        return ProviderRates(
+            provider=self.name,
+            base=data.get("base", "RUB"),
+            rates=data["rates"],
+            timestamp=int(data.get("timestamp") or self.path.stat().st_mtime),
+        )
+
+
+class MockRatesProvider(RatesProvider):
+    """
+    Фиксированные тестовые курсы к RUB
+
+    Используется, если не настроен ни один источник (например, в списке
+    только openexchangerates, а ключ API не задан), чтобы приложение
+    работало без внешних API.
+    """
+
+    name = "mock"
+
+    RATES = {
+        "USD": 0.0112,  # 89.3 RUB за 1 USD
+        "EUR": 0.0101,  # 99.0 RUB за 1 EUR
+        "GBP": 0.0087,  # 115.0 RUB за 1 GBP
+        "CNY": 0.1534,  # 6.52 RUB за 1 CNY
+        "JPY": 0.8203,  # 1.22 RUB за 1 JPY
+    }
+
+    async def fetch(self) -> ProviderRates:
+        return ProviderRates(provider=self.name, base="RUB", rates=dict(self.RATES), timestamp=int(time.time()))
+
+
+@dataclass
+class ProviderHealth:
+    """Здоровье источника: доля успешных опросов (EWMA), задержка и цепь"""
+    breaker: CircuitBreaker
+    score: float = 1.0
+    latency_ms: Optional[float] = None
+    last_error: Optional[str] = None
+    last_success_at: Optional[datetime] = None
+
+    def record(self, ok: bool, latency_ms: float, error: Optional[str] = None) -> None:
+        """Учитывает исход опроса"""
+        self.score = (1 - HEALTH_ALPHA) * self.score + HEALTH_ALPHA * (1.0 if ok else 0.0)
+        self.latency_ms = latency_ms if self.latency_ms is None else (
+            (1 - HEALTH_ALPHA) * self.latency_ms + HEALTH_ALPHA * latency_ms
+        )
+        if ok:
+            self.last_success_at = datetime.now(timezone.utc)
+            self.breaker.record_success()
+        else:
+            self.last_error = error
+            self.breaker.record_failure()
+
+
+class RatesAggregator:
+    """
+    Одновременный опрос источников курсов
+
+    Источники с разомкнутой цепью пропускаются, остальные опрашиваются
+    одновременно. Курсы берутся у первого по порядку rates_providers
+    источника с корректным ответом: следующий источник используется,
+    только если все предыдущие ответили ошибкой (или пропущены), поэтому
+    курсы не переключаются между источниками от обновления к обновлению.
+    Ответы резервных источников приходят параллельно, и отказ основного
+    не добавляет к обновлению их задержку. Обратная сторона: пока
+    основной источник отвечает, обновление ждет именно его (не дольше
+    timeout_seconds), даже если резервный ответил раньше. При quorum>1
+    ответ источника принимается, когда с ним совпали курсы quorum
+    источников (включая его самого).
+
+    Источники, не успевшие к выбору результата, дорабатывают в фоне
+    (не дольше timeout_seconds), чтобы их здоровье тоже учитывалось.
+    """
+
+    def __init__(
+        self,
+        providers: Sequence[RatesProvider],
+        quorum: int,
+        tolerance: float,
+        timeout_seconds: float,
+        min_currencies: int,
+        failure_threshold: int,
+        reset_timeout_seconds: float,
+    ):
+        self.providers = list(providers)
+        self.quorum = quorum
+        self.tolerance = tolerance
+        self.timeout_seconds = timeout_seconds
+        self.min_currencies = min_currencies
+        self.health: Dict[str, ProviderHealth] = {
+            provider.name: ProviderHealth(CircuitBreaker(failure_threshold, reset_timeout_seconds))
+            for provider in self.providers
+        }
+        self._background: Set[asyncio.Task] = set()
+
+    @property
+    def quota_budget(self) -> Optional[RatesQuotaBudget]:
+        """Квота платного источника, если он опрашивается"""
+        return next((provider.budget for provider in self.providers if provider.budget is not None), None)
+
+    async def fetch(self, forced: bool = False) -> Optional[ProviderRates]:
+        """
+        Курсы для записи в БД
+
+        Args:
+            forced: принудительное обновление, может расходовать резерв квоты
+
+        Returns:
+            Курсы выбранного источника или None, если корректных курсов нет
+            (все источники недоступны или кворум не набран)
+        """
+        available = []
+        for provider in self.providers:
+            if not await provider.has_budget(forced):
+                logger.info("Rates provider skipped: quota exhausted", provider=provider.name)
+            elif self.health[provider.name].breaker.allow():
+                available.append(provider)
+        if not available:
+            logger.warning("No rates providers available", providers=self.status())
+            return None
+
+        started = time.perf_counter()
+        tasks = {asyncio.create_task(self._fetch_provider(provider)): provider.name for provider in available}
+        pending = set(tasks)
+        finished: Dict[str, Optional[ProviderRates]] = {}
+        selected = None
+        while pending and selected is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            finished.update((tasks[task], task.result()) for task in done)
+            selected = self._select([provider.name for provider in available], finished)
+
+        for task in pending:
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+        responded = [name for name, result in finished.items() if result is not None]
+        if selected is None:
+            logger.warning("Rates providers returned no usable rates", responded=responded, quorum=self.quorum)
+            return None
+
+        log = logger.info if selected.provider == self.providers[0].name else logger.warning
+        log(
+            "Rates provider selected",
+            provider=selected.provider,
+            primary=self.providers[0].name,
+            responded=responded,
+            still_running=len(pending),
+            duration_ms=round((time.perf_counter() - started) * 1000, 1),
+        )
+        return selected
+
+    def _select(self, polled: List[str], finished: Dict[str, Optional[ProviderRates]]) -> Optional[ProviderRates]:
+        """
+        Ответ первого по приоритету источника, если он уже известен
+
+        None, пока не ответил источник с более высоким приоритетом или пока
+        ответ ждет подтверждений для кворума.
+        """
+        results = [result for result in finished.values() if result is not None]
+        for name in polled:
+            if name not in finished:
+                return None
+            candidate = finished[name]
+            if candidate is None or candidate.rub_rates() is None:
+                continue
+            if self.quorum <= 1:
+                return candidate
+            agreeing = sum(1 for other in results if rates_agree(candidate, other, self.tolerance))
+            if agreeing >= self.quorum:
+                return candidate
+            if len(finished) < len(polled):
+                # Подтверждения еще могут прийти от оставшихся источников
+                return None
+        return None
+
+    async def _fetch_provider(self, provider: RatesProvider) -> Optional[ProviderRates]:
+        """Опрашивает источник и учитывает исход в его здоровье"""
+        health = self.health[provider.name]
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(provider.fetch(), self.timeout_seconds)
+            error = validate_rates(result, self.min_currencies)
+        except Exception as e:
+            result, error = None, str(e) or type(e).__name__
+
+        health.record(error is None, (time.perf_counter() - started) * 1000, error)
+        if error is not None:
+            logger.warning(
+                "Rates provider failed",
+                provider=provider.name,
+                error=error,
+                breaker=health.breaker.state,
+                score=round(health.score, 2),
+            )
+            return None
+        return result
+
+    def status(self) -> Dict[str, Any]:
+        """Здоровье и состояние цепи каждого источника"""
+        return {
+            name: {
+                "score": round(health.score, 2),
+                "latency_ms": round(health.latency_ms, 1) if health.latency_ms is not None else None,
+                "last_error": health.last_error,
+                "last_success_at": health.last_success_at.isoformat() if health.last_success_at else None,
+                "breaker": health.breaker.status(),
+            }
+            for name, health in self.health.items()
+        }
+
+
+def build_rates_providers() -> List[RatesProvider]:
+    """Источники из settings.rates_providers в порядке перечисления"""
+    providers: List[RatesProvider] = []
+    for name in (name.strip() for name in settings.rates_providers.split(",")):
+        if name == OpenExchangeRatesProvider.name:
+            if not settings.rates_api_key:
+                logger.warning("Rates provider skipped: API key not configured", provider=name)
+                continue
+            providers.append(OpenExchangeRatesProvider(
+                settings.rates_api_url,
+                settings.rates_api_key,
+                budget=openexchangerates_quota if settings.rates_quota_monthly_requests > 0 else None,
+            ))
+        elif name == CBRProvider.name:
+            providers.append(CBRProvider(settings.rates_cbr_url))
+        elif name == ECBProvider.name:
+            providers.append(ECBProvider(settings.rates_ecb_url))
+        elif name == FileRatesProvider.name:
+            if not settings.rates_file_path:
+                logger.warning("Rates provider skipped: file path not configured", provider=name)
+                continue
+            providers.append(FileRatesProvider(settings.rates_file_path))
+        elif name == MockRatesProvider.name:
+            providers.append(MockRatesProvider())
+        elif name:
+            logger.warning("Unknown rates provider", provider=name)
+    if not providers:
+        logger.warning("No rates providers configured, using mock data", providers=settings.rates_providers)
+        providers.append(MockRatesProvider())
+    return providers
+
+
+# Глобальный опрос источников курсов
+rates_aggregator = RatesAggregator(
+    build_rates_providers(),
+    quorum=settings.rates_provider_quorum,
+    tolerance=settings.rates_provider_tolerance,
+    timeout_seconds=settings.rates_provider_timeout_seconds,
+    min_currencies=settings.rates_provider_min_currencies,
+    failure_threshold=settings.rates_provider_failure_threshold,
+    reset_timeout_seconds=settings.rates_provider_reset_timeout_seconds,
+)
@@ -0,0 +1,114 @@
+"""Месячная квота запросов к платному API курсов"""
+
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+import structlog
+
+from ..config import settings
+from ..database import get_redis
+
+logger = structlog.get_logger()
+
+# Счетчик месяца живет дольше самого месяца, чтобы его можно было посмотреть
+QUOTA_KEY_TTL_SECONDS = 40 * 24 * 3600
+
+
+def _month_start(now: datetime) -> datetime:
+    return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month_start(now: datetime) -> datetime:
+    start = _month_start(now)
+    return start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+
+
+class RatesQuotaBudget:
+    """
+    Расход месячной квоты запросов (Free Plan openexchangerates: 900 в месяц)
+
+    Счетчик запросов текущего месяца хранится в Redis и общий для всех
+    воркеров и перезапусков. Последние reserve запросов месяца оставлены
+    для принудительного обновления из админки. Интервал обновления
+    рассчитывается так, чтобы оставшихся запросов хватило до конца месяца.
+    """
+
+    def __init__(self, key_prefix: str, monthly_allowance: int, reserve: int):
+        self.key_prefix = key_prefix
+        self.monthly_allowance = monthly_allowance
+        self.reserve = reserve
+        self._last_used: Optional[int] = None
+        self._last_month: Optional[str] = None
+
+    @staticmethod
+    def _now(now: Optional[datetime]) -> datetime:
+        return now or datetime.now(timezone.utc)
+
+    def _key(self, now: datetime) -> str:
+        return f"{self.key_prefix}:{now:%Y-%m}"
+
+    def _remember(self, now: datetime, used: int) -> int:
+        self._last_used = used
+        self._last_month = f"{now:%Y-%m}"
+        return used
+
+    async def used(self, now: Optional[datetime] = None) -> int:
+        """Запросов в текущем месяце"""
+        now = self._now(now)
+        redis_client = await get_redis()
+        return self._remember(now, int(await redis_client.get(self._key(now)) or 0))
+
+    async def record(self, now: Optional[datetime] = None) -> int:
+        """Учитывает запрос к API и возвращает расход за месяц"""
+        now = self._now(now)
+        key = self._key(now)
+        redis_client = await get_redis()
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.incr(key)
+            pipe.expire(key, QUOTA_KEY_TTL_SECONDS)
+            used, _ = await pipe.execute()
+        return self._remember(now, int(used))
+
+    async def allows(self, forced: bool = False, now: Optional[datetime] = None) -> bool:
+        """Можно ли сделать запрос: плановым недоступен резерв квоты"""
+        if self.monthly_allowance <= 0:
+            return True
+        limit = self.monthly_allowance if forced else self.monthly_allowance - self.reserve
+        return await self.used(now) < limit
+
+    async def refresh_interval_seconds(self, now: Optional[datetime] = None) -> Optional[float]:
+        """
+        Интервал, при котором плановых запросов хватит до конца месяца
+
+        Returns:
+            Секунды между запросами или None, если плановая квота исчерпана
+        """
+        if self.monthly_allowance <= 0:
+            return 0.0
+        now = self._now(now)
+        usable = self.monthly_allowance - self.reserve - await self.used(now)
+        if usable <= 0:
+            return None
+        return self.seconds_until_reset(now) / usable
+
+    def seconds_until_reset(self, now: Optional[datetime] = None) -> float:
+        """Секунды до начала следующего месяца (квота обнуляется)"""
+        now = self._now(now)
+        return (_next_month_start(now) - now).total_seconds()
+
+    def status(self) -> Dict[str, Any]:
+        """Последний известный расход квоты (без запроса к Redis)"""
+        return {
+            "month": self._last_month,
+            "used": self._last_used,
+            "allowance": self.monthly_allowance,
+            "reserve": self.reserve,
+        }
+
+
+# Квота openexchangerates (общая для всех воркеров)
+openexchangerates_quota = RatesQuotaBudget(
+    key_prefix="rates:quota:openexchangerates",
+    monthly_allowance=settings.rates_quota_monthly_requests,
+    reserve=settings.rates_quota_reserve_requests,
+)
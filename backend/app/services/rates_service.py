@@ -1,72 +1,184 @@
 """Сервис для обновления курсов валют"""
 
-import httpx
 import structlog
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import func, select, text
 from typing import Dict, Any, Optional
-from datetime import datetime
-import json
+from datetime import datetime, timezone
 
 from ..config import settings
 from ..database import async_sessionmaker, get_redis
 from ..models.rate import Rate
+from ..schemas import CurrencyNamesResponse, RateResponse
+from .rates_snapshot import (
+    CURRENCY_NAMES_CACHE_KEY,
+    CURRENCY_NAMES_SNAPSHOT_KEY,
+    RATES_CACHE_KEY,
+    RATES_SNAPSHOT_KEY,
+    RATES_UPDATED_CHANNEL,
+    load_versioned_snapshots,
+    snapshot_store,
+    write_through_snapshots,
+)
+from .pubsub import publish_event
+from .cross_rates import CrossRateMatrix, cross_rates_cache
+from .rate_alerts import evaluate_rate_alerts
+from .rate_providers import RatesAggregator, rates_aggregator
 
 logger = structlog.get_logger()
 
+# Время последнего успешного обновления курсов (unix time), общее для всех
+# воркеров. updated_at в rates меняется только вместе со значением курса и
+# служит версией данных, а не часами обновлений.
+RATES_LAST_REFRESH_KEY = "rates:last_refresh"
+
+# Upsert всех курсов за один round trip. CTE previous видит снимок таблицы
+# до вставки, что позволяет разделить строки на новые, измененные и неизмененные.
+# Неизмененные курсы не перезаписываются (updated_at остается временем последнего
+# изменения) и не попадают в RETURNING, поэтому CTE history дописывает в
+# append-only таблицу rate_history только новые и изменившиеся значения.
+BULK_UPSERT_RATES_QUERY = """
+    WITH incoming AS (
+        SELECT code, value
+        FROM unnest(CAST(:codes AS varchar[]), CAST(:values AS double precision[])) AS t(code, value)
+    ),
+    previous AS (
+        SELECT rates.code, rates.value
+        FROM rates
+        JOIN incoming ON incoming.code = rates.code
+    ),
+    upserted AS (
+        INSERT INTO rates (code, name, value, updated_at)
+        SELECT code, code, value, NOW()
+        FROM incoming
+        ON CONFLICT (code) DO UPDATE
+        SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
+        WHERE rates.value IS DISTINCT FROM EXCLUDED.value
+        RETURNING code, value, updated_at
+    ),
+    history AS (
+        INSERT INTO rate_history (code, recorded_at, value)
+        SELECT code, updated_at, value
+        FROM upserted
+    )
+    SELECT
+        COUNT(*) FILTER (WHERE upserted.code IS NOT NULL AND previous.code IS NULL) AS inserted,
+        COUNT(*) FILTER (WHERE upserted.code IS NOT NULL AND previous.code IS NOT NULL) AS updated,
+        COUNT(*) FILTER (WHERE upserted.code IS NULL) AS unchanged
+    FROM incoming
+    LEFT JOIN previous ON previous.code = incoming.code
+    LEFT JOIN upserted ON upserted.code = incoming.code
+"""
+
 
 class RatesService:
     """Сервис для работы с курсами валют"""
     
-    def __init__(self):
-        self.api_url = settings.rates_api_url
-        self.api_key = settings.rates_api_key
+    def __init__(self, aggregator: RatesAggregator = rates_aggregator):
+        self.aggregator = aggregator
         
-    async def should_update_rates(self) -> bool:
+    async def refresh_interval_seconds(self) -> float:
         """
-        Проверяет, нужно ли обновлять курсы валют (rate limiting)
-        Обновляем не чаще чем раз в час для соблюдения лимитов Free Plan
-        
-        Returns:
-            bool: True если можно обновлять, False если нужно подождать
+        Интервал между обновлениями курсов с учетом квоты API
+
+        Если опрашивается источник с месячной квотой, интервал растягивается
+        так, чтобы оставшихся запросов хватило до конца месяца, и
+        сокращается до rates_min_interval_minutes, если квоты с запасом.
+        Без квоты или если ее расход неизвестен — rates_update_interval_minutes.
         """
+        fixed = settings.rates_update_interval_minutes * 60
+        budget = self.aggregator.quota_budget
+        if budget is None:
+            return fixed
+
         try:
-            # Получаем последнюю запись из БД
-            async with async_sessionmaker() as session:
-                result = await session.execute(
-                    select(Rate).order_by(Rate.updated_at.desc()).limit(1)
+            interval = await budget.refresh_interval_seconds()
+        except Exception as e:
+            logger.warning("Failed to read rates quota usage", error=str(e))
+            return fixed
+
+        if interval is None:
+            # Квота исчерпана: бесплатные источники опрашиваются как обычно,
+            # а если их нет — ждем начала следующего месяца
+            return fixed if len(self.aggregator.providers) > 1 else budget.seconds_until_reset()
+        return max(settings.rates_min_interval_minutes * 60, interval)
+
+    async def last_refresh_at(self) -> Optional[datetime]:
+        """
+        Время последнего успешного обновления курсов (UTC)
+
+        Берется из Redis. Если ключа нет (первый запуск после деплоя или
+        потеря данных Redis), используется max(updated_at) из БД.
+        """
+        redis_client = await get_redis()
+        value = await redis_client.get(RATES_LAST_REFRESH_KEY)
+        if value is not None:
+            return datetime.fromtimestamp(float(value), tz=timezone.utc)
+
+        async with async_sessionmaker() as session:
+            result = await session.execute(select(func.max(Rate.updated_at)))
+            updated_at = result.scalar()
+        if updated_at is None:
+            return None
+        return updated_at if updated_at.tzinfo else updated_at.replace(tzinfo=timezone.utc)
+
+    async def _record_refresh(self) -> None:
+        """Запоминает время успешного обновления для всех воркеров"""
+        try:
+            redis_client = await get_redis()
+            await redis_client.set(RATES_LAST_REFRESH_KEY, datetime.now(timezone.utc).timestamp())
+        except Exception as e:
+            logger.warning("Failed to record rates refresh time", error=str(e))
+
+    async def seconds_until_update(self) -> float:
+        """
+        Через сколько секунд можно обновлять курсы (0 — можно сейчас)
+
+        Отсчитывается от времени последнего успешного обновления (см.
+        last_refresh_at), поэтому обновление выполняет один воркер, даже
+        если ни один курс не изменился. Ошибка проверки не разрешает
+        обновление: проверка повторится через rates_retry_base_seconds.
+        """
+        try:
+            last_refresh = await self.last_refresh_at()
+            
+            if last_refresh is None:
+                logger.info("No rates in database, update needed")
+                return 0.0
+            
+            # Проверяем время последнего обновления
+            time_since_update = datetime.now(timezone.utc) - last_refresh
+            minutes_since_update = time_since_update.total_seconds() / 60
+            min_interval = await self.refresh_interval_seconds() / 60
+            
+            if minutes_since_update >= min_interval:
+                logger.info(
+                    "Rate limiting check: update allowed",
+                    minutes_since_last_update=round(minutes_since_update, 1),
+                    min_interval_minutes=round(min_interval, 1)
                 )
-                latest_rate = result.scalar_one_or_none()
-                
-                if not latest_rate:
-                    logger.info("No rates in database, update needed")
-                    return True
-                
-                # Проверяем время последнего обновления
-                time_since_update = datetime.utcnow() - latest_rate.updated_at.replace(tzinfo=None)
-                minutes_since_update = time_since_update.total_seconds() / 60
-                min_interval = settings.rates_update_interval_minutes
-                
-                if minutes_since_update >= min_interval:
-                    logger.info(
-                        "Rate limiting check: update allowed",
-                        minutes_since_last_update=round(minutes_since_update, 1),
-                        min_interval_minutes=min_interval
-                    )
-                    return True
-                else:
-                    logger.info(
-                        "Rate limiting check: update skipped",
-                        minutes_since_last_update=round(minutes_since_update, 1),
-                        min_interval_minutes=min_interval,
-                        wait_minutes=round(min_interval - minutes_since_update, 1)
-                    )
-                    return False
+                return 0.0
+            
+            logger.info(
+                "Rate limiting check: update skipped",
+                minutes_since_last_update=round(minutes_since_update, 1),
+                min_interval_minutes=round(min_interval, 1),
+                wait_minutes=round(min_interval - minutes_since_update, 1)
+            )
+            return (min_interval - minutes_since_update) * 60
                     
         except Exception as e:
             logger.error("Error checking rate limiting", error=str(e))
-            # В случае ошибки разрешаем обновление
-            return True
+            return settings.rates_retry_base_seconds
+
+    async def should_update_rates(self) -> bool:
+        """
+        Проверяет, нужно ли обновлять курсы валют (rate limiting)
+        
+        Returns:
+            bool: True если можно обновлять, False если нужно подождать
+        """
+        return await self.seconds_until_update() == 0
 
     async def update_rates_from_external_api(self, force: bool = False) -> Dict[str, Any]:
         """
@@ -80,37 +192,54 @@ class RatesService:
         """
         try:
             # Проверка rate limiting (если не принудительное обновление)
-            if not force and not await self.should_update_rates():
+            retry_after = 0.0 if force else await self.seconds_until_update()
+            if retry_after > 0:
                 return {
                     "success": False, 
                     "skipped": True,
-                    "reason": "Rate limiting: too soon since last update"
+                    "reason": "Rate limiting: too soon since last update",
+                    "retry_after_seconds": round(retry_after, 1)
                 }
             
             logger.info("Starting rates update from external API", forced=force)
             
-            # Запрашиваем данные из внешнего API
-            rates_data = await self._fetch_rates_from_api()
+            # Запрашиваем курсы у источников одновременно
+            rates_data = await self._fetch_rates_from_api(forced=force)
             
             if not rates_data:
-                logger.error("No data received from external API")
-                return {"success": False, "error": "No data from external API"}
+                logger.error("No data received from rates providers")
+                return {
+                    "success": False,
+                    "error": "No data from rates providers",
+                    "providers": self.aggregator.status(),
+                    "timestamp": datetime.utcnow().isoformat()
+                }
             
             # Обновляем курсы в базе данных
-            updated_count = await self._update_rates_in_database(rates_data)
+            counts = await self._update_rates_in_database(rates_data)
+            updated_count = counts["inserted"] + counts["updated"]
+            await self._record_refresh()
             
-            # Очищаем кэш
-            await self._clear_rates_cache()
+            # Сразу обновляем кэши Redis и снапшоты всех воркеров
+            matrix = await self._write_through_caches()
+            
+            # Проверяем подписки на курсы по новой матрице кросс-курсов
+            if matrix is not None:
+                await self._evaluate_rate_alerts(matrix)
             
             logger.info(
                 "Rates update completed successfully",
+                provider=rates_data["provider"],
                 updated_count=updated_count,
                 rates_count=len(rates_data.get("rates", {}))
             )
             
             return {
                 "success": True,
+                "provider": rates_data["provider"],
                 "updated_count": updated_count,
+                "inserted_count": counts["inserted"],
+                "unchanged_count": counts["unchanged"],
                 "rates_count": len(rates_data.get("rates", {})),
                 "timestamp": datetime.utcnow().isoformat()
             }
@@ -123,119 +252,121 @@ class RatesService:
                 "timestamp": datetime.utcnow().isoformat()
             }
     
-    async def _fetch_rates_from_api(self) -> Optional[Dict[str, Any]]:
-        """Запрашивает курсы из внешнего API"""
+    async def _fetch_rates_from_api(self, forced: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Запрашивает курсы у источников (см. RatesAggregator)
+
+        Args:
+            forced: принудительное обновление, может расходовать резерв квоты
+
+        Returns:
+            Курсы относительно RUB от выбранного источника или None,
+            если ни один источник не вернул корректных курсов
+        """
+        result = await self.aggregator.fetch(forced)
+        if result is None:
+            return None
+        return {
+            "base": "RUB",
+            "rates": result.rub_rates(),
+            "timestamp": result.timestamp,
+            "provider": result.provider,
+        }
+    
+    async def _update_rates_in_database(self, rates_data: Dict[str, Any]) -> Dict[str, int]:
+        """
+        Обновляет курсы в базе данных одним set-based запросом
         
-        if not self.api_key:
-            logger.warning("API key not configured, using mock data")
-            # Возвращаем тестовые данные если нет ключа API
-            return {
-                "rates": {
-                    "USD": 0.0112,  # 89.3 RUB за 1 USD
-                    "EUR": 0.0101,  # 99.0 RUB за 1 EUR  
-                    "GBP": 0.0087,  # 115.0 RUB за 1 GBP
-                    "CNY": 0.1534,  # 6.52 RUB за 1 CNY
-                    "JPY": 0.8203,  # 1.22 RUB за 1 JPY
-                },
-                "timestamp": int(datetime.utcnow().timestamp())
-            }
+        Весь словарь курсов передается массивами и записывается через
+        INSERT ... ON CONFLICT (code) DO UPDATE, в том же запросе новые и
+        изменившиеся значения добавляются в историю курсов. Неизмененные
+        курсы не перезаписываются. Новые валюты получают код в качестве
+        названия (колонка name обязательна).
         
-        try:
-            params = {
-                "app_id": self.api_key,
-                # Free plan only supports USD as base currency
-                # We'll convert to RUB base in the code below
-            }
-            
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(self.api_url, params=params)
-                response.raise_for_status()
-                
-                data = response.json()
-                logger.info("External API response received", status_code=response.status_code)
-                
-                # Convert from USD-based rates to RUB-based rates
-                if "rates" in data and "RUB" in data["rates"]:
-                    usd_to_rub = data["rates"]["RUB"]  # e.g., 1 USD = 90 RUB
-                    
-                    # Convert all rates to RUB base
-                    # If USD->EUR = 0.85 and USD->RUB = 90, then RUB->EUR = 0.85/90
-                    rub_based_rates = {}
-                    for currency, usd_rate in data["rates"].items():
-                        if currency != "RUB":  # Skip RUB itself
-                            rub_based_rates[currency] = usd_rate / usd_to_rub
-                    
-                    # Update the response to have RUB as base
-                    data["base"] = "RUB"
-                    data["rates"] = rub_based_rates
-                    
-                    logger.info("Converted rates from USD to RUB base", 
-                              usd_to_rub_rate=usd_to_rub, 
-                              currencies_count=len(rub_based_rates))
-                
-                return data
-                
-        except httpx.RequestError as e:
-            logger.error("Network error fetching rates", error=str(e))
-            raise
-        except httpx.HTTPStatusError as e:
-            logger.error("HTTP error fetching rates", status_code=e.response.status_code)
-            raise
-        except json.JSONDecodeError as e:
-            logger.error("Invalid JSON in API response", error=str(e))
-            raise
-    
-    async def _update_rates_in_database(self, rates_data: Dict[str, Any]) -> int:
-        """Обновляет курсы в базе данных"""
+        Returns:
+            Dict с количеством вставленных, измененных и неизмененных курсов
+        """
         
         rates = rates_data.get("rates", {})
         if not rates:
             logger.warning("No rates in API response")
-            return 0
-        
-        updated_count = 0
+            return {"inserted": 0, "updated": 0, "unchanged": 0}
         
         async with async_sessionmaker() as session:
             try:
-                for currency_code, rate_value in rates.items():
-                    # Ищем существующую запись
-                    result = await session.execute(
-                        select(Rate).where(Rate.code == currency_code)
-                    )
-                    existing_rate = result.scalar_one_or_none()
-                    
-                    if existing_rate:
-                        # Обновляем существующую
-                        existing_rate.value = rate_value
-                        existing_rate.updated_at = datetime.utcnow()
-                        logger.debug("Updated existing rate", currency=currency_code, value=rate_value)
-                    else:
-                        # Создаем новую
-                        new_rate = Rate(
-                            code=currency_code,
-                            value=rate_value,
-                            updated_at=datetime.utcnow()
-                        )
-                        session.add(new_rate)
-                        logger.debug("Created new rate", currency=currency_code, value=rate_value)
-                    
-                    updated_count += 1
+                result = await session.execute(
+                    text(BULK_UPSERT_RATES_QUERY),
+                    {
+                        "codes": list(rates.keys()),
+                        "values": [float(value) for value in rates.values()],
+                    }
+                )
+                inserted, updated, unchanged = result.one()
                 
                 await session.commit()
-                logger.info("Database transaction committed", updated_count=updated_count)
                 
             except Exception as e:
                 await session.rollback()
                 logger.error("Database transaction failed", error=str(e))
                 raise
         
-        return updated_count
+        counts = {"inserted": inserted, "updated": updated, "unchanged": unchanged}
+        logger.info("Database transaction committed", **counts)
+        return counts
+    
+    async def _write_through_caches(self) -> Optional[CrossRateMatrix]:
+        """
+        Обновляет кэши /rates и /currency-names сразу после commit
+
+        Ответы строятся из БД и записываются в снапшот процесса и в Redis,
+        а остальные воркеры получают версию через pub/sub. Кэши не остаются
+        холодными после обновления курсов.
+
+        Returns:
+            Матрица кросс-курсов новой версии или None, если кэши не обновлены
+        """
+        try:
+            async with async_sessionmaker() as session:
+                result = await session.execute(select(Rate))
+                rates = result.scalars().all()
+            if not rates:
+                return None
+
+            updated_at = max(rate.updated_at for rate in rates)
+            snapshot = await write_through_snapshots(
+                RateResponse(
+                    updated_at=updated_at,
+                    base="RUB",
+                    rates={rate.code: float(rate.value) for rate in rates},
+                ),
+                CurrencyNamesResponse(
+                    updated_at=updated_at,
+                    names={rate.code: rate.name for rate in rates},
+                ),
+            )
+            # Матрица кросс-курсов пересчитывается сразу для новой версии
+            matrix = cross_rates_cache.rebuild(snapshot)
+            await publish_event(RATES_UPDATED_CHANNEL, {"version": snapshot.version})
+            return matrix
+        except Exception as e:
+            logger.warning("Failed to write through rates caches", error=str(e))
+            await self._clear_rates_cache()
+            return None
+    
+    async def _evaluate_rate_alerts(self, matrix: CrossRateMatrix) -> None:
+        """Проверяет подписки на курсы (ошибка не прерывает обновление курсов)"""
+        try:
+            await evaluate_rate_alerts(matrix)
+        except Exception as e:
+            logger.warning("Failed to evaluate rate alerts", error=str(e))
     
     async def _clear_rates_cache(self) -> None:
-        """Очищает кэш курсов в Redis"""
+        """Очищает кэши курсов в Redis и в процессе (если не удалось обновить их)"""
+        snapshot_store.invalidate(RATES_SNAPSHOT_KEY)
+        snapshot_store.invalidate(CURRENCY_NAMES_SNAPSHOT_KEY)
         try:
             redis_client = await get_redis()
-            await redis_client.delete("rates_cache")
+            await redis_client.delete(RATES_CACHE_KEY, CURRENCY_NAMES_CACHE_KEY)
             logger.info("Rates cache cleared")
         except Exception as e:
             logger.warning("Failed to clear rates cache", error=str(e))
@@ -249,14 +380,19 @@ class RatesService:
                 rates = result.scalars().all()
                 
                 if not rates:
-                    return {"total_currencies": 0, "last_updated": None}
+                    return {
+                        "total_currencies": 0,
+                        "last_updated": None,
+                        "providers": self.aggregator.status()
+                    }
                 
                 last_updated = max(rate.updated_at for rate in rates)
                 
                 return {
                     "total_currencies": len(rates),
                     "last_updated": last_updated.isoformat(),
-                    "currencies": [rate.code for rate in rates]
+                    "currencies": [rate.code for rate in rates],
+                    "providers": self.aggregator.status()
                 }
                 
             except Exception as e:
@@ -264,5 +400,28 @@ class RatesService:
                 raise
 
 
+async def handle_rates_updated(message: Dict[str, Any]) -> None:
+    """
+    Обработчик RATES_UPDATED_CHANNEL: подменяет снапшоты процесса новой версией
+
+    Воркер, обновивший курсы, уже опубликовал эту версию и пропускает сообщение.
+    """
+    version = int(message["version"])
+    current = snapshot_store.get_stale(RATES_SNAPSHOT_KEY)
+    if current is not None and current.version >= version:
+        return
+
+    snapshot = await load_versioned_snapshots(version)
+    if snapshot is None:
+        # Версия уже вытеснена более новой — снапшот пересоберется при запросе
+        snapshot_store.invalidate(RATES_SNAPSHOT_KEY)
+        snapshot_store.invalidate(CURRENCY_NAMES_SNAPSHOT_KEY)
+        logger.warning("Published rates version is not in Redis", version=version)
+        return
+
+    cross_rates_cache.rebuild(snapshot)
+    logger.info("Rates snapshot updated from pub/sub", version=version)
+
+
 # Глобальный экземпляр сервиса
 rates_service = RatesService()
\ No newline at end of file
@@ -0,0 +1,471 @@
+"""In-process снапшоты ответов API курсов валют"""
+
+import asyncio
+import json
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set, Tuple
+
+import structlog
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..database import async_sessionmaker, get_redis
+from ..models.rate import Rate
+from ..schemas import RateResponse, CurrencyNamesResponse, RatesDeltaResponse
+from ..utils.prometheus import record_cache
+from ..utils.singleflight import SingleFlight
+
+logger = structlog.get_logger()
+
+RATES_SNAPSHOT_KEY = "rates"
+CURRENCY_NAMES_SNAPSHOT_KEY = "currency_names"
+
+# Ключи Redis с сериализованными ответами и их TTL
+RATES_CACHE_KEY = "rates_cache"
+CURRENCY_NAMES_CACHE_KEY = "currency_names_cache"
+RATES_CACHE_TTL_SECONDS = 3600  # 1 час
+CURRENCY_NAMES_CACHE_TTL_SECONDS = 86400  # 24 часа
+
+# Канал pub/sub, в который публикуется версия новых курсов
+RATES_UPDATED_CHANNEL = "rates:updated"
+
+# Сериализованные дельты /rates по ключу (текущая версия, since)
+DELTA_CACHE_SIZE = 256
+_delta_cache: Dict[Tuple[int, int], bytes] = {}
+
+# Пересборка снапшота при промахе: одна на ключ в процессе
+_rebuild_flight = SingleFlight()
+_revalidate_tasks: Set[asyncio.Task] = set()
+
+# Снятие блокировки только ее владельцем
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+SnapshotLoader = Callable[[AsyncSession], Awaitable[Optional["Snapshot"]]]
+
+
+def _as_utc(value: datetime) -> datetime:
+    """Приводит datetime к UTC (naive считается UTC)"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    Неизменяемый снапшот ответа эндпоинта
+
+    Хранит уже сериализованное тело ответа, поэтому на горячем пути
+    не нужны ни Redis, ни Pydantic, ни JSON.
+    """
+    version: int
+    updated_at: datetime
+    payload: Dict[str, Any]
+    body: bytes
+    etag: str
+    headers: Dict[str, str]
+    created_at: float = field(default_factory=time.monotonic)
+
+    def is_fresh(self, ttl_seconds: int) -> bool:
+        """Проверяет, не устарел ли снапшот в этом процессе"""
+        return time.monotonic() - self.created_at < ttl_seconds
+
+    def matches(self, if_none_match: Optional[str], if_modified_since: Optional[str]) -> bool:
+        """
+        Проверяет условные заголовки запроса (RFC 9110)
+
+        If-None-Match сравнивается слабым сравнением и имеет приоритет
+        над If-Modified-Since.
+        """
+        if if_none_match:
+            if if_none_match.strip() == "*":
+                return True
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            return self.etag in tags
+
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            return _as_utc(self.updated_at).replace(microsecond=0) <= since
+
+        return False
+
+
+def snapshot_version(updated_at: datetime) -> int:
+    """
+    Версия снапшота — время обновления данных в миллисекундах
+
+    Одинаковые данные в БД дают одинаковую версию во всех воркерах.
+    """
+    return int(_as_utc(updated_at).timestamp() * 1000)
+
+
+class SnapshotStore:
+    """
+    Хранилище снапшотов в памяти процесса
+
+    Снапшот заменяется целиком одной операцией присваивания,
+    поэтому читатели всегда видят согласованную версию. Последние
+    версии каждого ключа сохраняются для построения дельт.
+    """
+
+    def __init__(self, ttl_seconds: int, max_age_seconds: int = 0, history_size: int = 1):
+        self.ttl_seconds = ttl_seconds
+        self.max_age_seconds = max_age_seconds
+        self.history_size = history_size
+        self._snapshots: Dict[str, Snapshot] = {}
+        self._history: Dict[str, Deque[Snapshot]] = {}
+
+    def get(self, key: str) -> Optional[Snapshot]:
+        """Возвращает снапшот, если он есть и не устарел"""
+        snapshot = self._snapshots.get(key)
+        if snapshot is not None and snapshot.is_fresh(self.ttl_seconds):
+            return snapshot
+        return None
+
+    def get_stale(self, key: str) -> Optional[Snapshot]:
+        """Возвращает последний снапшот по ключу, даже устаревший"""
+        return self._snapshots.get(key)
+
+    def publish(self, key: str, updated_at: datetime, payload: Dict[str, Any], body: bytes) -> Snapshot:
+        """Атомарно заменяет снапшот по ключу"""
+        version = snapshot_version(updated_at)
+        etag = f'"{key}-{version}"'
+        snapshot = Snapshot(
+            version=version,
+            updated_at=updated_at,
+            payload=payload,
+            body=body,
+            etag=etag,
+            headers={
+                "ETag": etag,
+                "Last-Modified": format_datetime(_as_utc(updated_at), usegmt=True),
+                "Cache-Control": f"public, max-age={self.max_age_seconds}",
+                "X-Snapshot-Version": str(version),
+            },
+        )
+        self._snapshots[key] = snapshot
+
+        history = self._history.setdefault(key, deque(maxlen=self.history_size))
+        if history and history[-1].version == version:
+            history[-1] = snapshot
+        else:
+            history.append(snapshot)
+        logger.debug("Snapshot published", key=key, version=snapshot.version)
+        return snapshot
+
+    def find_version(self, key: str, version: int) -> Optional[Snapshot]:
+        """Ищет снапшот указанной версии среди последних версий ключа"""
+        for snapshot in reversed(self._history.get(key, ())):
+            if snapshot.version == version:
+                return snapshot
+        return None
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        """Удаляет снапшот по ключу (или все снапшоты)"""
+        if key is None:
+            self._snapshots.clear()
+        else:
+            self._snapshots.pop(key, None)
+
+
+async def _acquire_rebuild_lock(redis_client, cache_key: str) -> Tuple[Optional[str], Optional[bytes]]:
+    """
+    Берет блокировку пересборки кэша cache_key между воркерами
+
+    Если блокировку держит другой воркер, ждет, пока он заполнит кэш.
+    Возвращает (токен блокировки, None) или (None, значение кэша).
+    Если за rates_cache_lock_wait_ms ни то ни другое не получено,
+    возвращает (None, None) — вызывающий читает БД сам.
+    """
+    lock_key = f"{cache_key}:rebuild_lock"
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + settings.rates_cache_lock_wait_ms / 1000
+
+    while True:
+        if await redis_client.set(lock_key, token, nx=True, px=settings.rates_cache_lock_ttl_ms):
+            return token, None
+        if time.monotonic() >= deadline:
+            logger.warning("Timed out waiting for cache rebuild lock", cache_key=cache_key)
+            return None, None
+        await asyncio.sleep(0.05)
+        cached = await redis_client.get(cache_key)
+        if cached:
+            return None, cached
+
+
+async def _release_rebuild_lock(redis_client, cache_key: str, token: str) -> None:
+    """Снимает блокировку пересборки, если она все еще наша"""
+    try:
+        await redis_client.eval(RELEASE_LOCK_SCRIPT, 1, f"{cache_key}:rebuild_lock", token)
+    except Exception as e:
+        logger.warning("Failed to release cache rebuild lock", cache_key=cache_key, error=str(e))
+
+
+async def refresh_snapshot(key: str, loader: SnapshotLoader, db: AsyncSession) -> Optional[Snapshot]:
+    """
+    Снапшот при промахе in-process кэша
+
+    Если в процессе есть устаревший снапшот, он возвращается сразу, а
+    пересборка запускается в фоне (stale-while-revalidate). Иначе запрос
+    ждет пересборки. Одновременные промахи по одному ключу выполняют
+    loader один раз.
+    """
+    stale = snapshot_store.get_stale(key)
+    if stale is not None:
+        if not _rebuild_flight.in_flight(key):
+            task = asyncio.create_task(_revalidate_snapshot(key, loader))
+            _revalidate_tasks.add(task)
+            task.add_done_callback(_revalidate_tasks.discard)
+        return stale
+
+    return await _rebuild_flight.do(key, lambda: loader(db))
+
+
+async def _revalidate_snapshot(key: str, loader: SnapshotLoader) -> None:
+    """Фоновая пересборка снапшота в собственной сессии БД"""
+    try:
+        async with async_sessionmaker() as session:
+            await _rebuild_flight.do(key, lambda: loader(session))
+    except Exception as e:
+        logger.warning("Background snapshot revalidation failed", key=key, error=str(e))
+
+
+def publish_rates_snapshot(response: RateResponse) -> Snapshot:
+    """Сериализует ответ /rates один раз и публикует снапшот"""
+    return snapshot_store.publish(
+        RATES_SNAPSHOT_KEY,
+        response.updated_at,
+        {"base": response.base, "rates": response.rates},
+        response.model_dump_json().encode(),
+    )
+
+
+async def load_rates_snapshot(db: AsyncSession) -> Optional[Snapshot]:
+    """
+    Строит снапшот /rates при промахе in-process кэша
+
+    Сначала проверяет кэш Redis, если нет - обращается к базе данных.
+    При включенной rates_cache_lock_enabled в БД идет только один воркер.
+    Возвращает None, если курсов в базе нет.
+    """
+    redis_client = await get_redis()
+
+    cached_rates = await redis_client.get(RATES_CACHE_KEY)
+    record_cache("rates_redis", bool(cached_rates))
+    if cached_rates:
+        logger.info("Building rates snapshot from Redis cache")
+        return publish_rates_snapshot(RateResponse.model_validate_json(cached_rates))
+
+    # Кэш пересобирает один воркер, остальные ждут его результата в Redis
+    lock_token = None
+    if settings.rates_cache_lock_enabled:
+        lock_token, cached_rates = await _acquire_rebuild_lock(redis_client, RATES_CACHE_KEY)
+        if cached_rates:
+            logger.info("Building rates snapshot from cache rebuilt by another worker")
+            return publish_rates_snapshot(RateResponse.model_validate_json(cached_rates))
+
+    try:
+        logger.info("Reading rates from database")
+        result = await db.execute(select(Rate))
+        rates = result.scalars().all()
+
+        if not rates:
+            logger.warning("No rates found in database")
+            return None
+
+        response_data = {
+            "updated_at": max(rate.updated_at for rate in rates),
+            "base": "RUB",
+            "rates": {rate.code: float(rate.value) for rate in rates},
+        }
+
+        # Кэшируем результат на 1 час (3600 секунд)
+        await redis_client.setex(
+            RATES_CACHE_KEY,
+            RATES_CACHE_TTL_SECONDS,
+            json.dumps(response_data, default=str)
+        )
+        logger.info("Rates cached successfully", rates_count=len(response_data["rates"]))
+    finally:
+        if lock_token is not None:
+            await _release_rebuild_lock(redis_client, RATES_CACHE_KEY, lock_token)
+
+    return publish_rates_snapshot(RateResponse(**response_data))
+
+
+def build_rates_delta(current: Snapshot, since: int) -> bytes:
+    """
+    Сериализованная дельта /rates относительно версии since
+
+    Содержит только валюты, курс которых изменился. Если версия since
+    уже вытеснена из истории (или неизвестна этому процессу), возвращается
+    полный набор курсов с флагом full=true. Результат кэшируется
+    для пары (текущая версия, since).
+    """
+    cache_key = (current.version, since)
+    body = _delta_cache.get(cache_key)
+    if body is not None:
+        return body
+
+    previous = snapshot_store.find_version(RATES_SNAPSHOT_KEY, since)
+    new_rates = current.payload["rates"]
+
+    if previous is None:
+        delta = RatesDeltaResponse(
+            updated_at=current.updated_at,
+            base=current.payload["base"],
+            version=current.version,
+            since=since,
+            full=True,
+            rates=new_rates,
+        )
+    else:
+        old_rates = previous.payload["rates"]
+        delta = RatesDeltaResponse(
+            updated_at=current.updated_at,
+            base=current.payload["base"],
+            version=current.version,
+            since=since,
+            full=False,
+            rates={code: value for code, value in new_rates.items() if old_rates.get(code) != value},
+            removed=[code for code in old_rates if code not in new_rates],
+        )
+
+    body = delta.model_dump_json().encode()
+    if len(_delta_cache) >= DELTA_CACHE_SIZE:
+        _delta_cache.clear()
+    _delta_cache[cache_key] = body
+    return body
+
+
+def publish_currency_names_snapshot(response: CurrencyNamesResponse) -> Snapshot:
+    """Сериализует ответ /currency-names один раз и публикует снапшот"""
+    return snapshot_store.publish(
+        CURRENCY_NAMES_SNAPSHOT_KEY,
+        response.updated_at,
+        {"names": response.names},
+        response.model_dump_json().encode(),
+    )
+
+
+async def load_currency_names_snapshot(db: AsyncSession) -> Optional[Snapshot]:
+    """
+    Строит снапшот /currency-names при промахе in-process кэша
+
+    Сначала проверяет кэш Redis, если нет - обращается к базе данных.
+    Возвращает None, если курсов в базе нет.
+    """
+    redis_client = await get_redis()
+
+    cached_names = await redis_client.get(CURRENCY_NAMES_CACHE_KEY)
+    record_cache("currency_names_redis", bool(cached_names))
+    if cached_names:
+        logger.info("Building currency names snapshot from Redis cache")
+        return publish_currency_names_snapshot(CurrencyNamesResponse.model_validate_json(cached_names))
+
+    lock_token = None
+    if settings.rates_cache_lock_enabled:
+        lock_token, cached_names = await _acquire_rebuild_lock(redis_client, CURRENCY_NAMES_CACHE_KEY)
+        if cached_names:
+            logger.info("Building currency names snapshot from cache rebuilt by another worker")
+            return publish_currency_names_snapshot(CurrencyNamesResponse.model_validate_json(cached_names))
+
+    try:
+        logger.info("Reading currency names from database")
+        result = await db.execute(select(Rate))
+        rates = result.scalars().all()
+
+        if not rates:
+            logger.warning("No rates found in database")
+            return None
+
+        response_data = {
+            "updated_at": max(rate.updated_at for rate in rates),
+            "names": {rate.code: rate.name for rate in rates},
+        }
+
+        # Кэшируем результат на 24 часа (86400 секунд)
+        await redis_client.setex(
+            CURRENCY_NAMES_CACHE_KEY,
+            CURRENCY_NAMES_CACHE_TTL_SECONDS,
+            json.dumps(response_data, default=str)
+        )
+        logger.info("Currency names cached successfully", names_count=len(response_data["names"]))
+    finally:
+        if lock_token is not None:
+            await _release_rebuild_lock(redis_client, CURRENCY_NAMES_CACHE_KEY, lock_token)
+
+    return publish_currency_names_snapshot(CurrencyNamesResponse(**response_data))
+
+
+def versioned_cache_key(cache_key: str, version: int) -> str:
+    """Ключ Redis с ответом конкретной версии курсов"""
+    return f"{cache_key}:v{version}"
+
+
+async def write_through_snapshots(rates: RateResponse, names: CurrencyNamesResponse) -> Snapshot:
+    """
+    Публикует новые /rates и /currency-names в процессе и в Redis
+
+    Текущие и версионные ключи обоих ответов записываются одной транзакцией
+    MULTI/EXEC, поэтому читатели не увидят курсы без соответствующих названий.
+    Версионные ключи читают другие воркеры по сообщению из RATES_UPDATED_CHANNEL.
+    """
+    rates_snapshot = publish_rates_snapshot(rates)
+    names_snapshot = publish_currency_names_snapshot(names)
+
+    redis_client = await get_redis()
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.set(RATES_CACHE_KEY, rates_snapshot.body, ex=RATES_CACHE_TTL_SECONDS)
+        pipe.set(versioned_cache_key(RATES_CACHE_KEY, rates_snapshot.version), rates_snapshot.body, ex=RATES_CACHE_TTL_SECONDS)
+        pipe.set(CURRENCY_NAMES_CACHE_KEY, names_snapshot.body, ex=CURRENCY_NAMES_CACHE_TTL_SECONDS)
+        pipe.set(versioned_cache_key(CURRENCY_NAMES_CACHE_KEY, rates_snapshot.version), names_snapshot.body, ex=RATES_CACHE_TTL_SECONDS)
+        await pipe.execute()
+
+    logger.info("Rates caches written through", version=rates_snapshot.version, rates_count=len(rates.rates))
+    return rates_snapshot
+
+
+async def load_versioned_snapshots(version: int) -> Optional[Snapshot]:
+    """
+    Публикует в процессе /rates и /currency-names версии version из Redis
+
+    Returns:
+        Снапшот /rates или None, если версионные ключи уже истекли
+    """
+    redis_client = await get_redis()
+    rates_body, names_body = await redis_client.mget(
+        versioned_cache_key(RATES_CACHE_KEY, version),
+        versioned_cache_key(CURRENCY_NAMES_CACHE_KEY, version),
+    )
+    if rates_body is None:
+        return None
+
+    snapshot = publish_rates_snapshot(RateResponse.model_validate_json(rates_body))
+    if names_body is not None:
+        publish_currency_names_snapshot(CurrencyNamesResponse.model_validate_json(names_body))
+    return snapshot
+
+
+# Глобальное хранилище снапшотов процесса
+snapshot_store = SnapshotStore(
+    ttl_seconds=settings.rates_snapshot_ttl_seconds,
+    max_age_seconds=settings.rates_http_max_age_seconds,
+    history_size=settings.rates_snapshot_history_size,
+)
@@ -0,0 +1,128 @@
+"""Поток обновлений курсов для SSE и WebSocket"""
+
+import asyncio
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+import structlog
+
+from ..config import settings
+from .rates_snapshot import RATES_SNAPSHOT_KEY, Snapshot, build_rates_delta, snapshot_store
+
+logger = structlog.get_logger()
+
+
+class RatesBroadcaster:
+    """
+    Рассылка новых версий курсов подключенным клиентам воркера
+
+    У подключения нет своей очереди: все ждут одно общее событие, которое
+    срабатывает при новой версии или по таймеру keepalive и сразу
+    заменяется новым. Состояние подключения — версия, которую клиент уже
+    получил, поэтому воркер держит десятки тысяч простаивающих подключений.
+    Тело дельты строится один раз на пару версий (кэш build_rates_delta)
+    и отдается всем клиентам с той же версией.
+
+    Новые версии приходят из pub/sub (handle_rates_updated), поэтому
+    клиенты всех воркеров получают обновление одновременно.
+    """
+
+    def __init__(self, keepalive_seconds: float, max_connections: int):
+        self.keepalive_seconds = keepalive_seconds
+        self.max_connections = max_connections
+        self.connections = 0
+        self._snapshot: Optional[Snapshot] = None
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def version(self) -> Optional[int]:
+        """Последняя разосланная версия курсов"""
+        return self._snapshot.version if self._snapshot is not None else None
+
+    def publish(self, snapshot: Snapshot) -> bool:
+        """
+        Рассылает снапшот, если он новее разосланного
+
+        Returns:
+            bool: True, если клиенты получат новую версию
+        """
+        if self._snapshot is not None and snapshot.version <= self._snapshot.version:
+            return False
+        self._snapshot = snapshot
+        self._wake()
+        logger.info("Rates update broadcast", version=snapshot.version, connections=self.connections)
+        return True
+
+    def _wake(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def updates(self, since: Optional[int]) -> AsyncIterator[Optional[Tuple[int, bytes]]]:
+        """
+        Обновления для одного подключения
+
+        Отдает дельту /rates относительно версии клиента (since — его
+        текущая версия, None — полный набор курсов), затем дельту на каждую
+        новую версию, вместе с этой версией. None означает keepalive: ничего не изменилось. Клиенту,
+        который уже видел более новую версию в другом воркере, ничего не
+        отправляется, пока этот воркер ее не получит.
+        """
+        self.connections += 1
+        version = since
+        try:
+            while True:
+                # Событие берется до yield: версия, опубликованная, пока
+                # клиенту отправляются данные, разбудит цикл сразу
+                changed = self._changed
+                snapshot = self._snapshot
+                if snapshot is not None and (version is None or snapshot.version > version):
+                    yield snapshot.version, build_rates_delta(snapshot, version or 0)
+                    version = snapshot.version
+                else:
+                    yield None
+                await changed.wait()
+        finally:
+            self.connections -= 1
+
+    async def handle_rates_updated(self, message: Dict[str, Any]) -> None:
+        """
+        Обработчик RATES_UPDATED_CHANNEL
+
+        Регистрируется после rates_service.handle_rates_updated, который
+        к этому моменту уже загрузил снапшот новой версии.
+        """
+        snapshot = snapshot_store.get_stale(RATES_SNAPSHOT_KEY)
+        if snapshot is not None and snapshot.version >= int(message["version"]):
+            self.publish(snapshot)
+
+    async def start(self) -> None:
+        """Запускает таймер keepalive"""
+        if self._task is not None:
+            return
+        self._task = asyncio.create_task(self._keepalive())
+        logger.info("Rates broadcaster started", keepalive_seconds=self.keepalive_seconds)
+
+    async def stop(self) -> None:
+        """Останавливает таймер keepalive"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info("Rates broadcaster stopped", connections=self.connections)
+
+    async def _keepalive(self) -> None:
+        # Один таймер на процесс вместо таймера на каждое подключение
+        while True:
+            await asyncio.sleep(self.keepalive_seconds)
+            self._wake()
+
+
+# Глобальный рассыльщик обновлений курсов процесса
+rates_broadcaster = RatesBroadcaster(
+    keepalive_seconds=settings.rates_stream_keepalive_seconds,
+    max_connections=settings.rates_stream_max_connections,
+)
@@ -0,0 +1,109 @@
+"""Кэш результатов эндпоинтов аналитики"""
+
+import json
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import structlog
+
+from ..config import settings
+from ..database import get_redis
+from ..utils.prometheus import record_cache
+from ..utils.singleflight import SingleFlight
+
+logger = structlog.get_logger()
+
+STATS_CACHE_PREFIX = "stats_result:"
+
+
+class StatsResultCache:
+    """
+    Кэш ответов /stats/summary и /stats/metrics в Redis
+
+    Ключ строится по окну, округленному до bucket_seconds, поэтому
+    опросы дашборда в пределах одного интервала попадают в один ключ.
+    Окна, захватывающие текущий момент, живут live_ttl_seconds, закрытые
+    исторические окна — closed_ttl_seconds. Одновременные одинаковые
+    запросы в процессе вычисляются один раз (single-flight).
+    """
+
+    def __init__(
+        self,
+        bucket_seconds: int,
+        live_ttl_seconds: int,
+        closed_ttl_seconds: int,
+        settle_seconds: int,
+    ):
+        self.bucket_seconds = bucket_seconds
+        self.live_ttl_seconds = live_ttl_seconds
+        self.closed_ttl_seconds = closed_ttl_seconds
+        self.settle_seconds = settle_seconds
+        self._flight = SingleFlight()
+
+    def bucket(self, value: datetime) -> int:
+        """Номер интервала, в который попадает момент времени"""
+        return int(value.timestamp()) // self.bucket_seconds
+
+    def window_key(self, name: str, start: datetime, end: datetime, *parts: Any) -> str:
+        """Ключ кэша для окна [start, end] и дополнительных параметров запроса"""
+        key = f"{STATS_CACHE_PREFIX}{name}:{self.bucket(start)}:{self.bucket(end)}"
+        for part in parts:
+            key += f":{part}"
+        return key
+
+    def ttl_for(self, end: Optional[datetime], now: Optional[datetime] = None) -> int:
+        """
+        TTL результата для окна, заканчивающегося в end
+
+        Окно считается закрытым, если с его конца прошло больше settle_seconds:
+        к этому времени события записаны и учтены в агрегатах.
+        """
+        if end is None:
+            return self.live_ttl_seconds
+        now = now or datetime.now(timezone.utc)
+        if (now - end).total_seconds() > self.settle_seconds:
+            return self.closed_ttl_seconds
+        return self.live_ttl_seconds
+
+    async def get_or_compute(
+        self,
+        key: str,
+        ttl_seconds: int,
+        compute: Callable[[], Awaitable[Dict[str, Any]]],
+    ) -> Dict[str, Any]:
+        """Возвращает результат из кэша или вычисляет его один раз на процесс"""
+        return await self._flight.do(key, lambda: self._load(key, ttl_seconds, compute))
+
+    async def _load(
+        self,
+        key: str,
+        ttl_seconds: int,
+        compute: Callable[[], Awaitable[Dict[str, Any]]],
+    ) -> Dict[str, Any]:
+        redis_client = None
+        try:
+            redis_client = await get_redis()
+            cached = await redis_client.get(key)
+            record_cache("stats_results", bool(cached))
+            if cached:
+                return json.loads(cached)
+        except Exception as e:
+            logger.warning("Stats result cache unavailable", key=key, error=str(e))
+
+        result = await compute()
+
+        if redis_client is not None:
+            try:
+                await redis_client.setex(key, ttl_seconds, json.dumps(result, default=str))
+            except Exception as e:
+                logger.warning("Failed to cache stats result", key=key, error=str(e))
+        return result
+
+
+# Глобальный кэш результатов аналитики
+stats_result_cache = StatsResultCache(
+    bucket_seconds=settings.stats_cache_bucket_seconds,
+    live_ttl_seconds=settings.stats_cache_live_ttl_seconds,
+    closed_ttl_seconds=settings.stats_cache_closed_ttl_seconds,
+    settle_seconds=settings.stats_cache_settle_seconds,
+)
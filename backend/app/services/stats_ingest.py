@@ -0,0 +1,157 @@
+"""Буферизованная запись событий аналитики в базу данных"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import structlog
+from sqlalchemy import insert
+
+from ..config import settings
+from ..database import async_sessionmaker
+from ..models.usage_event import UsageEvent
+from ..utils.prometheus import STATS_EVENTS, STATS_QUEUE_DEPTH
+
+logger = structlog.get_logger()
+
+EventRow = Dict[str, Any]
+
+
+async def write_usage_events(rows: List[EventRow]) -> None:
+    """Записывает пачку событий одним multi-row INSERT"""
+    async with async_sessionmaker() as session:
+        await session.execute(insert(UsageEvent), rows)
+        await session.commit()
+
+
+class StatsIngestQueue:
+    """
+    Очередь событий аналитики в памяти процесса
+
+    POST /stats только кладет события в буфер и сразу отвечает клиенту.
+    Фоновая задача сбрасывает буфер в БД пачками — по достижении batch_size
+    или раз в flush_interval_seconds. Размер буфера ограничен max_events:
+    при переполнении submit() возвращает False (backpressure для клиента).
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        flush_interval_seconds: float,
+        max_events: int,
+        writer: Callable[[List[EventRow]], Awaitable[None]] = write_usage_events,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_events = max_events
+        self._writer = writer
+        self._buffer: List[EventRow] = []
+        self._wakeup = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        """Количество событий, ожидающих записи"""
+        return len(self._buffer)
+
+    def submit(self, rows: List[EventRow]) -> bool:
+        """
+        Добавляет события в буфер
+
+        Returns:
+            bool: False, если буфер переполнен и события не приняты
+        """
+        if len(self._buffer) + len(rows) > self.max_events:
+            STATS_EVENTS.labels(outcome="rejected").inc(len(rows))
+            return False
+
+        self._buffer.extend(rows)
+        STATS_EVENTS.labels(outcome="accepted").inc(len(rows))
+        STATS_QUEUE_DEPTH.set(len(self._buffer))
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    async def flush(self) -> int:
+        """Сбрасывает весь буфер в БД пачками по batch_size"""
+        written = 0
+        async with self._flush_lock:
+            while self._buffer:
+                batch = self._buffer[:self.batch_size]
+                del self._buffer[:self.batch_size]
+                try:
+                    await self._writer(batch)
+                except Exception as e:
+                    self._requeue(batch)
+                    logger.error("Failed to write analytics events", error=str(e), batch_size=len(batch))
+                    break
+                written += len(batch)
+                STATS_EVENTS.labels(outcome="written").inc(len(batch))
+            STATS_QUEUE_DEPTH.set(len(self._buffer))
+
+        if written:
+            logger.info("Analytics events flushed", events_count=written, pending=len(self._buffer))
+        return written
+
+    def _requeue(self, batch: List[EventRow]) -> None:
+        """Возвращает неудачную пачку в начало буфера, насколько позволяет лимит"""
+        room = max(self.max_events - len(self._buffer), 0)
+        dropped = len(batch) - room
+        if dropped > 0:
+            STATS_EVENTS.labels(outcome="dropped").inc(dropped)
+            logger.error("Analytics buffer is full, dropping events", dropped=dropped)
+            batch = batch[:room]
+        self._buffer[:0] = batch
+
+    async def start(self) -> None:
+        """Запускает фоновый сброс буфера"""
+        if self._task is not None:
+            return
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            "Stats ingest queue started",
+            batch_size=self.batch_size,
+            flush_interval_seconds=self.flush_interval_seconds,
+            max_events=self.max_events
+        )
+
+    async def stop(self) -> None:
+        """
+        Останавливает фоновую задачу и сбрасывает оставшиеся события
+
+        Задача не отменяется: она завершает текущую запись и выходит из
+        цикла, иначе отмена посреди записи теряла бы пачку, уже снятую
+        с буфера.
+        """
+        if self._task is not None:
+            self._stopping.set()
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+        await self.flush()
+        if self._buffer:
+            logger.error("Analytics events lost on shutdown", events_count=len(self._buffer))
+        logger.info("Stats ingest queue stopped")
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Error flushing analytics events", error=str(e), exc_info=True)
+
+
+# Глобальная очередь событий аналитики процесса
+stats_ingest_queue = StatsIngestQueue(
+    batch_size=settings.stats_ingest_batch_size,
+    flush_interval_seconds=settings.stats_ingest_flush_interval_seconds,
+    max_events=settings.stats_ingest_max_events,
+)
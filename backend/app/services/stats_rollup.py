@@ -0,0 +1,150 @@
+"""Инкрементальный пересчет агрегатов событий аналитики"""
+
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set
+
+import structlog
+from sqlalchemy import text
+
+from ..config import settings
+from ..database import async_sessionmaker
+from .device_sketches import missing_sketch_days, record_devices
+
+logger = structlog.get_logger()
+
+USAGE_EVENTS_ROLLUP = "usage_events"
+
+# События агрегируются по диапазону id (last_event_id, pending_event_id].
+# pending_event_id — максимальный id, увиденный на прошлом запуске: к следующему
+# запуску все транзакции, получившие меньшие id, уже закоммичены, поэтому
+# водяной знак не перепрыгивает через события, которые еще не видны.
+LOCK_STATE_QUERY = """
+    SELECT last_event_id, pending_event_id
+    FROM rollup_state
+    WHERE name = :name
+    FOR UPDATE
+"""
+
+INIT_STATE_QUERY = """
+    INSERT INTO rollup_state (name, last_event_id, pending_event_id)
+    VALUES (:name, 0, 0)
+    ON CONFLICT (name) DO NOTHING
+"""
+
+HOURLY_ROLLUP_QUERY = """
+    INSERT INTO usage_events_hourly (bucket, event_name, events)
+    SELECT date_trunc('hour', created_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC', event_name, COUNT(*)
+    FROM usage_events
+    WHERE id > :last_id AND id <= :high_id
+    GROUP BY 1, 2
+    ON CONFLICT (bucket, event_name) DO UPDATE
+    SET events = usage_events_hourly.events + EXCLUDED.events
+"""
+
+DAILY_DEVICES_ROLLUP_QUERY = """
+    INSERT INTO usage_daily_devices (day, device_id)
+    SELECT DISTINCT (created_at AT TIME ZONE 'UTC')::date, device_id
+    FROM usage_events
+    WHERE id > :last_id AND id <= :high_id
+    ON CONFLICT DO NOTHING
+    RETURNING day, device_id
+"""
+
+DAY_DEVICES_QUERY = """
+    SELECT device_id
+    FROM usage_daily_devices
+    WHERE day = :day
+"""
+
+MAX_EVENT_ID_QUERY = "SELECT COALESCE(MAX(id), 0) FROM usage_events"
+
+UPDATE_STATE_QUERY = """
+    UPDATE rollup_state
+    SET last_event_id = :last_id, pending_event_id = :pending_id, updated_at = NOW()
+    WHERE name = :name
+"""
+
+
+async def refresh_usage_rollups() -> Dict[str, Any]:
+    """
+    Дописывает в агрегаты события, появившиеся с прошлого запуска
+
+    Строка rollup_state блокируется на время транзакции, поэтому при
+    нескольких воркерах пересчет одновременно выполняет только один.
+
+    Returns:
+        Dict с обработанным диапазоном id событий
+    """
+    async with async_sessionmaker() as session:
+        try:
+            await session.execute(text(INIT_STATE_QUERY), {"name": USAGE_EVENTS_ROLLUP})
+            result = await session.execute(text(LOCK_STATE_QUERY), {"name": USAGE_EVENTS_ROLLUP})
+            last_id, high_id = result.one()
+
+            new_devices: Dict[date, Set[str]] = {}
+            if high_id > last_id:
+                params = {"last_id": last_id, "high_id": high_id}
+                await session.execute(text(HOURLY_ROLLUP_QUERY), params)
+                devices_result = await session.execute(text(DAILY_DEVICES_ROLLUP_QUERY), params)
+                for day, device_id in devices_result.fetchall():
+                    new_devices.setdefault(day, set()).add(str(device_id))
+            else:
+                high_id = last_id
+
+            max_id = (await session.execute(text(MAX_EVENT_ID_QUERY))).scalar()
+            await session.execute(
+                text(UPDATE_STATE_QUERY),
+                {"name": USAGE_EVENTS_ROLLUP, "last_id": high_id, "pending_id": max(max_id, high_id)}
+            )
+            await session.commit()
+
+        except Exception as e:
+            await session.rollback()
+            logger.error("Usage rollup refresh failed", error=str(e))
+            raise
+
+    # Скетчи догоняют агрегаты: устройства, которые прием событий не записал
+    # (Redis был недоступен), и дни до появления скетчей
+    backfilled_days: List[date] = []
+    try:
+        await record_devices(new_devices)
+        backfilled_days = await backfill_device_sketches()
+    except Exception as e:
+        logger.warning("Device sketches backfill failed", error=str(e))
+
+    logger.info("Usage rollups refreshed", from_event_id=last_id, to_event_id=high_id, pending_event_id=max_id,
+                sketch_days_backfilled=len(backfilled_days))
+    return {
+        "from_event_id": last_id,
+        "to_event_id": high_id,
+        "pending_event_id": max_id,
+        "sketch_days_backfilled": len(backfilled_days),
+    }
+
+
+async def backfill_device_sketches(today: Optional[date] = None) -> List[date]:
+    """
+    Заполняет отсутствующие дневные скетчи из usage_daily_devices
+
+    Проверяются дни в пределах stats_hll_retention_days. День без
+    активности получает пустой скетч, поэтому повторно не проверяется
+    по базе и не уводит метрики на агрегаты.
+
+    Returns:
+        Заполненные дни
+    """
+    today = today or datetime.now(timezone.utc).date()
+    start_day = today - timedelta(days=settings.stats_hll_retention_days - 1)
+    days = [start_day + timedelta(days=i) for i in range((today - start_day).days + 1)]
+    missing = await missing_sketch_days(days)
+    if not missing:
+        return []
+
+    async with async_sessionmaker() as session:
+        for day in missing:
+            result = await session.execute(text(DAY_DEVICES_QUERY), {"day": day})
+            await record_devices({day: {str(device_id) for device_id in result.scalars().all()}})
+
+    logger.info("Device sketches backfilled from daily rollups", days=len(missing),
+                first_day=missing[0].isoformat(), last_day=missing[-1].isoformat())
+    return missing
@@ -0,0 +1,123 @@
+"""Фоновый сборщик системных метрик"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, Optional, Tuple
+
+import psutil
+import structlog
+
+from ..config import settings
+
+logger = structlog.get_logger()
+
+MB = 1024 * 1024
+GB = 1024 * 1024 * 1024
+
+
+class MetricsSampler:
+    """
+    Периодически снимает метрики процесса и системы в кольцевой буфер
+
+    Все вызовы psutil неблокирующие (cpu_percent(interval=None) считает
+    загрузку с момента предыдущего вызова) и выполняются в отдельном потоке,
+    поэтому event loop не простаивает во время сбора.
+    """
+
+    def __init__(self, interval_seconds: int, history_size: int):
+        self.interval_seconds = interval_seconds
+        self._samples: Deque[Tuple[float, Dict[str, float]]] = deque(maxlen=history_size)
+        self._process = psutil.Process(os.getpid())
+        self._task: Optional[asyncio.Task] = None
+
+    def sample(self) -> Tuple[float, Dict[str, float]]:
+        """Снимает метрики и добавляет их в буфер"""
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage('/')
+        process_memory = self._process.memory_info()
+
+        sample = (time.time(), {
+            "cpu_usage_percent": psutil.cpu_percent(interval=None),
+            "memory_total_mb": memory.total / MB,
+            "memory_used_mb": memory.used / MB,
+            "memory_available_mb": memory.available / MB,
+            "memory_usage_percent": memory.percent,
+            "disk_total_gb": disk.total / GB,
+            "disk_used_gb": disk.used / GB,
+            "disk_free_gb": disk.free / GB,
+            "disk_usage_percent": (disk.used / disk.total) * 100,
+            "process_memory_mb": process_memory.rss / MB,
+            "process_cpu_percent": self._process.cpu_percent(interval=None),
+            "process_threads": self._process.num_threads(),
+        })
+        self._samples.append(sample)
+        return sample
+
+    def latest(self) -> Tuple[float, Dict[str, float]]:
+        """Последний снятый сэмпл (снимается сразу, если буфер пуст)"""
+        if self._samples:
+            return self._samples[-1]
+        return self.sample()
+
+    def window_stats(self, seconds: int) -> Dict[str, object]:
+        """Минимум, среднее и максимум каждой метрики за последние seconds секунд"""
+        since = time.time() - seconds
+        window = [metrics for ts, metrics in self._samples if ts >= since]
+
+        stats: Dict[str, Dict[str, float]] = {}
+        if window:
+            for name in window[-1]:
+                values = [metrics[name] for metrics in window]
+                stats[name] = {
+                    "min": min(values),
+                    "avg": sum(values) / len(values),
+                    "max": max(values),
+                }
+
+        return {"seconds": seconds, "samples": len(window), "metrics": stats}
+
+    async def start(self) -> None:
+        """Запускает фоновый сбор метрик"""
+        if self._task is not None:
+            return
+        # Первый вызов cpu_percent(interval=None) задает точку отсчета
+        psutil.cpu_percent(interval=None)
+        self._process.cpu_percent(interval=None)
+        self._task = asyncio.create_task(self._run())
+        logger.info("Metrics sampler started", interval_seconds=self.interval_seconds)
+
+    async def stop(self) -> None:
+        """Останавливает фоновый сбор метрик"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info("Metrics sampler stopped")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.sleep(self.interval_seconds)
+                await asyncio.to_thread(self.sample)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Failed to sample system metrics", error=str(e))
+
+
+def format_timestamp(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
+
+
+# Глобальный экземпляр сборщика метрик
+metrics_sampler = MetricsSampler(
+    interval_seconds=settings.metrics_sample_interval_seconds,
+    history_size=settings.metrics_history_size,
+)
@@ -1,23 +1,58 @@
 """Планировщик фоновых задач"""
 
-import asyncio
+from datetime import datetime, timedelta, timezone
 from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+from apscheduler.jobstores.base import JobLookupError
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_MISSED
 import structlog
 
 from ..services.rates_service import rates_service
+from ..services.stats_rollup import refresh_usage_rollups
+from ..services.event_partitions import manage_usage_event_partitions
+from ..services.iap_service import revalidate_expiring_receipts
+from ..services.premium_index import premium_index
 from ..config import settings
+from ..utils.circuit_breaker import CircuitBreaker, backoff_with_jitter
+from ..utils.prometheus import SCHEDULER_JOB_RUNS
 
 logger = structlog.get_logger()
 
+RATES_UPDATE_JOB_ID = "smart_update_rates"
+# Пауза перед первым обновлением курсов, чтобы приложение успело запуститься
+INITIAL_RATES_UPDATE_DELAY_SECONDS = 5
+
 
 class TaskScheduler:
     """Планировщик фоновых задач приложения"""
     
     def __init__(self):
         self.scheduler = AsyncIOScheduler(timezone="UTC")
+        self.scheduler.add_listener(
+            self._on_job_event,
+            EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED
+        )
         self._is_running = False
+        # Обновление курсов: ошибки подряд размыкают цепь, между ними — backoff
+        self.rates_breaker = CircuitBreaker(
+            failure_threshold=settings.rates_refresh_failure_threshold,
+            reset_timeout_seconds=settings.rates_refresh_reset_timeout_seconds,
+        )
+        self._rates_failures = 0
+        self._rates_next_run: Optional[datetime] = None
+    
+    @staticmethod
+    def _on_job_event(event):
+        """Считает запуски задач для метрик Prometheus"""
+        if event.code == EVENT_JOB_MISSED:
+            outcome = "missed"
+        elif event.exception:
+            outcome = "error"
+        else:
+            outcome = "executed"
+        SCHEDULER_JOB_RUNS.labels(job=event.job_id, outcome=outcome).inc()
     
     async def start(self):
         """Запускает планировщик и добавляет задачи"""
@@ -26,26 +61,65 @@ class TaskScheduler:
             return
         
         try:
-            # Добавляем задачу умной проверки обновления курсов каждые 30 минут
-            # (но обновляем только если прошло достаточно времени для rate limiting)
+            # Обновление курсов: каждый запуск сам переносит следующий
+            # (интервал по квоте API, backoff после ошибок, пауза при
+            # разомкнутой цепи). Интервал триггера — страховка, если перенос
+            # не выполнился. Первое обновление после запуска — первый запуск
+            # этой же задачи, поэтому на него тоже действует max_instances=1.
             check_interval = settings.rates_check_interval_minutes
             self.scheduler.add_job(
                 self._smart_rates_update_job,
                 trigger=IntervalTrigger(minutes=check_interval),
-                id="smart_update_rates",
+                id=RATES_UPDATE_JOB_ID,
                 name=f"Smart exchange rates update check (every {check_interval}min)",
+                next_run_time=datetime.now(timezone.utc) + timedelta(seconds=INITIAL_RATES_UPDATE_DELAY_SECONDS),
                 replace_existing=True,
                 max_instances=1  # Не запускать одновременно
             )
             
-            # Добавляем задачу для первого обновления через 30 секунд после запуска
+            # Инкрементальный пересчет агрегатов аналитики для /stats/metrics
+            rollup_interval = settings.stats_rollup_interval_minutes
+            self.scheduler.add_job(
+                self._usage_rollup_job,
+                trigger=IntervalTrigger(minutes=rollup_interval),
+                id="usage_rollups",
+                name=f"Usage analytics rollups (every {rollup_interval}min)",
+                replace_existing=True,
+                max_instances=1
+            )
+            
+            # Месячные секции usage_events: создание будущих и удаление старых
+            # (только если задан stats_events_retention_months)
+            self.scheduler.add_job(
+                self._usage_event_partitions_job,
+                trigger=IntervalTrigger(hours=24),
+                next_run_time=datetime.now(timezone.utc),  # первый запуск сразу при старте
+                id="usage_event_partitions",
+                name="Usage events partition maintenance (every 24h)",
+                replace_existing=True,
+                max_instances=1
+            )
+            
+            # Фоновая перепроверка истекающих подписок в Apple
+            revalidate_interval = settings.iap_revalidate_interval_minutes
+            self.scheduler.add_job(
+                self._iap_revalidation_job,
+                trigger=IntervalTrigger(minutes=revalidate_interval),
+                id="iap_revalidation",
+                name=f"IAP subscription revalidation (every {revalidate_interval}min)",
+                replace_existing=True,
+                max_instances=1
+            )
+            
+            # Полная перезагрузка индекса Premium: чистит истекшие подписки
+            # и восстанавливает обновления, пропущенные при обрыве pub/sub
             self.scheduler.add_job(
-                self._initial_rates_update,
-                trigger="date",
-                run_date=None,  # Запустить немедленно при старте
-                id="initial_update_rates",
-                name="Initial exchange rates update",
-                replace_existing=True
+                self._premium_index_reload_job,
+                trigger=IntervalTrigger(hours=1),
+                id="premium_index_reload",
+                name="Premium index reload (every 1h)",
+                replace_existing=True,
+                max_instances=1
             )
             
             # Запускаем планировщик
@@ -72,60 +146,132 @@ class TaskScheduler:
             logger.error("Error stopping scheduler", error=str(e))
     
     async def _smart_rates_update_job(self):
-        """Умная задача обновления курсов валют с rate limiting"""
+        """
+        Умная задача обновления курсов валют с rate limiting
+
+        После запуска следующий переносится: после успеха — на интервал по
+        оставшейся квоте API, после ошибки — на backoff с jitter, а после
+        rates_refresh_failure_threshold ошибок подряд цепь размыкается и
+        обновления не запускаются rates_refresh_reset_timeout_seconds.
+        """
+        delay = None
         try:
+            retry_after = self.rates_breaker.retry_after()
+            if retry_after > 0:
+                logger.warning(
+                    "Scheduled rates update skipped: circuit open",
+                    retry_after_seconds=round(retry_after, 1)
+                )
+                delay = retry_after
+                return
+            
             logger.info("Starting smart scheduled rates update check")
             result = await rates_service.update_rates_from_external_api()
             
             if result.get("success"):
                 logger.info(
                     "Scheduled rates update completed successfully",
+                    provider=result.get("provider"),
                     updated_count=result.get("updated_count"),
                     rates_count=result.get("rates_count")
                 )
+                self.rates_breaker.record_success()
+                self._rates_failures = 0
+                delay = await rates_service.refresh_interval_seconds()
             elif result.get("skipped"):
                 logger.debug(
                     "Scheduled rates update skipped due to rate limiting",
                     reason=result.get("reason")
                 )
+                delay = result.get("retry_after_seconds")
             else:
                 logger.error(
                     "Scheduled rates update failed",
                     error=result.get("error")
                 )
+                delay = self._record_rates_failure()
                 
         except Exception as e:
             logger.error("Error in scheduled rates update", error=str(e), exc_info=True)
+            delay = self._record_rates_failure()
+        finally:
+            self._schedule_next_rates_update(delay)
     
-    async def _initial_rates_update(self):
-        """Первоначальное обновление курсов при запуске приложения"""
+    def _record_rates_failure(self) -> float:
+        """Учитывает неудачное обновление курсов и возвращает паузу до повтора"""
+        self._rates_failures += 1
+        self.rates_breaker.record_failure()
+        retry_after = self.rates_breaker.retry_after()
+        if retry_after > 0:
+            logger.warning(
+                "Rates update circuit opened",
+                failures=self._rates_failures,
+                retry_after_seconds=round(retry_after, 1)
+            )
+            return retry_after
+        return backoff_with_jitter(
+            self._rates_failures,
+            settings.rates_retry_base_seconds,
+            settings.rates_retry_max_seconds,
+        )
+    
+    def _schedule_next_rates_update(self, delay: Optional[float]) -> None:
+        """Переносит следующий запуск обновления курсов через delay секунд"""
+        if delay is None or not self._is_running:
+            return
+        next_run = datetime.now(timezone.utc) + timedelta(seconds=delay)
         try:
-            logger.info("Starting initial rates update")
-            
-            # Ждем немного, чтобы дать приложению полностью запуститься
-            await asyncio.sleep(5)
-            
-            result = await rates_service.update_rates_from_external_api()
-            
-            if result.get("success"):
-                logger.info(
-                    "Initial rates update completed successfully",
-                    updated_count=result.get("updated_count"),
-                    rates_count=result.get("rates_count")
-                )
-            else:
-                logger.warning(
-                    "Initial rates update failed (will retry in 6 hours)",
-                    error=result.get("error")
-                )
-                
+            self.scheduler.modify_job(RATES_UPDATE_JOB_ID, next_run_time=next_run)
+        except JobLookupError:
+            return
+        self._rates_next_run = next_run
+        logger.info("Next rates update scheduled", delay_seconds=round(delay, 1), next_run=next_run.isoformat())
+    
+    async def _usage_rollup_job(self):
+        """Дописывает новые события аналитики в агрегаты"""
+        try:
+            result = await refresh_usage_rollups()
+            logger.debug("Usage rollup job completed", **result)
         except Exception as e:
-            logger.error("Error in initial rates update", error=str(e), exc_info=True)
+            logger.error("Error in usage rollup job", error=str(e), exc_info=True)
+    
+    async def _usage_event_partitions_job(self):
+        """Создает будущие секции usage_events и удаляет события старше срока хранения"""
+        try:
+            result = await manage_usage_event_partitions()
+            logger.debug("Usage event partitions job completed", **result)
+        except Exception as e:
+            logger.error("Error in usage event partitions job", error=str(e), exc_info=True)
+    
+    async def _iap_revalidation_job(self):
+        """Перепроверяет подписки, истекающие в ближайшее время"""
+        try:
+            result = await revalidate_expiring_receipts()
+            logger.debug("IAP revalidation job completed", **result)
+        except Exception as e:
+            logger.error("Error in IAP revalidation job", error=str(e), exc_info=True)
+    
+    async def _premium_index_reload_job(self):
+        """Перестраивает индекс Premium-статуса из БД"""
+        try:
+            await premium_index.load()
+        except Exception as e:
+            logger.error("Error in premium index reload job", error=str(e), exc_info=True)
+    
+    def rates_update_status(self) -> Dict[str, Any]:
+        """Состояние обновления курсов: цепь, ошибки подряд, квота API"""
+        budget = rates_service.aggregator.quota_budget
+        return {
+            "breaker": self.rates_breaker.status(),
+            "consecutive_failures": self._rates_failures,
+            "next_run": self._rates_next_run.isoformat() if self._rates_next_run else None,
+            "quota": budget.status() if budget is not None else None,
+        }
     
     def get_job_status(self) -> dict:
         """Возвращает статус всех задач"""
         if not self._is_running:
-            return {"scheduler_running": False, "jobs": []}
+            return {"scheduler_running": False, "jobs": [], "rates_update": self.rates_update_status()}
         
         jobs_info = []
         for job in self.scheduler.get_jobs():
@@ -138,7 +284,8 @@ class TaskScheduler:
         
         return {
             "scheduler_running": True,
-            "jobs": jobs_info
+            "jobs": jobs_info,
+            "rates_update": self.rates_update_status()
         }
     
     async def trigger_rates_update_now(self) -> dict:
@@ -0,0 +1,100 @@
+"""Circuit breaker и backoff для вызовов внешних API"""
+
+import random
+import time
+from typing import Any, Callable, Dict, Optional
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Размыкатель цепи для одного внешнего сервиса
+
+    После failure_threshold ошибок подряд цепь размыкается: вызовы не
+    выполняются reset_timeout_seconds. Затем пропускается один пробный
+    вызов (half_open): успех замыкает цепь, ошибка размыкает ее снова.
+    Сервис, который лежит, не получает запросов и не задерживает
+    вызывающих до ответа по таймауту.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int,
+        reset_timeout_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self._clock = clock
+        self.failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        """Текущее состояние цепи"""
+        if self._opened_at is None:
+            return BREAKER_CLOSED
+        if self._probe_in_flight or self.retry_after() == 0:
+            return BREAKER_HALF_OPEN
+        return BREAKER_OPEN
+
+    def retry_after(self) -> float:
+        """Сколько секунд цепь еще разомкнута"""
+        if self._opened_at is None:
+            return 0.0
+        return max(0.0, self._opened_at + self.reset_timeout_seconds - self._clock())
+
+    def allow(self) -> bool:
+        """
+        Можно ли выполнить вызов
+
+        В состоянии half_open разрешает только один пробный вызов: его
+        исход нужно передать в record_success или record_failure.
+        """
+        if self._opened_at is None:
+            return True
+        if self._probe_in_flight or self.retry_after() > 0:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self) -> None:
+        """Учитывает успешный вызов: цепь замыкается"""
+        self.failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        """Учитывает ошибку: цепь размыкается после failure_threshold ошибок подряд"""
+        self.failures += 1
+        if self._probe_in_flight or self.failures >= self.failure_threshold:
+            self._opened_at = self._clock()
+        self._probe_in_flight = False
+
+    def status(self) -> Dict[str, Any]:
+        """Состояние цепи для статуса и логов"""
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "retry_after_seconds": round(self.retry_after(), 1),
+        }
+
+
+def backoff_with_jitter(
+    attempt: int,
+    base_seconds: float,
+    max_seconds: float,
+    rng: Callable[[], float] = random.random,
+) -> float:
+    """
+    Пауза перед повтором attempt (с 1): экспоненциальная, с jitter
+
+    Пауза удваивается с каждой попыткой до max_seconds, а случайная
+    половина паузы разносит повторы воркеров и процессов во времени.
+    """
+    delay = min(max_seconds, base_seconds * 2 ** (attempt - 1))
+    return delay / 2 + rng() * delay / 2
@@ -0,0 +1,90 @@
+"""Общие HTTP-клиенты для внешних API"""
+
+from dataclasses import dataclass
+from typing import Dict
+
+import httpx
+import structlog
+
+from ..config import settings
+
+logger = structlog.get_logger()
+
+
+@dataclass(frozen=True)
+class UpstreamConfig:
+    """Параметры пула соединений к одному внешнему сервису"""
+    max_connections: int
+    max_keepalive_connections: int
+    http2: bool = True
+
+
+# Лимиты соединений по внешним сервисам. Имена совпадают с метками
+# upstream в метриках Prometheus (см. track_external_call).
+UPSTREAMS: Dict[str, UpstreamConfig] = {
+    # Источники курсов опрашиваются планировщиком раз в час
+    "openexchangerates": UpstreamConfig(max_connections=2, max_keepalive_connections=1),
+    "cbr": UpstreamConfig(max_connections=2, max_keepalive_connections=1),
+    "ecb": UpstreamConfig(max_connections=2, max_keepalive_connections=1),
+    # Проверка квитанций — на каждый запрос /iap/verify
+    "apple_production": UpstreamConfig(max_connections=50, max_keepalive_connections=20),
+    "apple_sandbox": UpstreamConfig(max_connections=10, max_keepalive_connections=5),
+    # Рассылка push: запросы мультиплексируются потоками HTTP/2 поверх
+    # нескольких долгоживущих соединений (рекомендация Apple)
+    "apns": UpstreamConfig(max_connections=4, max_keepalive_connections=4),
+}
+
+
+class HTTPClientRegistry:
+    """
+    Реестр httpx.AsyncClient процесса, по одному на внешний сервис
+
+    Клиенты создаются в lifespan и переиспользуют соединения между запросами:
+    TCP и TLS handshake выполняются один раз на соединение, а не на вызов.
+    Если клиент запрошен до start() (например, из скрипта), он создается
+    при первом обращении.
+    """
+
+    def __init__(self, upstreams: Dict[str, UpstreamConfig]):
+        self._upstreams = upstreams
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def _create(self, name: str) -> httpx.AsyncClient:
+        config = self._upstreams[name]
+        return httpx.AsyncClient(
+            timeout=settings.http_timeout_seconds,
+            http2=settings.http2_enabled and config.http2,
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_keepalive_connections,
+                keepalive_expiry=settings.http_keepalive_expiry_seconds,
+            ),
+        )
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """Клиент внешнего сервиса name"""
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._create(name)
+            self._clients[name] = client
+        return client
+
+    async def start(self) -> None:
+        """Создает клиенты всех известных внешних сервисов"""
+        for name in self._upstreams:
+            self.get(name)
+        logger.info("HTTP clients started", upstreams=sorted(self._clients), http2=settings.http2_enabled)
+
+    async def close(self) -> None:
+        """Закрывает клиенты и их соединения"""
+        clients, self._clients = self._clients, {}
+        for name, client in clients.items():
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning("Error closing HTTP client", upstream=name, error=str(e))
+        logger.info("HTTP clients closed")
+
+
+# Глобальный реестр HTTP-клиентов процесса
+http_clients = HTTPClientRegistry(UPSTREAMS)
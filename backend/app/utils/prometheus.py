@@ -0,0 +1,126 @@
+"""Метрики Prometheus"""
+
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Если задана переменная окружения PROMETHEUS_MULTIPROC_DIR, prometheus_client
+# пишет значения в файлы этого каталога, и метрики всех воркеров uvicorn
+# суммируются при отдаче. Каталог нужно очищать перед запуском сервиса.
+MULTIPROCESS_MODE = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+HTTP_REQUEST_DURATION = Histogram(
+    "convertik_http_request_duration_seconds",
+    "Длительность обработки HTTP запросов",
+    ["method", "route", "status"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "convertik_http_requests_in_flight",
+    "HTTP запросы в обработке",
+    ["method"],
+    multiprocess_mode="livesum",
+)
+
+DB_QUERIES = Counter(
+    "convertik_db_queries_total",
+    "SQL запросы к базе данных",
+    ["statement"],
+)
+
+CACHE_REQUESTS = Counter(
+    "convertik_cache_requests_total",
+    "Обращения к кэшам (hit / miss)",
+    ["cache", "result"],
+)
+
+EXTERNAL_API_CALLS = Counter(
+    "convertik_external_api_calls_total",
+    "Запросы к внешним API",
+    ["upstream", "outcome"],
+)
+
+EXTERNAL_API_DURATION = Histogram(
+    "convertik_external_api_duration_seconds",
+    "Длительность запросов к внешним API",
+    ["upstream"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+STATS_EVENTS = Counter(
+    "convertik_stats_events_total",
+    "События аналитики в очереди записи (accepted / rejected / written / dropped)",
+    ["outcome"],
+)
+
+STATS_QUEUE_DEPTH = Gauge(
+    "convertik_stats_queue_depth",
+    "События аналитики, ожидающие записи в БД",
+    multiprocess_mode="livesum",
+)
+
+PUSH_NOTIFICATIONS = Counter(
+    "convertik_push_notifications_total",
+    "Push-уведомления в рассылках (sent / failed / pruned)",
+    ["outcome"],
+)
+
+RATES_STREAM_CONNECTIONS = Gauge(
+    "convertik_rates_stream_connections",
+    "Открытые подключения к потоку обновлений курсов",
+    ["transport"],
+    multiprocess_mode="livesum",
+)
+
+SCHEDULER_JOB_RUNS = Counter(
+    "convertik_scheduler_job_runs_total",
+    "Запуски фоновых задач планировщика",
+    ["job", "outcome"],
+)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    """Учитывает попадание или промах кэша"""
+    CACHE_REQUESTS.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+@contextmanager
+def track_external_call(upstream: str) -> Iterator[None]:
+    """Учитывает запрос к внешнему API: исход и длительность"""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "success"
+    finally:
+        EXTERNAL_API_CALLS.labels(upstream=upstream, outcome=outcome).inc()
+        EXTERNAL_API_DURATION.labels(upstream=upstream).observe(time.perf_counter() - started)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Метрики в текстовом формате Prometheus (по всем воркерам в multiprocess режиме)"""
+    if MULTIPROCESS_MODE:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead() -> None:
+    """Удаляет live-метрики завершающегося воркера"""
+    if MULTIPROCESS_MODE:
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,25 @@
+"""Ограничение частоты запросов к внешним сервисам"""
+
+import asyncio
+import time
+
+
+class RateLimiter:
+    """
+    Равномерно распределяет операции во времени: не больше rate_per_second
+
+    Каждый вызов acquire() резервирует следующий свободный слот и ждет его.
+    Слот резервируется без await, поэтому блокировка не нужна.
+    """
+
+    def __init__(self, rate_per_second: float):
+        self.interval = 1.0 / rate_per_second if rate_per_second > 0 else 0.0
+        self._next_slot = 0.0
+
+    async def acquire(self) -> None:
+        """Ждет своего слота"""
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
@@ -0,0 +1,56 @@
+"""Объединение одновременных одинаковых вычислений (single-flight)"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Выполняет не более одного вычисления на ключ в процессе
+
+    Первый вызывающий с данным ключом (лидер) выполняет вычисление в своей
+    задаче, остальные ждут его результата или исключения. Если лидер отменен
+    (клиент отключился), ожидающие не получают CancelledError: один из них
+    становится новым лидером и выполняет вычисление сам.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        """Выполняется ли сейчас вычисление по ключу"""
+        return key in self._calls
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Возвращает результат fn(), объединяя одновременные вызовы с одним ключом"""
+        while True:
+            future = self._calls.get(key)
+            if future is None:
+                break
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # Лидер отменен — повторяем попытку и, возможно, становимся лидером
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Помечаем исключение полученным: ожидающих может не быть
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._calls.get(key) is future:
+                del self._calls[key]
@@ -0,0 +1,216 @@
+"""
+Бенчмарк рассылки push-уведомлений против локальной заглушки APNs
+
+В отдельном процессе поднимается заглушка APNs: HTTP/2 без TLS (prior
+knowledge) на пакете h2, с заданной задержкой ответа. Клиент открывает
+соединения с теми же лимитами, что и upstream "apns" в http_clients, и
+мультиплексирует запросы потоками HTTP/2, как при работе с настоящим APNs.
+Сегмент синтетический: токены генерируются на лету, как строки из
+серверного курсора, поэтому пиковая память не должна зависеть от --devices.
+Токены с префиксом dead заглушка отклоняет с 410 Unregistered.
+
+Запуск из каталога backend (БД не нужна):
+
+    python -m benchmarks.bench_push_fanout --devices 1000000 --concurrency 500
+
+Код возврата 1, если скорость ниже --min-rate уведомлений в секунду.
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import resource
+import socket
+import sys
+import time
+import uuid
+from typing import AsyncIterator, Dict, List
+
+import h2.config
+import h2.connection
+import h2.events
+import h2.exceptions
+import h2.settings
+import httpx
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from app.config import settings
+from app.services.apns import APNsClient
+from app.services.push_service import PushDispatcher, PushSegment, TokenRow, build_apns_payload
+from app.utils.http_clients import UPSTREAMS
+
+INVALID_PREFIX = "dead"
+
+# Лимит потоков на соединение, как у api.push.apple.com
+MAX_CONCURRENT_STREAMS = 1000
+
+
+class FakeAPNsProtocol(asyncio.Protocol):
+    """Сервер HTTP/2, отвечающий как POST /3/device/{token} в APNs"""
+
+    def __init__(self, latency_seconds: float):
+        self.latency_seconds = latency_seconds
+        self.conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+        self.paths: Dict[int, str] = {}
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.conn.initiate_connection()
+        self.conn.update_settings({h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS: MAX_CONCURRENT_STREAMS})
+        transport.write(self.conn.data_to_send())
+
+    def data_received(self, data):
+        try:
+            events = self.conn.receive_data(data)
+        except h2.exceptions.ProtocolError:
+            self.transport.close()
+            return
+        for event in events:
+            if isinstance(event, h2.events.RequestReceived):
+                self.paths[event.stream_id] = dict(event.headers)[b":path"].decode()
+            elif isinstance(event, h2.events.DataReceived):
+                self.conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            elif isinstance(event, h2.events.StreamEnded):
+                asyncio.get_running_loop().call_later(self.latency_seconds, self.respond, event.stream_id)
+        self.transport.write(self.conn.data_to_send())
+
+    def respond(self, stream_id: int):
+        token = self.paths.pop(stream_id, "").rsplit("/", 1)[-1]
+        if token.startswith(INVALID_PREFIX):
+            status, body = "410", b'{"reason":"Unregistered"}'
+        else:
+            status, body = "200", b""
+        try:
+            self.conn.send_headers(
+                stream_id,
+                [(":status", status), ("content-length", str(len(body)))],
+                end_stream=not body,
+            )
+            if body:
+                self.conn.send_data(stream_id, body, end_stream=True)
+        except h2.exceptions.StreamClosedError:
+            return
+        self.transport.write(self.conn.data_to_send())
+
+
+def serve_fake_apns(port: int, latency_seconds: float) -> None:
+    async def serve():
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: FakeAPNsProtocol(latency_seconds), "127.0.0.1", port, backlog=1024)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+def wait_for_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def synthetic_tokens(devices: int, invalid_every: int):
+    async def token_source(segment: PushSegment, batch_size: int) -> AsyncIterator[TokenRow]:
+        for i in range(devices):
+            prefix = INVALID_PREFIX if invalid_every and i % invalid_every == 0 else "ok"
+            yield uuid.uuid4(), f"{prefix}{i:064x}"
+            if i % batch_size == 0:
+                # Как при чтении следующей порции курсора
+                await asyncio.sleep(0)
+
+    return token_source
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss в килобайтах на Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run(args: argparse.Namespace) -> float:
+    # HTTP/2 без TLS: httpx договаривается о протоколе только через ALPN,
+    # поэтому для http:// заглушки HTTP/1.1 отключается явно
+    upstream = UPSTREAMS["apns"]
+    client = httpx.AsyncClient(
+        http1=False,
+        http2=True,
+        timeout=settings.http_timeout_seconds,
+        limits=httpx.Limits(
+            max_connections=upstream.max_connections,
+            max_keepalive_connections=upstream.max_keepalive_connections,
+        ),
+    )
+    sender = APNsClient(f"http://127.0.0.1:{args.port}", settings.apns_topic, client_factory=lambda: client)
+
+    pruned: List[int] = []
+
+    async def count_pruned(rows: List[TokenRow]) -> int:
+        pruned.append(len(rows))
+        return len(rows)
+
+    dispatcher = PushDispatcher(
+        sender,
+        concurrency=args.concurrency,
+        stream_batch_size=settings.push_stream_batch_size,
+        prune_batch_size=settings.push_prune_batch_size,
+        token_source=synthetic_tokens(args.devices, args.invalid_every),
+        pruner=count_pruned,
+    )
+
+    rss_before = peak_rss_mb()
+    started = time.perf_counter()
+    job = dispatcher.start(PushSegment(), build_apns_payload("Курс обновлен", "Convertik", None))
+    while job.status == "running":
+        await asyncio.sleep(1)
+        print(f"  {job.matched:>9} read  {job.sent:>9} sent  {job.pruned:>7} pruned", end="\r")
+    elapsed = time.perf_counter() - started
+
+    await client.aclose()
+
+    rate = job.matched / elapsed if elapsed else 0.0
+    print()
+    print(f"status:       {job.status} {job.error or ''}")
+    print(f"devices:      {job.matched} (sent {job.sent}, failed {job.failed}, pruned {job.pruned} in {len(pruned)} batches)")
+    print(f"elapsed:      {elapsed:.1f} s, {rate:.0f} notifications/s")
+    print(f"peak RSS:     {rss_before:.0f} MB before, {peak_rss_mb():.0f} MB after")
+    return rate
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=100000)
+    parser.add_argument("--concurrency", type=int, default=settings.push_send_concurrency)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="задержка ответа заглушки")
+    parser.add_argument("--invalid-every", type=int, default=50, help="каждый N-й токен недействителен")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--min-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    # Ключ для подписи provider token: заглушка его не проверяет
+    settings.apns_key = ec.generate_private_key(ec.SECP256R1()).private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+    settings.apns_key_id = settings.apns_key_id or "BENCHKEY"
+    settings.apns_team_id = settings.apns_team_id or "BENCHTEAM"
+
+    server = multiprocessing.Process(target=serve_fake_apns, args=(args.port, args.latency_ms / 1000), daemon=True)
+    server.start()
+    try:
+        wait_for_port(args.port)
+        rate = asyncio.run(run(args))
+    finally:
+        server.terminate()
+    return 1 if rate < args.min_rate else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""
+Бенчмарк проверки подписок на курсы
+
+Заполняет отдельную схему bench_alerts таблицей rate_alerts с теми же
+частичными индексами, что и рабочая, и меряет trigger_rate_alerts из
+app.services.rate_alerts после сдвига курсов на --move. Пороги
+распределены вокруг текущего курса в пределах --spread, как у реальных
+подписок: сработать должны только подписки в узкой полосе сдвига.
+Каждый замер выполняется в транзакции с откатом, данные не меняются.
+
+Запуск из каталога backend (нужна PostgreSQL из DATABASE_URL):
+
+    python -m benchmarks.bench_rate_alerts --alerts 5000000
+
+Код возврата 1, если медиана дольше --max-ms.
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.config import settings
+from app.services.cross_rates import CrossRateMatrix
+from app.services.rate_alerts import trigger_rate_alerts
+
+BENCH_SCHEMA = "bench_alerts"
+
+CREATE_TABLE_QUERIES = [
+    f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE",
+    f"CREATE SCHEMA {BENCH_SCHEMA}",
+    f"""
+    CREATE TABLE {BENCH_SCHEMA}.rate_alerts (
+        id BIGSERIAL PRIMARY KEY,
+        device_id UUID NOT NULL,
+        base VARCHAR(3) NOT NULL,
+        quote VARCHAR(3) NOT NULL,
+        direction VARCHAR(5) NOT NULL,
+        threshold NUMERIC(18, 6) NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        triggered_at TIMESTAMPTZ,
+        triggered_rate NUMERIC(18, 6)
+    )
+    """,
+]
+
+# Индексы как в рабочей схеме (см. миграцию add_rate_alerts_table)
+CREATE_INDEX_QUERIES = [
+    f"CREATE INDEX ix_bench_rate_alerts_device_id ON {BENCH_SCHEMA}.rate_alerts (device_id)",
+    f"""CREATE INDEX ix_bench_rate_alerts_pending_above ON {BENCH_SCHEMA}.rate_alerts (base, quote, threshold)
+        WHERE triggered_at IS NULL AND direction = 'above'""",
+    f"""CREATE INDEX ix_bench_rate_alerts_pending_below ON {BENCH_SCHEMA}.rate_alerts (base, quote, threshold)
+        WHERE triggered_at IS NULL AND direction = 'below'""",
+    f"ANALYZE {BENCH_SCHEMA}.rate_alerts",
+]
+
+SEED_QUERY = f"""
+    INSERT INTO {BENCH_SCHEMA}.rate_alerts (device_id, base, quote, direction, threshold)
+    SELECT
+        ('00000000-0000-4000-8000-' || lpad(to_hex((random() * :devices)::int), 12, '0'))::uuid,
+        pair.code,
+        'RUB',
+        CASE WHEN g % 2 = 0 THEN 'above' ELSE 'below' END,
+        CASE
+            WHEN g % 2 = 0 THEN pair.rate * (1 + random() * :spread)
+            ELSE pair.rate * (1 - random() * :spread)
+        END
+    FROM generate_series(:first_id, :last_id) AS g
+    JOIN unnest(CAST(:codes AS varchar[]), CAST(:rates AS double precision[])) WITH ORDINALITY
+        AS pair(code, rate, n) ON pair.n = 1 + g % :currencies
+"""
+
+SEED_CHUNK = 1_000_000
+
+
+def synthetic_rates(currencies: int) -> Dict[str, float]:
+    """Курсы относительно RUB: сколько единиц валюты за 1 RUB"""
+    rng = random.Random(42)
+    return {f"X{i:02d}": 1 / rng.uniform(0.01, 500.0) for i in range(currencies)}
+
+
+async def seed(engine, alerts: int, devices: int, rates: Dict[str, float], spread: float) -> None:
+    """Создает схему бенчмарка и заполняет rate_alerts"""
+    async with engine.begin() as conn:
+        for query in CREATE_TABLE_QUERIES:
+            await conn.execute(text(query))
+
+    started = time.perf_counter()
+    for first_id in range(1, alerts + 1, SEED_CHUNK):
+        async with engine.begin() as conn:
+            await conn.execute(
+                text(SEED_QUERY),
+                {
+                    "devices": devices,
+                    "spread": spread,
+                    "codes": list(rates),
+                    "rates": [1 / value for value in rates.values()],
+                    "currencies": len(rates),
+                    "first_id": first_id,
+                    "last_id": min(first_id + SEED_CHUNK - 1, alerts),
+                }
+            )
+        print(f"  seeded {min(first_id + SEED_CHUNK - 1, alerts):>12,} / {alerts:,}", flush=True)
+
+    async with engine.begin() as conn:
+        for query in CREATE_INDEX_QUERIES:
+            await conn.execute(text(query))
+    print(f"  seed finished in {time.perf_counter() - started:.1f}s")
+
+
+async def measure(engine, matrix: CrossRateMatrix, runs: int) -> List[float]:
+    """Время trigger_rate_alerts (первый прогон — прогрев, не учитывается)"""
+    timings = []
+    triggered = 0
+    for run in range(runs + 1):
+        async with engine.connect() as conn:
+            await conn.execute(text(f"SET search_path TO {BENCH_SCHEMA}"))
+            db = AsyncSession(bind=conn)
+            started = time.perf_counter()
+            triggered = len(await trigger_rate_alerts(db, matrix))
+            if run:
+                timings.append(time.perf_counter() - started)
+            await db.rollback()
+            await db.close()
+    print(f"  triggered {triggered:,} alerts per run")
+    return timings
+
+
+async def main(args: argparse.Namespace) -> int:
+    rates = synthetic_rates(args.currencies)
+    engine = create_async_engine(settings.database_url)
+    try:
+        if not args.skip_seed:
+            print(f"Seeding {args.alerts:,} alerts into {BENCH_SCHEMA}.rate_alerts")
+            await seed(engine, args.alerts, args.devices, rates, args.spread)
+
+        failed = False
+        print(f"{'move':>8}{'median, ms':>14}{'max, ms':>12}")
+        for move in (args.move, -args.move):
+            # Курс X/RUB = 1 / value, поэтому рост на move — деление value на (1 + move)
+            matrix = CrossRateMatrix(1, "RUB", {code: value / (1 + move) for code, value in rates.items()})
+            timings = await measure(engine, matrix, args.runs)
+            median_ms = statistics.median(timings) * 1000
+            print(f"{move:>+8.2%}{median_ms:>14.1f}{max(timings) * 1000:>12.1f}")
+            failed = failed or median_ms > args.max_ms
+
+        if not args.keep:
+            async with engine.begin() as conn:
+                await conn.execute(text(f"DROP SCHEMA {BENCH_SCHEMA} CASCADE"))
+    finally:
+        await engine.dispose()
+
+    return 1 if failed else 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--alerts", type=int, default=5_000_000, help="Количество подписок")
+    parser.add_argument("--devices", type=int, default=1_000_000, help="Количество устройств")
+    parser.add_argument("--currencies", type=int, default=40, help="Количество валют (пары к RUB)")
+    parser.add_argument("--spread", type=float, default=0.2, help="Разброс порогов от текущего курса")
+    parser.add_argument("--move", type=float, default=0.002, help="Сдвиг курсов между обновлениями")
+    parser.add_argument("--runs", type=int, default=5, help="Количество замеров")
+    parser.add_argument("--max-ms", type=float, default=500.0, help="Максимально допустимая медиана")
+    parser.add_argument("--skip-seed", action="store_true", help="Использовать уже заполненную схему")
+    parser.add_argument("--keep", action="store_true", help="Не удалять схему после замеров")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
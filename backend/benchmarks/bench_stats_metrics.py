@@ -0,0 +1,214 @@
+"""
+Бенчмарк точных метрик /stats/metrics
+
+Сравнивает прежнюю схему (семь последовательных запросов, каждый со своим
+сканом usage_events) с однопроходным запросом из app.routes.stats на
+синтетической таблице. Данные генерируются через generate_series в отдельной
+схеме bench_stats, рабочие таблицы не затрагиваются.
+
+Запуск из каталога backend (нужна PostgreSQL из DATABASE_URL):
+
+    python -m benchmarks.bench_stats_metrics --events 10000000
+
+Код возврата 1, если ускорение хотя бы для одного периода меньше --min-speedup.
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.config import settings
+from app.routes.stats import _exact_counters, _metrics_bounds, _parse_metrics_window
+
+BENCH_SCHEMA = "bench_stats"
+
+EVENT_NAMES = ["app_open", "conversion", "ad_impression", "currency_added", "settings_open", "share"]
+
+CREATE_TABLE_QUERIES = [
+    f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE",
+    f"CREATE SCHEMA {BENCH_SCHEMA}",
+    f"""
+    CREATE TABLE {BENCH_SCHEMA}.usage_events (
+        id INTEGER PRIMARY KEY,
+        device_id UUID NOT NULL,
+        event_name VARCHAR(64) NOT NULL,
+        payload JSONB,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+]
+
+# Индексы как в рабочей схеме (см. начальную миграцию)
+CREATE_INDEX_QUERIES = [
+    f"CREATE INDEX ix_bench_usage_events_device_id ON {BENCH_SCHEMA}.usage_events (device_id)",
+    f"CREATE INDEX ix_bench_usage_events_event_name ON {BENCH_SCHEMA}.usage_events (event_name)",
+    f"ANALYZE {BENCH_SCHEMA}.usage_events",
+]
+
+SEED_QUERY = f"""
+    INSERT INTO {BENCH_SCHEMA}.usage_events (id, device_id, event_name, payload, created_at)
+    SELECT
+        g,
+        ('00000000-0000-4000-8000-' || lpad(to_hex((random() * :devices)::int), 12, '0'))::uuid,
+        (CAST(:event_names AS varchar[]))[1 + (g % :event_kinds)],
+        NULL,
+        NOW() - random() * make_interval(days => :days)
+    FROM generate_series(:first_id, :last_id) AS g
+"""
+
+SEED_CHUNK = 1_000_000
+
+
+async def legacy_counters(db: AsyncSession, bounds: Dict[str, Any]) -> Dict[str, Any]:
+    """Прежняя реализация: отдельный запрос и скан на каждую метрику"""
+    unique_devices_query = """
+        SELECT COUNT(DISTINCT device_id)
+        FROM usage_events
+        WHERE created_at >= :start AND created_at <= :end
+    """
+    events_query = """
+        SELECT COUNT(*)
+        FROM usage_events
+        WHERE created_at >= :start AND created_at <= :end
+    """
+    top_events_query = """
+        SELECT event_name, COUNT(*) as count
+        FROM usage_events
+        WHERE created_at >= :start AND created_at <= :end
+        GROUP BY event_name
+        ORDER BY count DESC
+        LIMIT 10
+    """
+    end = bounds["end"]
+
+    dau = await db.execute(
+        text("""
+            SELECT COUNT(DISTINCT device_id)
+            FROM usage_events
+            WHERE created_at >= :start AND created_at < :end
+        """),
+        {"start": bounds["dau_start"], "end": bounds["dau_end"]}
+    )
+    wau = await db.execute(text(unique_devices_query), {"start": bounds["wau_start"], "end": end})
+    mau = await db.execute(text(unique_devices_query), {"start": bounds["mau_start"], "end": end})
+    events = await db.execute(text(events_query), {"start": bounds["period_start"], "end": end})
+    events_24h = await db.execute(text(events_query), {"start": bounds["events_24h_start"], "end": end})
+    unique_devices = await db.execute(text(unique_devices_query), {"start": bounds["period_start"], "end": end})
+    top_events = await db.execute(text(top_events_query), {"start": bounds["period_start"], "end": end})
+
+    return {
+        "dau": dau.scalar() or 0,
+        "wau": wau.scalar() or 0,
+        "mau": mau.scalar() or 0,
+        "events_period": events.scalar() or 0,
+        "events_24h": events_24h.scalar() or 0,
+        "unique_devices_period": unique_devices.scalar() or 0,
+        "top_events": [(event_name, count) for event_name, count in top_events.fetchall()],
+    }
+
+
+async def seed(engine, events: int, devices: int, days: int) -> None:
+    """Создает схему бенчмарка и заполняет usage_events"""
+    async with engine.begin() as conn:
+        for query in CREATE_TABLE_QUERIES:
+            await conn.execute(text(query))
+
+    started = time.perf_counter()
+    for first_id in range(1, events + 1, SEED_CHUNK):
+        async with engine.begin() as conn:
+            await conn.execute(
+                text(SEED_QUERY),
+                {
+                    "devices": devices,
+                    "event_names": EVENT_NAMES,
+                    "event_kinds": len(EVENT_NAMES),
+                    "days": days,
+                    "first_id": first_id,
+                    "last_id": min(first_id + SEED_CHUNK - 1, events),
+                }
+            )
+        print(f"  seeded {min(first_id + SEED_CHUNK - 1, events):>12,} / {events:,}", flush=True)
+
+    async with engine.begin() as conn:
+        for query in CREATE_INDEX_QUERIES:
+            await conn.execute(text(query))
+    print(f"  seed finished in {time.perf_counter() - started:.1f}s")
+
+
+async def measure(
+    engine,
+    counters: Callable[[AsyncSession, Dict[str, Any]], Awaitable[Dict[str, Any]]],
+    bounds: Dict[str, Any],
+    runs: int,
+) -> Tuple[List[float], Dict[str, Any]]:
+    """Время выполнения counters (первый прогон — прогрев, не учитывается)"""
+    timings = []
+    result: Dict[str, Any] = {}
+    async with engine.connect() as conn:
+        await conn.execute(text(f"SET search_path TO {BENCH_SCHEMA}"))
+        db = AsyncSession(bind=conn)
+        for run in range(runs + 1):
+            started = time.perf_counter()
+            result = await counters(db, bounds)
+            if run:
+                timings.append(time.perf_counter() - started)
+        await db.close()
+    return timings, result
+
+
+async def main(args: argparse.Namespace) -> int:
+    engine = create_async_engine(settings.database_url)
+    failed = False
+    try:
+        if not args.skip_seed:
+            print(f"Seeding {args.events:,} events into {BENCH_SCHEMA}.usage_events")
+            await seed(engine, args.events, args.devices, args.days)
+
+        print(f"{'period':<8}{'legacy, ms':>14}{'single-pass, ms':>18}{'speedup':>10}")
+        for period in ("day", "week", "month"):
+            window_start, end_datetime, _, explicit_start = _parse_metrics_window(period, None, None)
+            bounds = _metrics_bounds(window_start, end_datetime, explicit_start)
+
+            legacy_timings, legacy_result = await measure(engine, legacy_counters, bounds, args.runs)
+            new_timings, new_result = await measure(engine, _exact_counters, bounds, args.runs)
+
+            if legacy_result != new_result:
+                print(f"{period}: results differ\n  legacy: {legacy_result}\n  new:    {new_result}")
+                failed = True
+
+            legacy_ms = statistics.median(legacy_timings) * 1000
+            new_ms = statistics.median(new_timings) * 1000
+            speedup = legacy_ms / new_ms if new_ms else float("inf")
+            print(f"{period:<8}{legacy_ms:>14.1f}{new_ms:>18.1f}{speedup:>9.2f}x")
+            if speedup < args.min_speedup:
+                failed = True
+
+        if not args.keep:
+            async with engine.begin() as conn:
+                await conn.execute(text(f"DROP SCHEMA {BENCH_SCHEMA} CASCADE"))
+    finally:
+        await engine.dispose()
+
+    return 1 if failed else 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=10_000_000, help="Количество событий в таблице")
+    parser.add_argument("--devices", type=int, default=200_000, help="Количество уникальных устройств")
+    parser.add_argument("--days", type=int, default=45, help="Глубина истории событий в днях")
+    parser.add_argument("--runs", type=int, default=5, help="Количество замеров на вариант")
+    parser.add_argument("--min-speedup", type=float, default=1.5, help="Минимально допустимое ускорение")
+    parser.add_argument("--skip-seed", action="store_true", help="Использовать уже заполненную схему")
+    parser.add_argument("--keep", action="store_true", help="Не удалять схему после замеров")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,26 @@
+"""
+Shared pytest configuration
+"""
+# Test modules import the app inside patch.dict('sys.modules', ...), which drops
+# every module first imported there. C-extension modules cannot be initialised
+# twice per process, so they are imported once here, before any patching.
+import numpy  # noqa: F401
+import psutil  # noqa: F401
+
+import os
+
+import pytest
+
+
+@pytest.fixture
+def postgres_url():
+    """
+    Async URL of a scratch PostgreSQL database for tests that run real SQL
+
+    Set TEST_POSTGRES_URL (postgresql+asyncpg://...) to run them; tests create
+    TEMP tables only, so nothing is left behind in the database.
+    """
+    url = os.environ.get("TEST_POSTGRES_URL")
+    if not url:
+        pytest.skip("TEST_POSTGRES_URL is not set")
+    return url
@@ -0,0 +1,48 @@
+"""
+Tests for the circuit breaker
+"""
+from app.utils.circuit_breaker import (
+    BREAKER_CLOSED,
+    BREAKER_HALF_OPEN,
+    BREAKER_OPEN,
+    CircuitBreaker,
+    backoff_with_jitter,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_opens_and_probes_once():
+    """Consecutive failures open the circuit, after the timeout a single probe decides"""
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout_seconds=60, clock=clock)
+
+    breaker.record_failure()
+    assert breaker.allow() and breaker.state == BREAKER_CLOSED
+    breaker.record_failure()
+    assert breaker.state == BREAKER_OPEN and not breaker.allow()
+    assert breaker.status()["retry_after_seconds"] == 60
+
+    clock.now = 61
+    assert breaker.allow() and breaker.state == BREAKER_HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == BREAKER_OPEN
+
+    clock.now = 122
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == BREAKER_CLOSED and breaker.failures == 0
+
+
+def test_backoff_doubles_with_jitter_and_cap():
+    """Delay doubles per attempt, jitter keeps it within the upper half, max caps it"""
+    assert backoff_with_jitter(1, 60, 1800, rng=lambda: 0.0) == 30
+    assert backoff_with_jitter(3, 60, 1800, rng=lambda: 1.0) == 240
+    assert backoff_with_jitter(10, 60, 1800, rng=lambda: 0.5) == 1350
@@ -0,0 +1,37 @@
+"""
+Tests for the cross rate matrix
+"""
+import math
+import os
+from unittest.mock import patch, MagicMock
+
+# Set environment variables
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///:memory:"
+
+# Mock the database module completely
+with patch.dict('sys.modules', {'app.database': MagicMock()}):
+    from app.services.cross_rates import CrossRateMatrix
+
+RATES = {"USD": 0.0112, "EUR": 0.0101, "JPY": 0.8203}
+
+
+def test_cross_rate_matches_rub_rebasing():
+    """USD->EUR equals EUR per RUB divided by USD per RUB"""
+    matrix = CrossRateMatrix(1, "RUB", RATES)
+
+    assert math.isclose(matrix.rate("USD", "EUR"), 0.0101 / 0.0112)
+    assert math.isclose(matrix.rate("RUB", "USD"), 0.0112)
+    assert math.isclose(matrix.rate("USD", "RUB"), 1 / 0.0112)
+    assert matrix.rate("EUR", "EUR") == 1.0
+    assert matrix.rate("USD", "XXX") is None
+
+
+def test_convert_many_handles_unknown_codes():
+    """Batch conversion returns None only for unknown currencies"""
+    matrix = CrossRateMatrix(1, "RUB", RATES)
+    converted = matrix.convert_many([("USD", "JPY", 10.0), ("XXX", "USD", 1.0)])
+
+    rate, result = converted[0]
+    assert math.isclose(rate, 0.8203 / 0.0112)
+    assert math.isclose(result, 10 * 0.8203 / 0.0112)
+    assert converted[1] is None
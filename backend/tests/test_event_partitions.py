@@ -0,0 +1,81 @@
+"""
+Tests for usage_events partition planning
+"""
+import asyncio
+import os
+from datetime import date
+from unittest.mock import patch, MagicMock
+
+# Set environment variables
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///:memory:"
+
+# Mock the database module completely
+with patch.dict('sys.modules', {'app.database': MagicMock()}):
+    from app.services import event_partitions
+    from app.services.event_partitions import add_months, partition_bounds, plan_partitions
+
+
+def test_partition_bounds_cross_year():
+    """Monthly bounds are UTC and roll over the year"""
+    assert add_months(date(2026, 11, 1), 2) == date(2027, 1, 1)
+    assert add_months(date(2026, 1, 1), -1) == date(2025, 12, 1)
+    assert partition_bounds(date(2026, 12, 1)) == ("2026-12-01 00:00:00+00", "2027-01-01 00:00:00+00")
+
+
+def test_plan_creates_missing_and_drops_expired():
+    """Only missing future months are created, only our expired partitions dropped"""
+    existing = [
+        "usage_events_default",
+        "usage_events_p2025_08",
+        "usage_events_p2025_09",
+        "usage_events_p2026_10",
+        "usage_events_p2026_11",
+    ]
+    to_create, to_drop = plan_partitions(existing, date(2026, 10, 18), ahead_months=2, retention_months=13)
+
+    assert to_create == [date(2026, 12, 1)]
+    assert to_drop == ["usage_events_p2025_08"]
+
+    _, keep_all = plan_partitions(existing, date(2026, 10, 18), ahead_months=2, retention_months=0)
+    assert keep_all == []
+
+
+def test_default_partition_rows_expire_with_retention():
+    """Rows in the default partition expire at the same cutoff, and only when retention is set"""
+    executed = []
+
+    class Result:
+        rowcount = 3
+
+        def fetchall(self):
+            return [("usage_events_default",), ("usage_events_p2024_01",)]
+
+    class Session:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        async def execute(self, statement, params=None):
+            executed.append((str(statement), params))
+            return Result()
+
+        async def commit(self):
+            pass
+
+    async def run(retention_months):
+        executed.clear()
+        with patch.object(event_partitions, "async_sessionmaker", Session), \
+                patch.object(event_partitions.settings, "stats_partitions_ahead_months", -1), \
+                patch.object(event_partitions.settings, "stats_events_retention_months", retention_months):
+            return await event_partitions.manage_usage_event_partitions(date(2026, 10, 18))
+
+    kept = asyncio.run(run(0))
+    assert kept == {"created": [], "dropped": [], "default_deleted": 0}
+    assert not any("DELETE" in sql or "DROP" in sql for sql, _ in executed)
+
+    expired = asyncio.run(run(13))
+    assert expired["dropped"] == ["usage_events_p2024_01"] and expired["default_deleted"] == 3
+    sql, params = executed[-1]
+    assert sql.startswith("DELETE FROM usage_events_default") and params == {"cutoff": "2025-09-01 00:00:00+00"}
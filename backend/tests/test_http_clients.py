@@ -0,0 +1,23 @@
+"""
+Tests for the shared HTTP client registry
+"""
+import asyncio
+
+from app.utils.http_clients import HTTPClientRegistry, UpstreamConfig
+
+
+def test_registry_reuses_and_closes_clients():
+    """One pooled client per upstream, recreated after close"""
+    registry = HTTPClientRegistry({"example": UpstreamConfig(max_connections=3, max_keepalive_connections=1)})
+
+    async def scenario():
+        await registry.start()
+        client = registry.get("example")
+        assert registry.get("example") is client
+
+        await registry.close()
+        assert client.is_closed
+        assert registry.get("example") is not client
+        await registry.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,96 @@
+"""
+Tests for IAP receipt verification routing
+"""
+import asyncio
+import os
+from unittest.mock import AsyncMock, patch, MagicMock
+
+# Set environment variables
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///:memory:"
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import DeclarativeBase
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+# Mock the database module completely, keeping a real Base so statements compile
+with patch.dict('sys.modules', {'app.database': MagicMock(Base=Base)}):
+    from app.services import iap_service
+
+
+def test_known_sandbox_receipt_skips_production():
+    """Remembered environment avoids the production round trip"""
+    calls = []
+
+    async def fake_apple(receipt_data, use_sandbox=False):
+        calls.append(use_sandbox)
+        if not use_sandbox:
+            return {"status": iap_service.STATUS_SANDBOX_RECEIPT}
+        return {"status": 0}
+
+    async def scenario():
+        with patch.object(iap_service, "verify_receipt_with_apple", fake_apple):
+            unknown = await iap_service.verify_with_known_environment("receipt", None)
+            known = await iap_service.verify_with_known_environment("receipt", iap_service.ENVIRONMENT_SANDBOX)
+        return unknown, known
+
+    unknown, known = asyncio.run(scenario())
+    assert unknown == ({"status": 0}, "sandbox")
+    assert known == ({"status": 0}, "sandbox")
+    assert calls == [False, True, True]
+    assert iap_service.receipt_hash("receipt") == iap_service.receipt_hash("receipt")
+
+
+def test_claim_marks_revalidation_without_touching_last_check():
+    """Claiming receipts for revalidation must not make them look freshly verified"""
+    statements = []
+
+    class Session:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        async def execute(self, statement):
+            statements.append(statement)
+            result = MagicMock()
+            result.all.return_value = []
+            return result
+
+        async def commit(self):
+            pass
+
+    with patch.object(iap_service, "async_sessionmaker", Session):
+        assert asyncio.run(iap_service.claim_expiring_receipts()) == []
+
+    sql = str(statements[0].compile(dialect=postgresql.dialect()))
+    assert "SET last_check=iap_receipts.last_check, revalidate_claimed_at=" in sql
+    assert "iap_receipts.revalidate_claimed_at IS NULL OR iap_receipts.revalidate_claimed_at <" in sql
+    assert "FOR UPDATE SKIP LOCKED" in sql
+
+
+def test_verify_flight_is_shared_per_device_only():
+    """Concurrent checks coalesce per (receipt, device); each device's check stores its own device_id"""
+    stored = []
+
+    async def fake_verify_and_store(db, device_id, receipt_data, hash_value):
+        await asyncio.sleep(0.01)
+        stored.append((db, device_id))
+        return iap_service.IAPVerifyResponse(premium=False, expires_at=None)
+
+    async def scenario():
+        with patch.object(iap_service, "find_fresh_receipt_state", AsyncMock(return_value=None)), \
+                patch.object(iap_service, "_verify_and_store", fake_verify_and_store):
+            return await asyncio.gather(
+                iap_service.verify_receipt("db-a1", "device-a", "receipt"),
+                iap_service.verify_receipt("db-a2", "device-a", "receipt"),
+                iap_service.verify_receipt("db-b", "device-b", "receipt"),
+            )
+
+    results = asyncio.run(scenario())
+    assert all(cached is False for _, cached in results)
+    assert sorted(stored) == [("db-a1", "device-a"), ("db-b", "device-b")]
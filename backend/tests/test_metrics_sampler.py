@@ -0,0 +1,37 @@
+"""
+Tests for the background system metrics sampler
+"""
+import os
+import time
+from unittest.mock import patch, MagicMock
+
+# Set environment variables
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///:memory:"
+
+# Mock the database module completely
+with patch.dict('sys.modules', {'app.database': MagicMock()}):
+    from app.tasks.metrics_sampler import MetricsSampler
+
+
+def test_latest_samples_without_blocking():
+    """latest() returns immediately even before the background task runs"""
+    sampler = MetricsSampler(interval_seconds=10, history_size=5)
+
+    started = time.monotonic()
+    ts, metrics = sampler.latest()
+
+    assert time.monotonic() - started < 0.5
+    assert "cpu_usage_percent" in metrics
+    assert "process_memory_mb" in metrics
+
+
+def test_window_stats_and_ring_buffer():
+    """Window aggregates cover buffered samples only"""
+    sampler = MetricsSampler(interval_seconds=10, history_size=3)
+    now = time.time()
+    for i, value in enumerate([10.0, 20.0, 30.0, 40.0]):
+        sampler._samples.append((now - 3 + i, {"cpu_usage_percent": value}))
+
+    stats = sampler.window_stats(60)
+    assert stats["samples"] == 3
+    assert stats["metrics"]["cpu_usage_percent"] == {"min": 20.0, "avg": 30.0, "max": 40.0}
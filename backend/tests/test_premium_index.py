@@ -0,0 +1,32 @@
+"""
+Tests for the in-memory premium status index
+"""
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch, MagicMock
+
+# Set environment variables
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///:memory:"
+
+# Mock the database module completely
+with patch.dict('sys.modules', {'app.database': MagicMock()}):
+    from app.services.premium_index import PremiumIndex
+
+
+def test_premium_status_uses_latest_expiry():
+    """Later expiry wins, expired and unknown devices are not premium"""
+    index = PremiumIndex()
+    device = uuid.uuid4()
+    now = datetime(2026, 10, 18, 12, 0, tzinfo=timezone.utc)
+
+    index.update(device, now + timedelta(days=30))
+    index.update(device, now + timedelta(days=1))
+
+    premium, expires_at = index.status(device, now=now.timestamp())
+    assert premium is True
+    assert expires_at == now + timedelta(days=30)
+
+    assert index.status(device, now=(now + timedelta(days=31)).timestamp())[0] is False
+    assert index.status(uuid.uuid4()) == (False, None)
+    assert len(index) == 1
@@ -0,0 +1,83 @@
+"""
+Tests for the Prometheus metrics
+"""
+import os
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+# Set environment variables before any imports
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///:memory:"
+os.environ["REDIS_URL"] = "redis://localhost:6379/0"
+os.environ["RATES_API_KEY"] = "test_key"
+os.environ["ADMIN_TOKEN"] = "test_token"
+
+# Mock the database module completely
+with patch.dict('sys.modules', {'app.database': MagicMock()}):
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.utils import prometheus
+
+client = TestClient(app)
+
+
+def sample(name, **labels):
+    return prometheus.REGISTRY.get_sample_value(name, labels) or 0
+
+
+def route_counts(suffix, status):
+    """Request counts by route label ending in suffix (newer FastAPI omits the include prefix)"""
+    counts = {}
+    for metric in prometheus.REGISTRY.collect():
+        for s in metric.samples:
+            if (s.name == "convertik_http_request_duration_seconds_count"
+                    and s.labels["route"].endswith(suffix) and s.labels["status"] == status):
+                counts[s.labels["route"]] = s.value
+    return counts
+
+
+def test_requests_are_labelled_by_route_template():
+    """Latency is recorded per route template, not per URL"""
+    template = "/rates/{currency_code}/history"
+    before = sum(route_counts(template, "422").values())
+    unmatched_before = sample("convertik_http_request_duration_seconds_count",
+                              method="GET", route="unmatched", status="404")
+
+    assert client.get("/api/v1/rates/usd/history?step=year").status_code == 422
+    assert client.get("/api/v1/rates/eur/history?step=year").status_code == 422
+    assert client.get("/no-such-route").status_code == 404
+
+    after = route_counts(template, "422")
+    assert len(after) == 1
+    assert sum(after.values()) == before + 2
+    assert sample("convertik_http_request_duration_seconds_count",
+                  method="GET", route="unmatched", status="404") == unmatched_before + 1
+    assert sample("convertik_http_requests_in_flight", method="GET") == 0
+
+
+def test_external_calls_and_cache_results_are_counted():
+    """External calls record outcome and duration; caches record hits and misses"""
+    with prometheus.track_external_call("test_upstream"):
+        pass
+    with pytest.raises(RuntimeError):
+        with prometheus.track_external_call("test_upstream"):
+            raise RuntimeError("boom")
+    prometheus.record_cache("test_cache", True)
+    prometheus.record_cache("test_cache", False)
+    prometheus.record_cache("test_cache", False)
+
+    assert sample("convertik_external_api_calls_total", upstream="test_upstream", outcome="success") == 1
+    assert sample("convertik_external_api_calls_total", upstream="test_upstream", outcome="error") == 1
+    assert sample("convertik_external_api_duration_seconds_count", upstream="test_upstream") == 2
+    assert sample("convertik_cache_requests_total", cache="test_cache", result="hit") == 1
+    assert sample("convertik_cache_requests_total", cache="test_cache", result="miss") == 2
+
+
+def test_prometheus_endpoint_renders_text_format():
+    """The endpoint serves the registry in the Prometheus text format"""
+    response = client.get("/api/v1/metrics/prometheus")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "convertik_http_request_duration_seconds_bucket" in response.text
+    assert "convertik_scheduler_job_runs_total" in response.text
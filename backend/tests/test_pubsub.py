@@ -0,0 +1,37 @@
+"""
+Tests for the Redis pub/sub listener dispatch
+"""
+import asyncio
+import os
+from unittest.mock import patch, MagicMock
+
+# Set environment variables
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///:memory:"
+
+# Mock the database module completely
+with patch.dict('sys.modules', {'app.database': MagicMock()}):
+    from app.services.pubsub import PubSubListener
+
+
+def test_dispatch_routes_messages_and_isolates_failures():
+    """Messages reach every handler of their channel, bad input and errors are contained"""
+    listener = PubSubListener()
+    received = []
+
+    async def failing(message):
+        raise RuntimeError("handler bug")
+
+    async def recording(message):
+        received.append(message)
+
+    listener.subscribe("rates:updated", failing)
+    listener.subscribe("rates:updated", recording)
+    listener.subscribe("other", recording)
+
+    async def scenario():
+        await listener.dispatch("rates:updated", b'{"version": 42}')
+        await listener.dispatch("rates:updated", b"not json")
+        await listener.dispatch("unknown", b'{"version": 1}')
+
+    asyncio.run(scenario())
+    assert received == [{"version": 42}]
@@ -0,0 +1,180 @@
+"""
+Tests for push notification fan-out
+"""
+import asyncio
+import os
+import uuid
+from unittest.mock import AsyncMock, patch, MagicMock
+
+import httpx
+
+# Set environment variables
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///:memory:"
+
+# Mock the database module completely
+with patch.dict('sys.modules', {'app.database': MagicMock()}):
+    from app.services import apns, push_service
+
+
+class FakeSender:
+    """Stand-in APNs sender tracking concurrency"""
+
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+
+    def provider_token(self):
+        return "token"
+
+    async def send(self, device_token, payload):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(0.001)
+        self.active -= 1
+        if device_token.startswith("dead"):
+            return apns.APNsResult(status=410, reason="Unregistered")
+        if device_token.startswith("busy"):
+            return apns.APNsResult(status=429, reason="TooManyRequests")
+        return apns.APNsResult(status=200)
+
+
+class FakeRedis:
+    """Shared Redis stand-in recording key TTLs"""
+
+    def __init__(self):
+        self.values = {}
+        self.ttls = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.values[key] = value
+        self.ttls[key] = ex
+
+
+def test_dispatcher_bounds_concurrency_and_prunes_tokens():
+    """Sends stay under the concurrency limit and invalid tokens are pruned in batches"""
+    tokens = [(uuid.uuid4(), f"{prefix}{i}") for i in range(50) for prefix in ("ok", "dead", "busy")]
+    pruned_batches = []
+
+    async def token_source(segment, batch_size):
+        for row in tokens:
+            yield row
+
+    async def pruner(rows):
+        pruned_batches.append(list(rows))
+        return len(rows)
+
+    sender = FakeSender()
+    dispatcher = push_service.PushDispatcher(
+        sender, concurrency=8, stream_batch_size=10, prune_batch_size=20,
+        token_source=token_source, pruner=pruner, redis_factory=AsyncMock(return_value=FakeRedis())
+    )
+
+    async def scenario():
+        job = await dispatcher.start(push_service.PushSegment(), {"aps": {}})
+        while job.status == "running":
+            await asyncio.sleep(0.01)
+        return job
+
+    job = asyncio.run(scenario())
+    assert job.status == "completed"
+    assert (job.matched, job.sent, job.failed, job.pruned) == (150, 50, 50, 50)
+    assert sender.max_active <= 8
+    assert all(len(batch) <= 20 + 8 for batch in pruned_batches)
+    assert sorted(token for batch in pruned_batches for _, token in batch) == sorted(
+        token for _, token in tokens if token.startswith("dead")
+    )
+    assert asyncio.run(dispatcher.get(job.job_id)) is job
+
+
+def test_push_job_state_is_visible_from_other_workers():
+    """A job started on one worker is reported by another from Redis, with progress and final counts"""
+    redis = FakeRedis()
+    release = asyncio.Event()
+
+    async def token_source(segment, batch_size):
+        for i in range(10):
+            if i == 5:
+                await release.wait()
+            yield uuid.uuid4(), f"ok{i}"
+
+    def dispatcher():
+        return push_service.PushDispatcher(
+            FakeSender(), concurrency=2, stream_batch_size=10, prune_batch_size=10, job_ttl_seconds=600,
+            progress_interval_seconds=0.02, token_source=token_source, redis_factory=AsyncMock(return_value=redis)
+        )
+
+    owner, other = dispatcher(), dispatcher()
+    segment = push_service.PushSegment(premium=True, locale="ru")
+
+    async def scenario():
+        job = await owner.start(segment, {"aps": {}})
+        started = await other.get(job.job_id)
+        await asyncio.sleep(0.1)
+        running = await other.get(job.job_id)
+        release.set()
+        while job.status == "running":
+            await asyncio.sleep(0.01)
+        finished = await other.get(job.job_id)
+        return job, started, running, finished, await other.get("unknown")
+
+    job, started, running, finished, unknown = asyncio.run(scenario())
+
+    assert started.status == "running" and started.segment == segment and started.sent == 0
+    assert running.status == "running" and running.sent == 5
+    assert finished == job
+    assert (finished.status, finished.sent) == ("completed", 10)
+    assert finished.finished_at is not None and finished.started_at == job.started_at
+    assert unknown is None
+    assert redis.ttls[f"{push_service.PUSH_JOB_PREFIX}{job.job_id}"] == 600
+
+
+def test_push_job_lookup_survives_redis_errors():
+    """Redis being down turns a foreign job lookup into a miss rather than an error"""
+    dispatcher = push_service.PushDispatcher(
+        FakeSender(), concurrency=1, stream_batch_size=1, prune_batch_size=1,
+        redis_factory=AsyncMock(side_effect=ConnectionError("redis is down"))
+    )
+
+    assert asyncio.run(dispatcher.get("elsewhere")) is None
+
+
+def test_apns_client_signs_and_parses_responses():
+    """Requests carry an ES256 provider token; 410 marks the token invalid"""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from jose import jwt
+
+    key = ec.generate_private_key(ec.SECP256R1()).private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        if request.url.path.endswith("/gone"):
+            return httpx.Response(410, json={"reason": "Unregistered"})
+        return httpx.Response(200)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    sender = apns.APNsClient("http://apns.test/", "com.example.app", client_factory=lambda: client)
+
+    async def scenario():
+        return await sender.send("abc", b"{}"), await sender.send("gone", b"{}")
+
+    with patch.multiple(apns.settings, apns_key=key, apns_key_id="KEY123", apns_team_id="TEAM123"):
+        ok, gone = asyncio.run(scenario())
+
+    assert ok.ok and not ok.token_invalid
+    assert gone.token_invalid
+    assert seen[0].url == "http://apns.test/3/device/abc"
+    assert seen[0].headers["apns-topic"] == "com.example.app"
+    assert seen[0].headers["authorization"] == seen[1].headers["authorization"]
+
+    provider_token = seen[0].headers["authorization"].removeprefix("bearer ")
+    assert jwt.get_unverified_header(provider_token)["kid"] == "KEY123"
+    assert jwt.get_unverified_claims(provider_token)["iss"] == "TEAM123"
@@ -0,0 +1,272 @@
+"""
+Tests for rate alert evaluation
+"""
+import asyncio
+import os
+import uuid
+from collections import namedtuple
+from decimal import Decimal
+from unittest.mock import patch, MagicMock
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+# Set environment variables
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///:memory:"
+
+# Mock the database module completely
+with patch.dict('sys.modules', {'app.database': MagicMock()}):
+    from app.services import apns, push_service, rate_alerts
+    from app.services.cross_rates import CrossRateMatrix
+
+TriggeredAlert = namedtuple("TriggeredAlert", "id device_id base quote threshold rate")
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def all(self):
+        return self._rows
+
+
+class FakeSession:
+    """Returns pending pairs for pair queries and echoes triggered alerts for updates"""
+
+    def __init__(self, pairs):
+        self.pairs = pairs
+        self.updates = []
+
+    async def execute(self, statement, params=None):
+        if params is None:
+            direction = rate_alerts.DIRECTION_ABOVE if "'above'" in str(statement) else rate_alerts.DIRECTION_BELOW
+            return FakeResult(self.pairs[direction])
+        self.updates.append((str(statement), params))
+        rows = [
+            TriggeredAlert(len(self.updates), uuid.uuid4(), base, quote, Decimal("1"), rate)
+            for base, quote, rate in zip(params["bases"], params["quotes"], params["rates"])
+        ]
+        return FakeResult(rows)
+
+
+def test_trigger_rate_alerts_prices_pending_pairs():
+    """Each direction gets one batched update with cross rates of its pending pairs"""
+    # Курсы относительно RUB: 1 RUB = 0.0125 USD = 0.0111 EUR
+    matrix = CrossRateMatrix(1, "RUB", {"USD": 0.0125, "EUR": 0.0111})
+    session = FakeSession({
+        rate_alerts.DIRECTION_ABOVE: [("USD", "RUB"), ("XXX", "RUB")],
+        rate_alerts.DIRECTION_BELOW: [("EUR", "USD")],
+    })
+
+    triggered = asyncio.run(rate_alerts.trigger_rate_alerts(session, matrix))
+
+    assert len(session.updates) == 2
+    above_sql, above = session.updates[0]
+    assert "alert.threshold <= pair.rate" in above_sql and "'above'" in above_sql
+    assert above["bases"] == ["USD"] and above["quotes"] == ["RUB"]
+    assert float(above["rates"][0]) == 80.0
+    below_sql, below = session.updates[1]
+    assert "alert.threshold >= pair.rate" in below_sql
+    assert abs(float(below["rates"][0]) - 0.0125 / 0.0111) < 1e-9
+    assert [direction for direction, _ in triggered] == ["above", "below"]
+
+    message = rate_alerts.alert_message(*triggered[0])
+    assert message.title == "USD/RUB ≥ 1"
+    assert message.payload["rate"] == 80.0
+
+
+def test_alert_reached():
+    """Direction decides on which side of the threshold the alert fires"""
+    assert rate_alerts.alert_reached("above", 100.0, 100.0)
+    assert not rate_alerts.alert_reached("above", 100.0, 99.9)
+    assert rate_alerts.alert_reached("below", 100.0, 99.9)
+    assert not rate_alerts.alert_reached("below", 100.0, 100.1)
+
+
+def test_push_queue_sends_to_known_devices():
+    """Queued messages are sent to registered tokens and invalid tokens are pruned"""
+    known, gone, unknown = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    sent = []
+    pruned = []
+
+    class Sender:
+        def provider_token(self):
+            return "token"
+
+        async def send(self, device_token, payload):
+            sent.append((device_token, payload))
+            return apns.APNsResult(status=410 if device_token == "gone" else 200)
+
+    async def token_lookup(device_ids):
+        return {device_id: token for device_id, token in ((known, "known"), (gone, "gone")) if device_id in device_ids}
+
+    async def pruner(rows):
+        pruned.extend(rows)
+        return len(rows)
+
+    queue = push_service.PushQueue(
+        Sender(), concurrency=2, batch_size=10, flush_interval_seconds=1.0, max_messages=3,
+        token_lookup=token_lookup, pruner=pruner
+    )
+    accepted = queue.submit([push_service.PushMessage(device_id, "hi") for device_id in (known, gone, unknown, known)])
+    counts = asyncio.run(queue.flush())
+
+    assert accepted == 3
+    assert (counts.matched, counts.sent, counts.pruned) == (2, 1, 1)
+    assert pruned == [(gone, "gone")]
+    assert b'"body": "hi"' in sent[0][1]
+    assert queue.pending == 0
+
+
+class OkSender:
+    def provider_token(self):
+        return "token"
+
+    async def send(self, device_token, payload):
+        return apns.APNsResult(status=200)
+
+
+def test_push_queue_retries_failed_batches_a_bounded_number_of_times():
+    """A transient lookup error is retried; a persistent one drops the batch after max_attempts"""
+    device = uuid.uuid4()
+    lookups = []
+
+    async def flaky_lookup(device_ids):
+        lookups.append(device_ids)
+        if len(lookups) == 1:
+            raise RuntimeError("database is down")
+        return {device: "token"}
+
+    queue = push_service.PushQueue(
+        OkSender(), concurrency=2, batch_size=10, flush_interval_seconds=1.0, max_messages=10,
+        max_attempts=3, token_lookup=flaky_lookup
+    )
+    queue.submit([push_service.PushMessage(device, "hi")])
+    assert asyncio.run(queue.flush()).sent == 0
+    assert queue.pending == 1
+    assert asyncio.run(queue.flush()).sent == 1
+    assert queue.pending == 0
+
+    async def broken_lookup(device_ids):
+        raise RuntimeError("database is down")
+
+    queue = push_service.PushQueue(
+        OkSender(), concurrency=2, batch_size=10, flush_interval_seconds=1.0, max_messages=10,
+        max_attempts=3, token_lookup=broken_lookup
+    )
+    queue.submit([push_service.PushMessage(device, "hi")])
+    pending = []
+    for _ in range(3):
+        asyncio.run(queue.flush())
+        pending.append(queue.pending)
+    assert pending == [1, 1, 0]
+
+
+def test_push_queue_stop_waits_for_the_send_in_progress():
+    """Stopping during a slow send keeps the in-flight batch and sends the rest"""
+    devices = [uuid.uuid4() for _ in range(3)]
+    sent = []
+
+    class SlowSender(OkSender):
+        async def send(self, device_token, payload):
+            await asyncio.sleep(0.05)
+            sent.append(device_token)
+            return apns.APNsResult(status=200)
+
+    async def token_lookup(device_ids):
+        return {device_id: str(device_id) for device_id in device_ids}
+
+    async def scenario():
+        queue = push_service.PushQueue(
+            SlowSender(), concurrency=2, batch_size=2, flush_interval_seconds=60, max_messages=10,
+            token_lookup=token_lookup
+        )
+        await queue.start()
+        queue.submit([push_service.PushMessage(device_id, "hi") for device_id in devices])
+        await asyncio.sleep(0.01)
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(scenario())
+    assert sorted(sent) == sorted(str(device_id) for device_id in devices)
+    assert queue.pending == 0
+
+
+RATE_ALERTS_TABLE = """
+    CREATE TEMP TABLE rate_alerts (
+        id BIGSERIAL PRIMARY KEY,
+        device_id UUID NOT NULL,
+        base VARCHAR(3) NOT NULL,
+        quote VARCHAR(3) NOT NULL,
+        direction VARCHAR(5) NOT NULL,
+        threshold NUMERIC(18, 6) NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        triggered_at TIMESTAMPTZ,
+        triggered_rate NUMERIC(18, 6)
+    )
+"""
+
+
+def test_alerts_are_not_triggered_without_apns_keys():
+    """Without APNs keys nothing could be delivered, so alerts stay armed"""
+    class Unconfigured:
+        def provider_token(self):
+            raise apns.APNsConfigurationError("not configured")
+
+    queue = push_service.PushQueue(Unconfigured(), concurrency=1, batch_size=10, flush_interval_seconds=1.0,
+                                   max_messages=10)
+    sessionmaker = MagicMock(side_effect=AssertionError("database must not be touched"))
+    with patch.object(rate_alerts, "push_queue", queue), patch.object(rate_alerts, "async_sessionmaker", sessionmaker):
+        triggered = asyncio.run(rate_alerts.evaluate_rate_alerts(CrossRateMatrix(1, "RUB", {"USD": 0.0125})))
+
+    assert triggered == 0
+    assert queue.pending == 0
+
+
+def test_undelivered_alerts_are_rearmed(postgres_url):
+    """Alerts whose message the queue rejects or drops can trigger again"""
+    devices = [uuid.uuid4() for _ in range(3)]
+
+    async def lookup_fails(device_ids):
+        raise RuntimeError("database is down")
+
+    async def scenario():
+        engine = create_async_engine(postgres_url)
+        async with engine.connect() as conn:
+            await conn.execute(text(RATE_ALERTS_TABLE))
+            await conn.execute(
+                text("INSERT INTO rate_alerts (device_id, base, quote, direction, threshold) "
+                     "VALUES (:device_id, 'USD', 'RUB', :direction, :threshold)"),
+                [
+                    {"device_id": devices[0], "direction": "above", "threshold": 75},
+                    {"device_id": devices[1], "direction": "above", "threshold": 79},
+                    {"device_id": devices[2], "direction": "below", "threshold": 70},
+                ]
+            )
+            await conn.commit()
+
+            # Room for one message: the second triggered alert is rejected by submit()
+            queue = push_service.PushQueue(
+                OkSender(), concurrency=1, batch_size=10, flush_interval_seconds=1.0, max_messages=1,
+                max_attempts=1, token_lookup=lookup_fails
+            )
+            queue.add_drop_handler(rate_alerts.rearm_dropped_alerts)
+            with patch.object(rate_alerts, "push_queue", queue), \
+                    patch.object(rate_alerts, "async_sessionmaker", lambda: AsyncSession(bind=conn)):
+                triggered = await rate_alerts.evaluate_rate_alerts(CrossRateMatrix(1, "RUB", {"USD": 0.0125}))
+                after_submit = (await conn.execute(text(
+                    "SELECT device_id FROM rate_alerts WHERE triggered_at IS NOT NULL"
+                ))).scalars().all()
+                # The accepted message fails its only attempt and is dropped as well
+                await queue.flush()
+            armed = (await conn.execute(text(
+                "SELECT device_id FROM rate_alerts WHERE triggered_at IS NULL AND triggered_rate IS NULL"
+            ))).scalars().all()
+        await engine.dispose()
+        return triggered, after_submit, armed
+
+    triggered, after_submit, armed = asyncio.run(scenario())
+
+    assert triggered == 2
+    assert len(after_submit) == 1 and after_submit[0] in devices[:2]
+    assert sorted(armed) == sorted(devices)
@@ -0,0 +1,96 @@
+"""
+Tests for the OHLC rate history endpoint
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch, MagicMock
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+# Set environment variables
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///:memory:"
+
+# Mock the database module completely
+with patch.dict('sys.modules', {'app.database': MagicMock()}):
+    from app.routes.rates import HISTORY_MAX_POINTS, get_rate_history
+
+RATE_HISTORY_TABLE = """
+    CREATE TEMP TABLE rate_history (
+        code VARCHAR(3) NOT NULL,
+        recorded_at TIMESTAMPTZ NOT NULL,
+        value NUMERIC(18, 6) NOT NULL,
+        PRIMARY KEY (code, recorded_at)
+    )
+"""
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+async def history_on_postgres(url, samples, **query):
+    engine = create_async_engine(url)
+    async with engine.connect() as conn:
+        await conn.execute(text(RATE_HISTORY_TABLE))
+        await conn.execute(
+            text("INSERT INTO rate_history (code, recorded_at, value) VALUES (:code, :recorded_at, :value)"),
+            [{"code": code, "recorded_at": recorded_at, "value": value} for code, recorded_at, value in samples]
+        )
+        response = await get_rate_history(db=AsyncSession(bind=conn), **query)
+    await engine.dispose()
+    return response
+
+
+def test_history_carries_the_rate_through_days_without_changes(postgres_url):
+    """Only changes are stored, yet every day of the range gets a point"""
+    samples = [
+        ("USD", utc(2025, 8, 28, 12), 90.0),   # before the range: opens it
+        ("USD", utc(2025, 9, 3, 9), 91.5),
+        ("USD", utc(2025, 9, 3, 15), 89.0),
+        ("EUR", utc(2025, 9, 2, 10), 99.0),
+    ]
+    response = asyncio.run(history_on_postgres(
+        postgres_url, samples, currency_code="usd", from_date=utc(2025, 9, 1), to_date=utc(2025, 9, 8), step="day"
+    ))
+
+    assert response.code == "USD"
+    assert [point.bucket for point in response.points] == [utc(2025, 9, 1) + timedelta(days=i) for i in range(7)]
+    ohlc = [(p.open, p.high, p.low, p.close, p.samples) for p in response.points]
+    assert ohlc[0] == (90.0, 90.0, 90.0, 90.0, 0)
+    assert ohlc[2] == (90.0, 91.5, 89.0, 89.0, 2)
+    assert ohlc[3:] == [(89.0, 89.0, 89.0, 89.0, 0)] * 4
+
+
+def test_history_starts_at_the_first_known_rate(postgres_url):
+    """Buckets before the currency's first record are omitted; partial buckets respect the range"""
+    samples = [("USD", utc(2025, 9, 10, 8), 90.0), ("USD", utc(2025, 9, 20, 8), 92.0)]
+    response = asyncio.run(history_on_postgres(
+        postgres_url, samples, currency_code="USD", from_date=utc(2025, 9, 5), to_date=utc(2025, 10, 15), step="month"
+    ))
+
+    assert [point.bucket for point in response.points] == [utc(2025, 9, 1), utc(2025, 10, 1)]
+    september, october = response.points
+    assert (september.open, september.high, september.low, september.close, september.samples) == (90.0, 92.0, 90.0, 92.0, 2)
+    assert (october.open, october.close, october.samples) == (92.0, 92.0, 0)
+
+
+def test_history_rejects_bad_ranges_without_querying():
+    """Reversed ranges and too many points are rejected with the usual error shape"""
+    db = MagicMock()
+    end = utc(2025, 9, 3)
+
+    with pytest.raises(HTTPException) as reversed_range:
+        asyncio.run(get_rate_history("USD", from_date=end, to_date=datetime(2025, 9, 1), step="day", db=db))
+    assert reversed_range.value.status_code == 400
+    assert reversed_range.value.detail["code"] == 400
+
+    with pytest.raises(HTTPException) as too_many:
+        asyncio.run(get_rate_history("USD", from_date=datetime(2020, 1, 1), to_date=end, step="hour", db=db))
+    assert too_many.value.status_code == 400
+    assert too_many.value.detail["details"] == {"step": "hour", "max_points": HISTORY_MAX_POINTS}
+
+    db.execute.assert_not_called()
@@ -0,0 +1,21 @@
+"""
+Tests for the request pacing rate limiter
+"""
+import asyncio
+import time
+
+from app.utils.rate_limiter import RateLimiter
+
+
+def test_acquire_spaces_calls_evenly():
+    """N acquisitions at R per second take about (N - 1) / R seconds"""
+    limiter = RateLimiter(rate_per_second=100)
+
+    async def scenario():
+        started = time.monotonic()
+        await asyncio.gather(*(limiter.acquire() for _ in range(6)))
+        return time.monotonic() - started
+
+    elapsed = asyncio.run(scenario())
+    assert 0.045 <= elapsed < 0.5
+    assert RateLimiter(rate_per_second=0).interval == 0.0
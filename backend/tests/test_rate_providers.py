@@ -0,0 +1,137 @@
+"""
+Tests for concurrent rate provider fetching
+"""
+import asyncio
+import importlib
+import os
+from unittest.mock import patch, MagicMock
+
+# Set environment variables
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///:memory:"
+
+# Mock the database module completely
+with patch.dict('sys.modules', {'app.database': MagicMock()}):
+    rate_providers = importlib.import_module("app.services.rate_providers")
+    from app.services.rate_providers import (
+        MockRatesProvider,
+        ProviderRates,
+        RatesAggregator,
+        RatesProvider,
+        parse_cbr_daily,
+        parse_ecb_daily,
+        rates_agree,
+    )
+    from app.utils.circuit_breaker import BREAKER_OPEN
+
+RUB_RATES = {"USD": 0.0112, "EUR": 0.0101, "GBP": 0.0087, "CNY": 0.1534, "JPY": 0.8203, "CHF": 0.0098}
+
+
+class FakeProvider(RatesProvider):
+    def __init__(self, name, base="RUB", rates=None, delay=0.0, error=None):
+        self.name = name
+        self.base = base
+        self.rates = rates or RUB_RATES
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    async def fetch(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return ProviderRates(self.name, self.base, dict(self.rates), 0)
+
+
+def _aggregator(providers, quorum=1):
+    return RatesAggregator(
+        providers, quorum=quorum, tolerance=0.02, timeout_seconds=1.0, min_currencies=5,
+        failure_threshold=2, reset_timeout_seconds=60,
+    )
+
+
+def test_fallback_is_used_only_when_higher_priority_providers_fail():
+    """A failed primary falls back to the next provider without waiting for lower ones"""
+    broken = FakeProvider("broken", error=RuntimeError("boom"))
+    fast = FakeProvider("fast", delay=0.01)
+    slow = FakeProvider("slow", delay=0.5)
+    aggregator = _aggregator([broken, fast, slow])
+
+    async def run():
+        first = await aggregator.fetch()
+        second = await aggregator.fetch()
+        await asyncio.gather(*aggregator._background)
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert first.provider == "fast" and second.provider == "fast"
+    assert aggregator.health["broken"].breaker.state == BREAKER_OPEN
+    assert aggregator.health["broken"].score < aggregator.health["slow"].score
+    assert aggregator.health["slow"].latency_ms is not None
+    # The third poll skips the provider whose breaker is open
+    asyncio.run(aggregator.fetch())
+    assert broken.calls == 2
+
+
+def test_slow_primary_wins_over_fast_fallback():
+    """Rates do not flip to a partial fallback source just because it answered first"""
+    primary = FakeProvider("primary", rates={**RUB_RATES, "AED": 0.0411}, delay=0.05)
+    fallback = FakeProvider("fallback")
+
+    selected = asyncio.run(_aggregator([primary, fallback]).fetch())
+
+    assert selected.provider == "primary" and "AED" in selected.rub_rates()
+
+
+def test_mock_rates_are_used_when_no_provider_is_configured():
+    """Without an API key and other providers the app still gets RUB-based rates"""
+    with patch.object(rate_providers.settings, "rates_providers", "openexchangerates"), \
+            patch.object(rate_providers.settings, "rates_api_key", None):
+        providers = rate_providers.build_rates_providers()
+
+    assert [type(provider) for provider in providers] == [MockRatesProvider]
+    selected = asyncio.run(_aggregator(providers).fetch())
+    assert selected.provider == "mock" and selected.rub_rates() == MockRatesProvider.RATES
+
+
+def test_quorum_rejects_outlier_and_accepts_eur_witness():
+    """An EUR-based provider confirms RUB rates, an outlier never reaches quorum"""
+    # ECB: units per 1 EUR, consistent with RUB_RATES
+    ecb = FakeProvider("ecb", base="EUR", rates={code: value / RUB_RATES["EUR"] for code, value in RUB_RATES.items() if code != "EUR"})
+    outlier = FakeProvider("outlier", rates={**RUB_RATES, "USD": 0.02, "GBP": 0.02, "CNY": 0.3})
+    cbr = FakeProvider("cbr", delay=0.05)
+
+    selected = asyncio.run(_aggregator([ecb, outlier, cbr], quorum=2).fetch())
+
+    assert selected.provider == "cbr"
+    assert rates_agree(selected, ProviderRates("ecb", "EUR", ecb.rates, 0), 0.02)
+    assert ProviderRates("ecb", "EUR", ecb.rates, 0).rub_rates() is None
+
+
+def test_usd_based_rates_are_rebased_to_rub():
+    """openexchangerates returns USD-based rates that are stored RUB-based"""
+    rates = ProviderRates("openexchangerates", "USD", {"USD": 1.0, "RUB": 80.0, "EUR": 0.9}, 0).rub_rates()
+    assert rates == {"USD": 1 / 80.0, "EUR": 0.9 / 80.0}
+
+
+def test_parse_official_xml_feeds():
+    """CBR quotes RUB per nominal in windows-1251, ECB quotes units per EUR"""
+    cbr = (
+        '<?xml version="1.0" encoding="windows-1251"?>'
+        '<ValCurs Date="17.10.2026" name="Foreign Currency Market">'
+        '<Valute ID="R01235"><NumCode>840</NumCode><CharCode>USD</CharCode><Nominal>1</Nominal>'
+        '<Name>Доллар США</Name><Value>80,0000</Value></Valute>'
+        '<Valute ID="R01375"><NumCode>156</NumCode><CharCode>CNY</CharCode><Nominal>10</Nominal>'
+        '<Name>Юань</Name><Value>110,0000</Value></Valute>'
+        '</ValCurs>'
+    ).encode("windows-1251")
+    assert parse_cbr_daily(cbr) == {"USD": 1 / 80.0, "CNY": 10 / 110.0}
+
+    ecb = (
+        b'<gesmes:Envelope xmlns:gesmes="http://www.gesmes.org/xml/2002-08-01" '
+        b'xmlns="http://www.ecb.int/vocabulary/2002-08-01/eurofxref">'
+        b'<Cube><Cube time="2026-10-16"><Cube currency="USD" rate="1.0876"/>'
+        b'<Cube currency="JPY" rate="162.35"/></Cube></Cube></gesmes:Envelope>'
+    )
+    assert parse_ecb_daily(ecb) == {"USD": 1.0876, "JPY": 162.35}
@@ -0,0 +1,128 @@
+"""
+Tests for the rates API quota budget and adaptive refresh scheduling
+"""
+import asyncio
+import os
+from datetime import datetime, timezone
+from unittest.mock import patch, MagicMock
+
+# Set environment variables
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///:memory:"
+
+# Mock the database module completely
+with patch.dict('sys.modules', {'app.database': MagicMock()}):
+    from app.services import rates_quota
+    from app.tasks import scheduler as scheduler_module
+    from app.utils.circuit_breaker import BREAKER_OPEN
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def incr(self, key):
+        self.commands.append(("incr", key))
+
+    def expire(self, key, ttl):
+        self.commands.append(("expire", key))
+
+    async def execute(self):
+        results = []
+        for command, key in self.commands:
+            if command == "incr":
+                self.redis.values[key] = self.redis.values.get(key, 0) + 1
+                results.append(self.redis.values[key])
+            else:
+                results.append(True)
+        return results
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+def test_quota_budget_keeps_reserve_and_spreads_requests():
+    """Scheduled requests stop at the reserve, the interval spreads the rest until month end"""
+    redis = FakeRedis()
+    budget = rates_quota.RatesQuotaBudget("rates:quota:test", monthly_allowance=10, reserve=2)
+    now = datetime(2026, 10, 31, 0, 0, tzinfo=timezone.utc)
+
+    async def get_redis():
+        return redis
+
+    async def run():
+        with patch.object(rates_quota, "get_redis", get_redis):
+            assert await budget.refresh_interval_seconds(now) == 86400 / 8
+            for _ in range(8):
+                await budget.record(now)
+            assert not await budget.allows(now=now)
+            assert await budget.allows(forced=True, now=now)
+            assert await budget.refresh_interval_seconds(now) is None
+            # Новый месяц — новый счетчик
+            assert await budget.allows(now=datetime(2026, 11, 1, tzinfo=timezone.utc))
+
+    asyncio.run(run())
+    assert redis.values == {"rates:quota:test:2026-10": 8}
+    assert budget.status()["used"] == 0 and budget.status()["month"] == "2026-11"
+
+
+def test_scheduler_backs_off_and_opens_circuit():
+    """Failed refreshes are retried with growing delays until the circuit opens"""
+    task_scheduler = scheduler_module.TaskScheduler()
+    task_scheduler._is_running = True
+    task_scheduler.scheduler = MagicMock()
+    failures = {"success": False, "error": "No data from rates providers"}
+
+    async def update_rates_from_external_api():
+        return failures
+
+    async def run():
+        with patch.object(scheduler_module.rates_service, "update_rates_from_external_api", update_rates_from_external_api):
+            for _ in range(scheduler_module.settings.rates_refresh_failure_threshold):
+                await task_scheduler._smart_rates_update_job()
+
+    asyncio.run(run())
+
+    delays = [
+        (call.kwargs["next_run_time"] - datetime.now(timezone.utc)).total_seconds()
+        for call in task_scheduler.scheduler.modify_job.call_args_list
+    ]
+    assert delays[0] < delays[1] < delays[2]
+    assert delays[-1] > scheduler_module.settings.rates_refresh_reset_timeout_seconds - 5
+    status = task_scheduler.rates_update_status()
+    assert status["breaker"]["state"] == BREAKER_OPEN
+    assert status["consecutive_failures"] == scheduler_module.settings.rates_refresh_failure_threshold
+
+
+
+def test_initial_rates_update_is_the_guarded_job_first_run():
+    """The startup refresh is the rates job's first run, not a separate job that could overlap it"""
+    task_scheduler = scheduler_module.TaskScheduler()
+    task_scheduler.scheduler = MagicMock()
+
+    with patch.object(scheduler_module, "IntervalTrigger", MagicMock()):
+        asyncio.run(task_scheduler.start())
+
+    rates_jobs = [
+        call for call in task_scheduler.scheduler.add_job.call_args_list
+        if "rates_update" in call.args[0].__name__
+    ]
+    assert len(rates_jobs) == 1
+    job = rates_jobs[0].kwargs
+    assert job["id"] == scheduler_module.RATES_UPDATE_JOB_ID and job["max_instances"] == 1
+    first_run = (job["next_run_time"] - datetime.now(timezone.utc)).total_seconds()
+    assert 0 < first_run <= scheduler_module.INITIAL_RATES_UPDATE_DELAY_SECONDS
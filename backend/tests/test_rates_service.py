@@ -0,0 +1,166 @@
+"""
+Tests for the bulk rates upsert and the refresh clock
+"""
+import asyncio
+import importlib
+import os
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, patch, MagicMock
+
+# Set environment variables
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///:memory:"
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import DeclarativeBase
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+# Mock the database module completely, keeping a real Base so statements build
+with patch.dict('sys.modules', {'app.database': MagicMock(Base=Base)}):
+    # app.services re-exports the rates_service singleton under the module's name
+    rates_service = importlib.import_module("app.services.rates_service")
+    from app.services.rates_service import RatesService
+
+
+RATES_TABLES = [
+    """
+    CREATE TEMP TABLE rates (
+        id SERIAL PRIMARY KEY,
+        code VARCHAR(3) NOT NULL UNIQUE,
+        name VARCHAR(100) NOT NULL,
+        value NUMERIC(18, 6) NOT NULL,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TEMP TABLE rate_history (
+        code VARCHAR(3) NOT NULL,
+        recorded_at TIMESTAMPTZ NOT NULL,
+        value NUMERIC(18, 6) NOT NULL,
+        PRIMARY KEY (code, recorded_at)
+    )
+    """,
+]
+
+
+class FakeSession:
+    """Session stand-in for code paths that only need execute/commit"""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+def test_upsert_only_writes_changed_rates(postgres_url):
+    """Repeating a refresh leaves rates and history untouched; changes are written and recorded"""
+    service = RatesService()
+
+    async def scenario():
+        engine = create_async_engine(postgres_url)
+        async with engine.connect() as conn:
+            for ddl in RATES_TABLES:
+                await conn.execute(text(ddl))
+            await conn.commit()
+
+            async def snapshot():
+                rates = (await conn.execute(text("SELECT code, name, value, updated_at FROM rates"))).all()
+                history = (await conn.execute(text("SELECT COUNT(*) FROM rate_history"))).scalar()
+                await conn.commit()
+                return {code: (name, float(value), updated_at) for code, name, value, updated_at in rates}, history
+
+            steps = []
+            with patch.object(rates_service, "async_sessionmaker", lambda: AsyncSession(bind=conn)):
+                for rates in (
+                    {"USD": 0.0112, "EUR": 0.0101},
+                    {"USD": 0.0112, "EUR": 0.0101},
+                    {"USD": 0.0113, "EUR": 0.0101, "CNY": 1},
+                ):
+                    counts = await service._update_rates_in_database({"rates": rates})
+                    steps.append((counts, *await snapshot()))
+        await engine.dispose()
+        return steps
+
+    first, repeated, changed = asyncio.run(scenario())
+
+    counts, rates, history = first
+    assert counts == {"inserted": 2, "updated": 0, "unchanged": 0}
+    assert rates["USD"][:2] == ("USD", 0.0112)
+    assert history == 2
+
+    counts, rates, history = repeated
+    assert counts == {"inserted": 0, "updated": 0, "unchanged": 2}
+    assert rates == first[1]
+    assert history == 2
+
+    counts, rates, history = changed
+    assert counts == {"inserted": 1, "updated": 1, "unchanged": 1}
+    assert rates["USD"][1] == 0.0113 and rates["USD"][2] > first[1]["USD"][2]
+    assert rates["EUR"] == first[1]["EUR"]
+    assert history == 4
+
+
+def test_empty_rates_skip_the_database():
+    """An empty provider answer writes nothing"""
+    with patch.object(rates_service, "async_sessionmaker", MagicMock(side_effect=AssertionError)):
+        counts = asyncio.run(RatesService()._update_rates_in_database({"rates": {}}))
+
+    assert counts == {"inserted": 0, "updated": 0, "unchanged": 0}
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value):
+        self.values[key] = str(value)
+
+
+def test_refresh_without_changes_still_restarts_the_interval():
+    """A refresh that changed no rates counts as a refresh for every worker"""
+    redis = FakeRedis()
+    service = RatesService()
+    stale = MagicMock()
+    stale.scalar.return_value = datetime.now(timezone.utc) - timedelta(days=3)
+    db = FakeSession()
+    db.execute = AsyncMock(return_value=stale)
+
+    async def run():
+        with patch.object(rates_service, "get_redis", AsyncMock(return_value=redis)), \
+                patch.object(rates_service, "async_sessionmaker", lambda: db), \
+                patch.object(service, "refresh_interval_seconds", AsyncMock(return_value=3600)), \
+                patch.object(service, "_fetch_rates_from_api",
+                             AsyncMock(return_value={"rates": {"USD": 0.0112}, "provider": "cbr"})), \
+                patch.object(service, "_update_rates_in_database",
+                             AsyncMock(return_value={"inserted": 0, "updated": 0, "unchanged": 1})), \
+                patch.object(service, "_write_through_caches", AsyncMock(return_value=None)):
+            # Before the first recorded refresh the clock falls back to max(updated_at)
+            before = await service.seconds_until_update()
+            result = await service.update_rates_from_external_api()
+            after = await service.seconds_until_update()
+            again = await service.update_rates_from_external_api()
+        return before, result, after, again
+
+    before, result, after, again = asyncio.run(run())
+
+    assert before == 0
+    assert result["success"] and result["updated_count"] == 0
+    assert 3590 < after <= 3600
+    assert again["skipped"]
+    assert rates_service.RATES_LAST_REFRESH_KEY in redis.values
+    # Only the two checks before the first recorded refresh read the database
+    assert db.execute.await_count == 2
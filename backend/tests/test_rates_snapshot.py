@@ -0,0 +1,120 @@
+"""
+Tests for the in-process rates snapshot store
+"""
+import asyncio
+import json
+import os
+from datetime import datetime, timezone
+from unittest.mock import patch, MagicMock
+
+# Set environment variables
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///:memory:"
+
+# Mock the database module completely
+with patch.dict('sys.modules', {'app.database': MagicMock()}):
+    from app.schemas import RateResponse
+    from app.services.rates_snapshot import (
+        SnapshotStore,
+        build_rates_delta,
+        publish_rates_snapshot,
+        refresh_snapshot,
+        snapshot_store,
+        snapshot_version,
+    )
+
+
+def test_snapshot_body_is_serialized_response():
+    """Snapshot body must match what the endpoint would have returned"""
+    response = RateResponse(
+        updated_at=datetime(2025, 7, 31, 10, 0, tzinfo=timezone.utc),
+        base="RUB",
+        rates={"USD": 0.0112, "EUR": 0.0101}
+    )
+    snapshot = publish_rates_snapshot(response)
+
+    assert json.loads(snapshot.body) == json.loads(response.model_dump_json())
+    assert snapshot.payload["rates"] == {"USD": 0.0112, "EUR": 0.0101}
+
+
+def test_snapshot_version_is_stable_across_timezones():
+    """Naive UTC and aware UTC timestamps give the same version"""
+    aware = datetime(2025, 7, 31, 10, 0, tzinfo=timezone.utc)
+    naive = datetime(2025, 7, 31, 10, 0)
+    assert snapshot_version(aware) == snapshot_version(naive)
+
+
+def test_snapshot_store_replaces_and_expires():
+    """Publishing replaces the snapshot, zero TTL makes it stale"""
+    store = SnapshotStore(ttl_seconds=60)
+    first = store.publish("rates", datetime(2025, 1, 1, tzinfo=timezone.utc), {}, b"{}")
+    second = store.publish("rates", datetime(2025, 1, 2, tzinfo=timezone.utc), {}, b"{}")
+
+    assert store.get("rates") is second
+    assert second.version > first.version
+
+    store.ttl_seconds = 0
+    assert store.get("rates") is None
+
+    store.invalidate()
+    assert store.get("missing") is None
+
+
+def test_snapshot_conditional_headers():
+    """ETag and Last-Modified validators produce 304 matches"""
+    store = SnapshotStore(ttl_seconds=60, max_age_seconds=300)
+    snapshot = store.publish("rates", datetime(2025, 7, 31, 10, 0, 0, 500000, tzinfo=timezone.utc), {}, b"{}")
+
+    assert snapshot.headers["ETag"] == snapshot.etag
+    assert snapshot.headers["Cache-Control"] == "public, max-age=300"
+    assert snapshot.matches(snapshot.etag, None)
+    assert snapshot.matches(f'"other", W/{snapshot.etag}', None)
+    assert not snapshot.matches('"other"', None)
+    assert snapshot.matches(None, snapshot.headers["Last-Modified"])
+    assert not snapshot.matches(None, "Thu, 31 Jul 2025 09:00:00 GMT")
+    assert not snapshot.matches(None, None)
+
+
+def test_rates_delta_contains_only_changed_codes():
+    """Delta lists changed and removed codes, unknown versions fall back to full"""
+    base_response = RateResponse(
+        updated_at=datetime(2025, 8, 1, 10, 0, tzinfo=timezone.utc),
+        rates={"USD": 0.0112, "EUR": 0.0101, "GBP": 0.0087}
+    )
+    previous = publish_rates_snapshot(base_response)
+    current = publish_rates_snapshot(RateResponse(
+        updated_at=datetime(2025, 8, 1, 11, 0, tzinfo=timezone.utc),
+        rates={"USD": 0.0113, "EUR": 0.0101}
+    ))
+
+    delta = json.loads(build_rates_delta(current, previous.version))
+    assert delta["full"] is False
+    assert delta["rates"] == {"USD": 0.0113}
+    assert delta["removed"] == ["GBP"]
+    assert delta["version"] == current.version
+
+    full = json.loads(build_rates_delta(current, 1))
+    assert full["full"] is True
+    assert full["rates"] == {"USD": 0.0113, "EUR": 0.0101}
+
+
+def test_refresh_snapshot_coalesces_and_serves_stale():
+    """Concurrent misses load once, a stale snapshot is served while revalidating"""
+    calls = []
+
+    async def loader(db):
+        calls.append(db)
+        await asyncio.sleep(0.01)
+        return snapshot_store.publish("coalesce", datetime(2025, 8, 1, tzinfo=timezone.utc), {}, b"{}")
+
+    async def scenario():
+        results = await asyncio.gather(*(refresh_snapshot("coalesce", loader, None) for _ in range(5)))
+        assert len(calls) == 1
+        assert all(result is results[0] for result in results)
+
+        stale = await refresh_snapshot("coalesce", loader, None)
+        await asyncio.sleep(0.05)
+        return results[0], stale
+
+    fresh, stale = asyncio.run(scenario())
+    assert stale is fresh
+    assert len(calls) == 2
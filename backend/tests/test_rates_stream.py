@@ -0,0 +1,79 @@
+"""
+Tests for the rates update stream broadcaster
+"""
+import asyncio
+import json
+import os
+from datetime import datetime, timezone
+from unittest.mock import patch, MagicMock
+
+# Set environment variables
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///:memory:"
+
+# Mock the database module completely
+with patch.dict('sys.modules', {'app.database': MagicMock()}):
+    from app.schemas import RateResponse
+    from app.services.rates_snapshot import publish_rates_snapshot
+    from app.services.rates_stream import RatesBroadcaster
+
+
+def _publish(day, rates):
+    return publish_rates_snapshot(RateResponse(
+        updated_at=datetime(2025, 9, day, tzinfo=timezone.utc), base="RUB", rates=rates
+    ))
+
+
+def test_broadcaster_sends_deltas_and_keepalives():
+    """Subscribers share one wakeup: new versions arrive as deltas, timer ticks as keepalives"""
+    first = _publish(1, {"USD": 0.0112, "EUR": 0.0101})
+    second = _publish(2, {"USD": 0.0113, "EUR": 0.0101})
+
+    async def run():
+        broadcaster = RatesBroadcaster(keepalive_seconds=0.01, max_connections=10)
+        broadcaster.publish(first)
+        fresh = broadcaster.updates(None)
+        current = broadcaster.updates(first.version)
+
+        version, full = await fresh.__anext__()
+        assert version == first.version
+        assert json.loads(full)["rates"] == {"USD": 0.0112, "EUR": 0.0101}
+        assert await current.__anext__() is None
+        assert broadcaster.connections == 2
+
+        assert broadcaster.publish(second)
+        assert not broadcaster.publish(first)
+        for stream in (fresh, current):
+            version, delta = await stream.__anext__()
+            assert version == second.version
+            assert json.loads(delta)["rates"] == {"USD": 0.0113}
+
+        await broadcaster.start()
+        assert await asyncio.wait_for(current.__anext__(), 1) is None
+        await broadcaster.stop()
+
+        await fresh.aclose()
+        await current.aclose()
+        assert broadcaster.connections == 0
+
+    asyncio.run(run())
+
+
+def test_broadcaster_waits_for_versions_newer_than_client():
+    """A client that saw a newer version on another worker gets nothing older"""
+    older = _publish(3, {"USD": 0.0114})
+    seen = _publish(4, {"USD": 0.0115})
+    newest = _publish(5, {"USD": 0.0116})
+
+    async def run():
+        broadcaster = RatesBroadcaster(keepalive_seconds=60, max_connections=10)
+        broadcaster.publish(older)
+        stream = broadcaster.updates(seen.version)
+        assert await stream.__anext__() is None
+
+        await broadcaster.handle_rates_updated({"version": newest.version})
+        version, delta = await stream.__anext__()
+        assert version == newest.version
+        assert json.loads(delta)["rates"] == {"USD": 0.0116}
+        await stream.aclose()
+
+    asyncio.run(run())
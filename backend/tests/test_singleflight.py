@@ -0,0 +1,54 @@
+"""
+Tests for single-flight request coalescing
+"""
+import asyncio
+
+from app.utils.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_computation():
+    """Concurrent calls with one key run the function once, errors are shared"""
+    flight = SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def scenario():
+        results = await asyncio.gather(*(flight.do("rates", compute) for _ in range(10)))
+        errors = await asyncio.gather(*(flight.do("rates", fail) for _ in range(3)), return_exceptions=True)
+        return results, errors
+
+    results, errors = asyncio.run(scenario())
+    assert results == [1] * 10
+    assert len(calls) == 1
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert not flight.in_flight("rates")
+
+
+def test_cancelled_leader_hands_over_to_waiter():
+    """A waiter recomputes instead of failing when the leader is cancelled"""
+    flight = SingleFlight()
+
+    async def slow():
+        await asyncio.sleep(1)
+        return "leader"
+
+    async def fast():
+        return "waiter"
+
+    async def scenario():
+        leader = asyncio.create_task(flight.do("key", slow))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flight.do("key", fast))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await waiter
+
+    assert asyncio.run(scenario()) == "waiter"
@@ -0,0 +1,90 @@
+"""
+Tests for the buffered analytics ingestion queue
+"""
+import asyncio
+import os
+from unittest.mock import patch, MagicMock
+
+# Set environment variables
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///:memory:"
+
+# Mock the database module completely
+with patch.dict('sys.modules', {'app.database': MagicMock()}):
+    from app.services.stats_ingest import StatsIngestQueue
+
+
+def make_queue(writer, max_events=10):
+    return StatsIngestQueue(batch_size=4, flush_interval_seconds=60, max_events=max_events, writer=writer)
+
+
+def test_flush_writes_in_batches():
+    """Buffered events are written in batch_size chunks"""
+    batches = []
+
+    async def writer(rows):
+        batches.append(list(rows))
+
+    queue = make_queue(writer)
+    assert queue.submit([{"n": i} for i in range(6)])
+
+    written = asyncio.run(queue.flush())
+
+    assert written == 6
+    assert [len(batch) for batch in batches] == [4, 2]
+    assert queue.pending == 0
+
+
+def test_submit_applies_backpressure():
+    """Batches that do not fit into the buffer are rejected"""
+    async def writer(rows):
+        pass
+
+    queue = make_queue(writer, max_events=5)
+    assert queue.submit([{"n": i} for i in range(4)])
+    assert not queue.submit([{"n": i} for i in range(2)])
+    assert queue.pending == 4
+
+
+def test_failed_batch_is_requeued():
+    """Events survive a failed write and are retried on the next flush"""
+    calls = []
+
+    async def writer(rows):
+        calls.append(len(rows))
+        if len(calls) == 1:
+            raise RuntimeError("database is down")
+
+    queue = make_queue(writer)
+    queue.submit([{"n": i} for i in range(3)])
+
+    assert asyncio.run(queue.flush()) == 0
+    assert queue.pending == 3
+    assert asyncio.run(queue.flush()) == 3
+    assert queue.pending == 0
+
+
+def test_stop_waits_for_the_write_in_progress():
+    """Stopping during a slow write keeps the in-flight batch and flushes the rest"""
+    written = []
+    write_started = None
+
+    async def writer(rows):
+        write_started.set()
+        await asyncio.sleep(0.05)
+        written.extend(rows)
+
+    async def scenario():
+        nonlocal write_started
+        write_started = asyncio.Event()
+        queue = make_queue(writer, max_events=20)
+        await queue.start()
+        queue.submit([{"n": i} for i in range(4)])
+        await write_started.wait()
+        queue.submit([{"n": i} for i in range(4, 7)])
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(scenario())
+
+    assert sorted(row["n"] for row in written) == list(range(7))
+    assert queue.pending == 0
@@ -0,0 +1,294 @@
+"""
+Tests for the single-pass exact /stats/metrics counters
+"""
+import asyncio
+import os
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from unittest.mock import AsyncMock, patch, MagicMock
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+# Set environment variables
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///:memory:"
+
+# Mock the database module completely
+with patch.dict('sys.modules', {'app.database': MagicMock()}):
+    from app.routes import stats
+    from app.routes.stats import (
+        _exact_counters,
+        _metrics_bounds,
+        _rollup_device_counters,
+        _rollup_event_counters,
+    )
+    from app.services import device_sketches, stats_rollup
+    from app.services.device_sketches import sketch_key
+    from app.services.stats_cache import StatsResultCache
+
+
+class FakeRedis:
+    """Redis with HyperLogLog keys modelled as exact sets"""
+
+    def __init__(self, sketches=None):
+        self.sketches = {sketch_key(day): set(devices) for day, devices in (sketches or {}).items()}
+
+    def pipeline(self, transaction=False):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def exists(self, key):
+        self.commands.append(lambda: int(key in self.redis.sketches))
+
+    def pfcount(self, *keys):
+        self.commands.append(lambda: len(set().union(*(self.redis.sketches.get(key, set()) for key in keys))))
+
+    def pfadd(self, key, *values):
+        self.commands.append(lambda: self.redis.sketches.setdefault(key, set()).update(values))
+
+    def expire(self, key, seconds):
+        self.commands.append(lambda: True)
+
+    async def execute(self):
+        results = [command() for command in self.commands]
+        self.commands = []
+        return results
+
+
+async def run_exact_counters(events, bounds):
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.connect() as conn:
+        await conn.execute(text(
+            "CREATE TABLE usage_events (id INTEGER PRIMARY KEY, device_id TEXT, event_name TEXT, created_at TIMESTAMP)"
+        ))
+        await conn.execute(
+            text("INSERT INTO usage_events (device_id, event_name, created_at) VALUES (:device_id, :event_name, :created_at)"),
+            [{"device_id": d, "event_name": e, "created_at": t} for d, e, t in events]
+        )
+        counters = await _exact_counters(AsyncSession(bind=conn), bounds)
+    await engine.dispose()
+    return counters
+
+
+def test_exact_counters_filter_each_window():
+    """One scan yields the same per-window counters as separate queries"""
+    end = datetime(2025, 8, 20, 15, 0, tzinfo=timezone.utc)
+    start = datetime(2025, 8, 20, tzinfo=timezone.utc)
+    bounds = _metrics_bounds(start, end, explicit_start=True)
+
+    events = [
+        ("a", "app_open", end - timedelta(hours=1)),
+        ("a", "conversion", end - timedelta(hours=2)),
+        ("b", "app_open", end - timedelta(hours=20)),
+        ("c", "app_open", end - timedelta(days=5)),
+        ("d", "conversion", end - timedelta(days=20)),
+        ("e", "app_open", end - timedelta(days=60)),
+    ]
+    counters = asyncio.run(run_exact_counters(events, bounds))
+
+    assert counters["dau"] == 1
+    assert counters["wau"] == 3
+    assert counters["mau"] == 4
+    assert counters["events_period"] == 2
+    assert counters["events_24h"] == 3
+    assert counters["unique_devices_period"] == 1
+    assert sorted(counters["top_events"]) == [("app_open", 1), ("conversion", 1)]
+
+
+def test_result_cache_keys_and_ttls():
+    """Windows in one bucket share a key, closed windows get the long TTL"""
+    cache = StatsResultCache(bucket_seconds=60, live_ttl_seconds=30, closed_ttl_seconds=86400, settle_seconds=900)
+    now = datetime(2025, 8, 20, 15, 0, 40, tzinfo=timezone.utc)
+    start = now - timedelta(days=7)
+
+    key = cache.window_key("metrics", start, now, "week")
+    assert key == cache.window_key("metrics", start - timedelta(seconds=30), now - timedelta(seconds=30), "week")
+    assert key != cache.window_key("metrics", start, now + timedelta(seconds=30), "week")
+
+    assert cache.ttl_for(None) == 30
+    assert cache.ttl_for(now, now=now) == 30
+    assert cache.ttl_for(now - timedelta(hours=1), now=now) == 86400
+
+
+def test_metrics_fall_back_to_rollups_for_days_without_sketches():
+    """Ranges reaching days before the sketches existed are counted from daily device rollups"""
+    end = datetime(2025, 8, 20, 15, 0, tzinfo=timezone.utc)
+    start = datetime(2025, 8, 18, tzinfo=timezone.utc)
+    # Sketches exist only for the last 3 days: DAU and the period come from them, WAU/MAU from rollups
+    redis = FakeRedis({end.date() - timedelta(days=i): {"a", "b"} for i in range(3)})
+    event_counters = {"events_period": 10, "events_24h": 4, "top_events": []}
+    rollup_devices = {"dau": 99, "wau": 7, "mau": 30, "unique_devices_period": 12}
+
+    async def run():
+        with patch.object(device_sketches, "get_redis", AsyncMock(return_value=redis)), \
+                patch.object(device_sketches, "datetime", MagicMock(now=MagicMock(return_value=end))), \
+                patch.object(stats, "_rollup_event_counters", AsyncMock(return_value=dict(event_counters))), \
+                patch.object(stats, "_rollup_device_counters", AsyncMock(return_value=rollup_devices)) as rollups:
+            response = await stats._compute_metrics(None, start, end, 2, True, exact=False)
+        return response, rollups
+
+    response, rollups = asyncio.run(run())
+
+    assert rollups.await_count == 1
+    assert response["source"] == "rollups+hll"
+    metrics = response["metrics"]
+    assert (metrics["dau"], metrics["unique_devices_period"]) == (2, 2)
+    assert (metrics["wau"], metrics["mau"]) == (7, 30)
+
+
+def test_backfill_fills_missing_sketches_from_rollups():
+    """Missing day sketches are rebuilt from usage_daily_devices; quiet days get empty sketches"""
+    today = date(2025, 8, 20)
+    redis = FakeRedis({today: {"a"}})
+    rollup_rows = {today - timedelta(days=1): ["b", "c"]}
+    queried = []
+
+    class Session:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        async def execute(self, statement, params):
+            queried.append(params["day"])
+            result = MagicMock()
+            result.scalars.return_value.all.return_value = rollup_rows.get(params["day"], [])
+            return result
+
+    async def run():
+        with patch.object(device_sketches, "get_redis", AsyncMock(return_value=redis)), \
+                patch.object(stats_rollup, "async_sessionmaker", Session), \
+                patch.object(stats_rollup.settings, "stats_hll_retention_days", 3):
+            first = await stats_rollup.backfill_device_sketches(today)
+            second = await stats_rollup.backfill_device_sketches(today)
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert first == [today - timedelta(days=2), today - timedelta(days=1)]
+    assert second == []
+    assert queried == first
+    assert redis.sketches[sketch_key(today - timedelta(days=1))] == {"b", "c"}
+    assert redis.sketches[sketch_key(today - timedelta(days=2))] == set()
+    assert redis.sketches[sketch_key(today)] == {"a"}
+
+
+USAGE_ROLLUP_TABLES = [
+    """
+    CREATE TEMP TABLE usage_events (
+        id SERIAL PRIMARY KEY,
+        device_id UUID NOT NULL,
+        event_name VARCHAR(64) NOT NULL,
+        payload JSONB,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TEMP TABLE usage_events_hourly (
+        bucket TIMESTAMPTZ NOT NULL,
+        event_name VARCHAR(64) NOT NULL,
+        events BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket, event_name)
+    )
+    """,
+    """
+    CREATE TEMP TABLE usage_daily_devices (
+        day DATE NOT NULL,
+        device_id UUID NOT NULL,
+        PRIMARY KEY (day, device_id)
+    )
+    """,
+    """
+    CREATE TEMP TABLE rollup_state (
+        name VARCHAR(64) PRIMARY KEY,
+        last_event_id BIGINT NOT NULL DEFAULT 0,
+        pending_event_id BIGINT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+]
+
+
+def test_rollups_match_exact_counters_one_run_behind(postgres_url):
+    """Refreshed rollups give the exact counters; new events wait one run for in-flight writers"""
+    end = datetime(2025, 8, 20, 15, 0, tzinfo=timezone.utc)
+    bounds = _metrics_bounds(datetime(2025, 8, 20, tzinfo=timezone.utc), end, explicit_start=True)
+    devices = {name: uuid.uuid4() for name in "abcde"}
+    events = [
+        ("a", "app_open", end - timedelta(hours=1)),
+        ("a", "conversion", end - timedelta(hours=2)),
+        ("a", "app_open", end - timedelta(hours=2, minutes=30)),
+        ("b", "app_open", end - timedelta(hours=20)),
+        ("c", "app_open", end - timedelta(days=5)),
+        ("d", "conversion", end - timedelta(days=20)),
+        ("e", "app_open", end - timedelta(days=60)),
+    ]
+    late_event = ("b", "conversion", end - timedelta(minutes=10))
+
+    async def scenario():
+        engine = create_async_engine(postgres_url)
+        async with engine.connect() as conn:
+            for ddl in USAGE_ROLLUP_TABLES:
+                await conn.execute(text(ddl))
+
+            async def add_events(rows):
+                await conn.execute(
+                    text("INSERT INTO usage_events (device_id, event_name, created_at) "
+                         "VALUES (:device_id, :event_name, :created_at)"),
+                    [{"device_id": devices[d], "event_name": e, "created_at": t} for d, e, t in rows]
+                )
+                await conn.commit()
+
+            async def counters():
+                db = AsyncSession(bind=conn)
+                rollup = {**await _rollup_event_counters(db, bounds), **await _rollup_device_counters(db, bounds)}
+                exact = await _exact_counters(db, bounds)
+                await conn.commit()
+                return rollup, exact
+
+            await add_events(events)
+            runs = []
+            with patch.object(stats_rollup, "async_sessionmaker", lambda: AsyncSession(bind=conn)), \
+                    patch.object(stats_rollup, "record_devices", AsyncMock()) as record, \
+                    patch.object(stats_rollup, "backfill_device_sketches", AsyncMock(return_value=[])):
+                runs.append(await stats_rollup.refresh_usage_rollups())
+                runs.append(await stats_rollup.refresh_usage_rollups())
+                caught_up = await counters()
+                await add_events([late_event])
+                runs.append(await stats_rollup.refresh_usage_rollups())
+                pending = await counters()
+                runs.append(await stats_rollup.refresh_usage_rollups())
+                final = await counters()
+        await engine.dispose()
+        return runs, caught_up, pending, final, record
+
+    runs, caught_up, pending, final, record = asyncio.run(scenario())
+
+    assert [(run["from_event_id"], run["to_event_id"], run["pending_event_id"]) for run in runs] == [
+        (0, 0, 7), (0, 7, 7), (7, 7, 8), (7, 8, 8),
+    ]
+    for rollup, exact in (caught_up, final):
+        assert {key: rollup[key] for key in exact if key != "top_events"} == \
+            {key: value for key, value in exact.items() if key != "top_events"}
+        assert sorted(rollup["top_events"]) == sorted(exact["top_events"])
+    assert caught_up[0]["events_period"] == 3 and caught_up[0]["dau"] == 1
+    # The late event is already in usage_events but not yet in the rollups
+    assert pending[0] == caught_up[0]
+    assert pending[1]["events_period"] == 4
+    assert final[0]["dau"] == 2 and final[0]["events_24h"] == 5
+    recorded = [call.args[0] for call in record.await_args_list]
+    assert recorded[1][date(2025, 8, 20)] == {str(devices["a"])}
+    assert recorded[1][date(2025, 8, 19)] == {str(devices["b"])}
+    assert recorded[3] == {date(2025, 8, 20): {str(devices["b"])}}